@@ -8,6 +8,7 @@ from datetime import datetime
 # 1. IMPORT TỪ FACTORY VÀ UTILS
 from factory import create_app
 from utils import login_required, get_user_ip, record_activity # [FIX] Import get_user_ip từ utils
+from services.user_cache import bump_credential_version
 
 # 2. KHỞI TẠO APP TỪ NHÀ MÁY
 app = create_app()
@@ -259,6 +260,7 @@ def change_password():
                 update_query = f"UPDATE {config.TEN_BANG_NGUOI_DUNG} SET [PASSWORD] = ? WHERE USERCODE = ?"
                 
                 if app.db_manager.execute_non_query(update_query, (new_password, user_code)):
+                    bump_credential_version(user_code)  # Các phiên khác của user phải đăng nhập lại
                     app.db_manager.write_audit_log(
                         user_code=user_code, 
                         action_type='CHANGE_PASSWORD', 
@@ -293,6 +295,8 @@ def inject_global_vars():
 # =========================================================================
 # MAIN
 # =========================================================================
+# app được tạo ở mức module (server.py / WSGI import 'from app import app'), nên file này KHÔNG
+# khai báo SPAWN_SAFE_MAIN: chạy trực tiếp thì nạp tài liệu trích PDF bằng luồng thay vì process con.
 if __name__ == '__main__':
     print("!!! CẢNH BÁO: ĐANG CHẠY CHẾ ĐỘ DEV. KHÔNG DÙNG CHO PRODUCTION !!!")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,108 @@
+# benchmarks/bench_db_read.py
+# --- MICRO-BENCHMARK: get_data (Pandas) vs FAST READ ENGINE (cursor + fetchmany) ---
+#
+# Chạy từ thư mục app_server:
+#     python benchmarks/bench_db_read.py
+#
+# Dùng SQLite in-memory làm nguồn dữ liệu giả lập (cùng chuẩn DB-API với PyODBC)
+# để so sánh phần xử lý phía Python, không phụ thuộc SQL Server.
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark')  # config.py bắt buộc có key
+
+import pandas as pd
+from db_manager import fetch_records, fetch_columns
+
+warnings.simplefilter('ignore')  # Ẩn cảnh báo deprecate của Pandas khi đo
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+REPEAT = 3
+
+QUERY = """
+    SELECT InventoryID, InventoryName, StockClass, TotalCurrentQuantity,
+           TotalCurrentValue, Range_0_180_V, Range_Over_720_V
+    FROM Aging
+"""
+
+def build_source(n_rows):
+    """Tạo bảng giả lập giống result set của sp_GetInventoryAging_Detail_Cache."""
+    rnd = random.Random(42)
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""
+        CREATE TABLE Aging (
+            InventoryID TEXT, InventoryName TEXT, StockClass TEXT,
+            TotalCurrentQuantity REAL, TotalCurrentValue REAL,
+            Range_0_180_V REAL, Range_Over_720_V REAL
+        )
+    """)
+    rows = [
+        (
+            f"VT{i:07d}  ",
+            f"  Vòng bi SKF 62{i % 100:02d}-2RS ",
+            rnd.choice(['A ', 'B', ' C', 'D', None]),
+            rnd.randint(0, 500),
+            rnd.random() * 1e8,
+            rnd.random() * 1e7,
+            rnd.random() * 1e7 if i % 3 else None,
+        )
+        for i in range(n_rows)
+    ]
+    conn.executemany("INSERT INTO Aging VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+def pandas_path(conn):
+    """Bản sao logic DBManager.get_data hiện tại."""
+    df = pd.read_sql(QUERY, conn)
+    for col in df.select_dtypes(include=['object']).columns:
+        def clean_cell(x):
+            if x is None: return ''
+            if isinstance(x, bytes):
+                return x.decode('utf-8', errors='ignore')
+            return str(x).strip()
+        df[col] = df[col].apply(clean_cell)
+    return df.to_dict('records')
+
+def fast_path(conn):
+    cursor = conn.cursor()
+    cursor.execute(QUERY)
+    return fetch_records(cursor)
+
+def columnar_path(conn):
+    cursor = conn.cursor()
+    cursor.execute(QUERY)
+    return fetch_columns(cursor, as_numpy=True)
+
+def best_of(fn, conn):
+    best = float('inf')
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn(conn)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+if __name__ == '__main__':
+    print(f"{'Rows':>8} | {'pandas (ms)':>12} | {'fast (ms)':>10} | {'columnar (ms)':>13} | {'speedup':>7}")
+    print('-' * 64)
+    for n in ROW_COUNTS:
+        conn = build_source(n)
+
+        # Kiểm tra cùng kết quả trước khi đo
+        old = pandas_path(conn)
+        new = fast_path(conn)
+        assert len(old) == len(new)
+        assert old[0]['InventoryID'] == new[0]['InventoryID']
+        assert old[0]['InventoryName'] == new[0]['InventoryName']
+
+        t_pd = best_of(pandas_path, conn)
+        t_fast = best_of(fast_path, conn)
+        t_col = best_of(columnar_path, conn)
+        print(f"{n:>8} | {t_pd:>12.1f} | {t_fast:>10.1f} | {t_col:>13.1f} | {t_pd / t_fast:>6.1f}x")
+        conn.close()
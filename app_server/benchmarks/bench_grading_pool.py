@@ -0,0 +1,55 @@
+# benchmarks/bench_grading_pool.py
+# --- BENCHMARK: CHẤM DAILY CHALLENGE TUẦN TỰ vs POOL ---
+#
+# Chạy từ thư mục app_server:
+#     python benchmarks/bench_grading_pool.py
+#
+# Không gọi Gemini, không cần SQL: grader giả ngủ 0.2-1.0s / bài (mô phỏng độ trễ LLM,
+# thu nhỏ 5 lần) và lỗi tạm thời ~10% để đi qua nhánh thử lại. Hàm ghi chỉ đếm.
+# So sánh workers=1 (tương đương vòng for cũ) với GRADING_WORKERS.
+
+import os
+import sys
+import random
+import threading
+import logging
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.grading_pool import GradingPipeline, GRADING_WORKERS
+
+logging.getLogger("services.grading_pool").setLevel(logging.ERROR)  # Bỏ log thử lại cho gọn
+
+ITEMS = 40
+FAIL_RATE = 0.10
+
+def make_grader(seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def grade(item):
+        with lock:
+            latency = rng.uniform(0.2, 1.0)
+            fail = rng.random() < FAIL_RATE
+        time.sleep(latency)
+        if fail:
+            raise TimeoutError("LLM timeout (giả lập)")
+        return {'sid': item, 'score': 70}
+    return grade
+
+def run(workers):
+    written = []
+    pipeline = GradingPipeline(make_grader(20), lambda rows: written.extend(rows) or len(rows),
+                               workers=workers, backoff=0.05)
+    report = pipeline.run(list(range(ITEMS)))
+    assert report['written'] == len(written) == report['graded']
+    assert report['graded'] + report['failed'] == ITEMS
+    return report
+
+if __name__ == '__main__':
+    for workers in (1, GRADING_WORKERS):
+        r = run(workers)
+        print(f"workers={workers}: {r['graded']}/{r['total']} bài trong {r['elapsed_s']}s "
+              f"({r['per_second']} bài/s) | LLM p50 {r['llm_p50_ms']} ms, p95 {r['llm_p95_ms']} ms | "
+              f"thử lại {r['retries']}, lỗi {r['failed']}")
@@ -0,0 +1,84 @@
+# benchmarks/bench_kpi_scoring.py
+# --- BENCHMARK: calculate_bucket_score TỪNG DÒNG vs score_buckets (NumPy) ---
+#
+# Chạy từ thư mục app_server:
+#     python benchmarks/bench_kpi_scoring.py
+#
+# 1. Đối chiếu ngẫu nhiên (nhiều vòng, nhiều kiểu dữ liệu khó: trùng ngưỡng, ngưỡng
+#    đảo thứ tự, ngưỡng bằng nhau, NaN, ±inf, số rất lớn/nhỏ): raw và weighted phải
+#    bằng bản vô hướng TỪNG BIT.
+# 2. Đo thời gian chấm 100k cặp (user, tiêu chí).
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark')
+
+import numpy as np
+from services.kpi_service import KPIService
+from services.kpi_scoring import score_buckets
+
+PAIRS = 100_000
+PARITY_ROUNDS = 200
+PARITY_SIZE = 500
+
+def random_case(rng, n):
+    """Sinh (actuals, thresholds (n,6), is_higher_better, weights) có nhiều ca biên."""
+    kind = rng.integers(0, 4)
+    if kind == 0:   # Ngưỡng đúng thứ tự, thực tế quanh ngưỡng
+        base = np.sort(rng.uniform(0, 200, (n, 6)), axis=1)
+        thresholds = np.where(rng.random((n, 1)) < 0.5, base[:, ::-1], base)
+    elif kind == 1: # Ngưỡng lộn xộn / bằng nhau
+        thresholds = rng.integers(0, 5, (n, 6)).astype(np.float64) * 25
+    elif kind == 2: # Số lớn (doanh số VNĐ) và số rất nhỏ
+        thresholds = rng.choice([0.0, 1e-9, -1e-9, 1e9, 1e12, -5.0], (n, 6))
+    else:           # Ngưỡng ngẫu nhiên hoàn toàn
+        thresholds = rng.normal(50, 40, (n, 6))
+
+    # Thực tế: 1/3 trùng đúng 1 ngưỡng (ca >= / <= bằng nhau), còn lại ngẫu nhiên + vài giá trị đặc biệt
+    actuals = rng.normal(60, 60, n)
+    hit = rng.random(n) < 0.33
+    actuals[hit] = thresholds[hit, rng.integers(0, 6, hit.sum())]
+    special = rng.random(n) < 0.02
+    actuals[special] = rng.choice([np.nan, np.inf, -np.inf, 0.0], special.sum())
+
+    is_higher_better = rng.random(n) < 0.5
+    weights = rng.choice([0.0, 0.05, 0.1, 0.15, 0.2, 0.3, 1 / 3], n)
+    return actuals, thresholds, is_higher_better, weights
+
+def scalar_scores(service, actuals, thresholds, is_higher_better, weights):
+    raw, weighted = [], []
+    for a, t, h, w in zip(actuals.tolist(), thresholds.tolist(), is_higher_better.tolist(), weights.tolist()):
+        r = service.calculate_bucket_score(a, h, *t)
+        raw.append(r)
+        weighted.append(r * w)
+    return raw, weighted
+
+def check_parity(service, rng):
+    for _ in range(PARITY_ROUNDS):
+        case = random_case(rng, PARITY_SIZE)
+        raw_s, weighted_s = scalar_scores(service, *case)
+        raw_v, weighted_v = score_buckets(*case)
+        assert raw_v.tolist() == raw_s, "raw score lệch bản vô hướng"
+        # So từng bit (tránh NaN != NaN và -0.0 == 0.0 che lỗi)
+        assert np.array_equal(np.array(weighted_s, dtype=np.float64).view(np.int64), weighted_v.view(np.int64)), \
+            "weighted score lệch bản vô hướng"
+    print(f"Parity OK: {PARITY_ROUNDS * PARITY_SIZE:,} cặp ngẫu nhiên khớp từng bit")
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(18)
+    service = KPIService(db_manager=None)
+    check_parity(service, rng)
+
+    case = random_case(rng, PAIRS)
+    t0 = time.perf_counter()
+    scalar_scores(service, *case)
+    t_scalar = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    score_buckets(*case)
+    t_vector = (time.perf_counter() - t0) * 1000
+
+    print(f"{PAIRS:,} cặp (user, tiêu chí): vô hướng {t_scalar:.1f} ms | vector {t_vector:.1f} ms | {t_scalar / t_vector:.0f}x")
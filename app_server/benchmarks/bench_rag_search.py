@@ -0,0 +1,80 @@
+# benchmarks/bench_rag_search.py
+# --- BENCHMARK: VÒNG LẶP COSINE CŨ vs VectorIndex (matmul + argpartition) ---
+#
+# Chạy từ thư mục app_server:
+#     python benchmarks/bench_rag_search.py
+#
+# Sinh ngẫu nhiên N chunk embedding, so sánh thời gian tìm top-k của vòng lặp
+# Python cũ (GLOBAL_VECTOR_CACHE dạng list) với VectorIndex.search.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('APP_SECRET_KEY', 'benchmark')
+
+import numpy as np
+from services.rag_memory_service import VectorIndex, SIMILARITY_THRESHOLD
+
+CHUNK_COUNTS = [1_000, 10_000, 100_000]
+DIM = 768          # gemini-embedding-001 hỗ trợ output_dimensionality 768/1536/3072
+TOP_K = 3
+QUERIES = 5
+
+def build_rows(n, rng):
+    base = rng.standard_normal((n, DIM)).astype(np.float32)
+    return base, [
+        {'MaterialID': i % 50, 'ChunkText': f"chunk {i}",
+         'FileName': f"doc_{i % 50}.pdf", 'PageIndex': i % 30}
+        for i in range(n)
+    ]
+
+def legacy_cache(vectors, rows):
+    """Cấu trúc GLOBAL_VECTOR_CACHE cũ: list dict, mỗi chunk 1 vector + norm."""
+    return [
+        {'text': r['ChunkText'], 'vector': v, 'norm': np.linalg.norm(v),
+         'file_name': r['FileName'], 'page': r['PageIndex']}
+        for v, r in zip(vectors, rows)
+    ]
+
+def legacy_search(cache, query_vector, top_k=TOP_K):
+    """Bản sao vòng lặp search_vector_database cũ."""
+    query_norm = np.linalg.norm(query_vector)
+    results = []
+    for item in cache:
+        if item['norm'] == 0: continue
+        sim = np.dot(query_vector, item['vector']) / (query_norm * item['norm'])
+        if sim > SIMILARITY_THRESHOLD:
+            results.append({'similarity': sim, 'text': item['text'], 'file_name': item['file_name'], 'page': item['page']})
+    results.sort(key=lambda x: x['similarity'], reverse=True)
+    return results[:top_k]
+
+def timed(fn, queries):
+    t0 = time.perf_counter()
+    out = [fn(q) for q in queries]
+    return (time.perf_counter() - t0) * 1000 / len(queries), out
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(7)
+    print(f"{'Chunks':>8} | {'legacy (ms/query)':>17} | {'index (ms/query)':>16} | {'speedup':>8}")
+    print('-' * 60)
+    for n in CHUNK_COUNTS:
+        vectors, rows = build_rows(n, rng)
+        index = VectorIndex.build(
+            vectors, [r['ChunkText'] for r in rows], [r['FileName'] for r in rows],
+            [r['PageIndex'] for r in rows], [r['MaterialID'] for r in rows]
+        )
+        cache = legacy_cache(vectors, rows)
+
+        # Query = chunk có sẵn + nhiễu nhỏ -> chắc chắn có kết quả vượt ngưỡng
+        queries = [vectors[i] + 0.1 * rng.standard_normal(DIM).astype(np.float32)
+                   for i in rng.integers(0, n, QUERIES)]
+
+        t_old, old_res = timed(lambda q: legacy_search(cache, q), queries)
+        t_new, new_res = timed(lambda q: index.search(q, top_k=TOP_K), queries)
+
+        for a, b in zip(old_res, new_res):
+            assert [x['text'] for x in a] == [x['text'] for x in b], "Kết quả top-k lệch nhau"
+
+        print(f"{n:>8} | {t_old:>17.2f} | {t_new:>16.2f} | {t_old / t_new:>7.0f}x")
@@ -7,10 +7,15 @@ from datetime import datetime, timedelta
 from db_manager import safe_float 
 from operator import itemgetter 
 import config 
+from services.swr_cache import get_or_compute
 
 # Khởi tạo Blueprint (Không cần url_prefix vì các route này là routes cấp cao)
 kpi_bp = Blueprint('kpi_bp', __name__)
 
+# Thời gian cache Dashboard (giây): tươi / được phục vụ bản cũ thêm
+SALES_DASHBOARD_TTL, SALES_DASHBOARD_STALE_TTL = 21600, 3600
+REALTIME_TTL, REALTIME_STALE_TTL = 18600, 1800
+
 # [HÀM HELPER CẦN THIẾT]
 def get_user_ip():
     """Lấy địa chỉ IP của người dùng."""
@@ -37,49 +42,15 @@ def make_dashboard_cache_key():
         date_to = request.args.get('date_to', 'def_to')
         salesman = request.args.get('salesman_id', 'all')
         
+    return sales_dashboard_cache_key(user_code, date_from, date_to, salesman)
+
+def sales_dashboard_cache_key(user_code, date_from='def_from', date_to='def_to', salesman='all'):
     # Key ví dụ: sales_dash_KD010_2025-01-01_2025-01-31_all
     return f"sales_dash_{user_code}_{date_from}_{date_to}_{salesman}"
 
-@kpi_bp.route('/sales_dashboard', methods=['GET', 'POST'])
-@login_required
-@permission_required('VIEW_SALES_DASHBOARD') # Áp dụng quyền mới
-def sales_dashboard():
-    """ROUTE: Bảng Tổng hợp Hiệu suất Sales (ĐÃ CÓ CACHE)"""
-    
-    # 1. TẠO KEY VÀ KIỂM TRA CACHE
-    # Chỉ cache khi request là GET (xem mặc định) hoặc POST (Lọc).
-    # Tuy nhiên, cẩn thận với Flash message, cache HTML sẽ lưu luôn flash message cũ.
-    # Giải pháp an toàn nhất cho Dashboard nặng: Cache DỮ LIỆU TÍNH TOÁN, không cache HTML.
-    
-    cache_key = make_dashboard_cache_key()
-    
-    # Thử lấy dữ liệu đã tính toán từ Redis
-    # current_app.cache được lấy từ factory đã setup
-    cached_data = current_app.cache.get(cache_key)
-    
-    if cached_data:
-        # HIT CACHE: Có dữ liệu rồi -> Render ngay lập tức
-        current_app.logger.info(f"CACHE HIT: {cache_key}")
-        # Giải nén dữ liệu từ cache và return template
-        return render_template('sales_dashboard.html', **cached_data)
-
-    # =========================================================
-    # MISS CACHE: Nếu không có cache, chạy logic tính toán cũ
-    # =========================================================
-    
+def build_sales_dashboard_context(current_year, user_code, is_admin, user_division):
+    """Tính toàn bộ dữ liệu Dashboard Sales (không phụ thuộc request -> chạy được ở luồng nền)."""
     sales_service = current_app.sales_service
-    db_manager = current_app.db_manager
-    
-    current_year = datetime.now().year
-    
-    user_role = session.get('user_role', '').strip().upper()
-    is_admin = (user_role == config.ROLE_ADMIN) 
-    user_code = session.get('user_code')
-    user_division = session.get('division')
-
-    if not user_code:
-        flash("Lỗi phiên đăng nhập: Không tìm thấy mã nhân viên.", 'danger')
-        return redirect(url_for('login'))
 
     # 1. Lấy dữ liệu
     summary_data = sales_service.get_sales_performance_data(
@@ -116,12 +87,8 @@ def sales_dashboard():
         'PendingOrdersAmount': total_pending_orders_amount_raw
     }
 
-    # =========================================================
-    # LƯU VÀO CACHE TRƯỚC KHI TRẢ VỀ
-    # =========================================================
-    
     # Đóng gói toàn bộ biến cần thiết cho template vào 1 dictionary
-    render_context = {
+    return {
         'summary': summary_data,
         'current_year': current_year,
         'kpi_summary': kpi_summary,
@@ -131,9 +98,32 @@ def sales_dashboard():
         'total_orders': total_orders_raw,
         'total_pending_orders_amount': total_pending_orders_amount_raw
     }
+
+@kpi_bp.route('/sales_dashboard', methods=['GET', 'POST'])
+@login_required
+@permission_required('VIEW_SALES_DASHBOARD') # Áp dụng quyền mới
+def sales_dashboard():
+    """ROUTE: Bảng Tổng hợp Hiệu suất Sales (ĐÃ CÓ CACHE)"""
     
-    # Lưu vào Redis trong 6 tiếng
-    current_app.cache.set(cache_key, render_context, timeout=21600)
+    # Giải pháp an toàn nhất cho Dashboard nặng: Cache DỮ LIỆU TÍNH TOÁN, không cache HTML.
+    db_manager = current_app.db_manager
+    
+    current_year = datetime.now().year
+    
+    user_role = session.get('user_role', '').strip().upper()
+    is_admin = (user_role == config.ROLE_ADMIN) 
+    user_code = session.get('user_code')
+    user_division = session.get('division')
+
+    if not user_code:
+        flash("Lỗi phiên đăng nhập: Không tìm thấy mã nhân viên.", 'danger')
+        return redirect(url_for('login'))
+
+    # Tươi 6 tiếng; hết hạn vẫn trả bản cũ thêm 1 tiếng trong lúc 1 worker làm mới ở nền
+    render_context = get_or_compute(
+        make_dashboard_cache_key(), build_sales_dashboard_context,
+        (current_year, user_code, is_admin, user_division), ttl=SALES_DASHBOARD_TTL, stale_ttl=SALES_DASHBOARD_STALE_TTL
+    )
 
     # 4. Ghi Log
     try:
@@ -210,53 +200,16 @@ def make_realtime_cache_key():
         # Nếu GET (mặc định vào trang), filter có thể rỗng
         salesman_filter = request.args.get('salesman_filter', 'all')
         
-    # Key ví dụ: realtime_KD010_all_2025
-    return f"realtime_{user_code}_{salesman_filter}_{datetime.now().year}"
+    return realtime_cache_key(user_code, salesman_filter, datetime.now().year)
 
-@kpi_bp.route('/realtime_dashboard', methods=['GET', 'POST'])
-@login_required
-@permission_required('VIEW_REALTIME_KPI') # Áp dụng quyền mới
-def realtime_dashboard():
-    """ROUTE: Dashboard KPI Bán hàng Thời gian thực (CACHE 60s)."""
-    
-    # =========================================================
-    # 1. KIỂM TRA CACHE
-    # =========================================================
-    cache_key = make_realtime_cache_key()
-    
-    # Thử lấy dữ liệu từ Redis
-    cached_data = current_app.cache.get(cache_key)
-    
-    if cached_data:
-        # HIT CACHE: Có dữ liệu -> Render ngay (Siêu nhanh)
-        # Vì là realtime nên log mức debug hoặc info tùy bạn
-        # current_app.logger.info(f"REALTIME CACHE HIT: {cache_key}")
-        return render_template('realtime_dashboard.html', **cached_data)
+def realtime_cache_key(user_code, salesman_filter, year):
+    # Key ví dụ: realtime_KD010_all_2025
+    return f"realtime_{user_code}_{salesman_filter}_{year}"
 
-    # =========================================================
-    # 2. MISS CACHE: TÍNH TOÁN DỮ LIỆU (LOGIC CŨ)
-    # =========================================================
-    
+def build_realtime_context(user_code, user_division, is_admin, selected_salesman, current_year):
+    """Tính dữ liệu Dashboard Realtime (không phụ thuộc request -> chạy được ở luồng nền)."""
     db_manager = current_app.db_manager 
 
-    current_year = datetime.now().year
-    user_division = session.get('division')
-    user_code = session.get('user_code')
-    user_role = session.get('user_role', '').strip().upper()
-    is_admin = user_role == config.ROLE_ADMIN
-    
-    selected_salesman = None
-    
-    # Logic Lọc (POST/GET)
-    if is_admin:
-        if request.method == 'POST':
-            filter_value = request.form.get('salesman_filter')
-            selected_salesman = filter_value.strip() if filter_value and filter_value.strip() != '' else None
-        else:
-            selected_salesman = None
-    else:
-        selected_salesman = user_code
-        
     users_data = []
     if is_admin:
         query_users = f"""
@@ -281,8 +234,9 @@ def realtime_dashboard():
     # Gọi SP (Nặng)
     all_results = db_manager.execute_sp_multi(config.SP_GET_REALTIME_KPI, sp_params)
 
-    if not all_results or len(all_results) < 5:
-        flash("Lỗi dữ liệu: SP không trả về đủ 5 bảng kết quả.", 'warning')
+    sp_incomplete = not all_results or len(all_results) < 5
+    if sp_incomplete:
+        current_app.logger.warning("Realtime KPI: SP không trả về đủ 5 bảng kết quả.")
         kpi_summary = {}
         pending_orders = []
         top_orders = []
@@ -313,12 +267,8 @@ def realtime_dashboard():
     except Exception as e:
         current_app.logger.error(f"Lỗi đồng bộ Backlog Realtime: {e}")
 
-    # =========================================================
-    # 3. LƯU CACHE VÀ RETURN
-    # =========================================================
-    
     # Đóng gói dữ liệu vào Dictionary context
-    render_context = {
+    return {
         'kpi_summary': kpi_summary,
         'pending_orders': pending_orders,
         'top_orders': top_orders,
@@ -328,11 +278,41 @@ def realtime_dashboard():
         'selected_salesman': selected_salesman,
         'salesman_name': salesman_name,
         'current_year': current_year,
-        'is_admin': is_admin
+        'is_admin': is_admin,
+        'sp_incomplete': sp_incomplete  # SP trả thiếu bảng (khác với bảng tổng hợp rỗng hợp lệ)
     }
+
+@kpi_bp.route('/realtime_dashboard', methods=['GET', 'POST'])
+@login_required
+@permission_required('VIEW_REALTIME_KPI') # Áp dụng quyền mới
+def realtime_dashboard():
+    """ROUTE: Dashboard KPI Bán hàng Thời gian thực (CACHE SWR)."""
+    current_year = datetime.now().year
+    user_division = session.get('division')
+    user_code = session.get('user_code')
+    user_role = session.get('user_role', '').strip().upper()
+    is_admin = user_role == config.ROLE_ADMIN
     
-    # Lưu Cache trong 6 tiếng (Vì là Realtime nên time ngắn)
-    current_app.cache.set(cache_key, render_context, timeout=18600)
+    selected_salesman = None
+    
+    # Logic Lọc (POST/GET)
+    if is_admin:
+        if request.method == 'POST':
+            filter_value = request.form.get('salesman_filter')
+            selected_salesman = filter_value.strip() if filter_value and filter_value.strip() != '' else None
+        else:
+            selected_salesman = None
+    else:
+        selected_salesman = user_code
+
+    # Single-flight: key hết hạn thì chỉ 1 worker gọi SP_GET_REALTIME_KPI, các worker khác chờ / dùng bản cũ
+    render_context = get_or_compute(
+        make_realtime_cache_key(), build_realtime_context,
+        (user_code, user_division, is_admin, selected_salesman, current_year), ttl=REALTIME_TTL, stale_ttl=REALTIME_STALE_TTL
+    )
+
+    if render_context.get('sp_incomplete'):
+        flash("Lỗi dữ liệu: SP không trả về đủ 5 bảng kết quả.", 'warning')
     
     return render_template('realtime_dashboard.html', **render_context)
 
@@ -119,6 +119,55 @@ def evaluate_kpi():
 
     return jsonify(result)
 
+@kpi_evaluation_bp.route('/api/evaluate_bulk', methods=['POST'])
+@login_required
+def evaluate_kpi_bulk():
+    """Chốt KPI tháng cho cả phòng ban (department) hoặc toàn công ty (bỏ trống) - chỉ Admin."""
+    user_role = str(session.get('user_role', '')).strip().upper()
+    if user_role != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Chỉ Admin được chốt KPI hàng loạt.'}), 403
+
+    data = request.json or {}
+    year = data.get('year')
+    month = data.get('month')
+    if not all([year, month]):
+        return jsonify({'success': False, 'message': 'Thiếu tham số bắt buộc.'}), 400
+
+    result = current_app.kpi_service.evaluate_monthly_kpi_bulk(
+        int(year), int(month), user_codes=data.get('user_codes') or None, department=data.get('department') or None
+    )
+
+    if result.get('success'):
+        scope = data.get('department') or 'Toàn công ty'
+        current_app.db_manager.write_audit_log(
+            session.get('user_code'), 'KPI_CALC', 'INFO',
+            f"Chốt KPI hàng loạt {scope} (Tháng {month}/{year}): {len(result['scores'])} người, lỗi ERP {len(result['failed'])}",
+            get_user_ip()
+        )
+    return jsonify(result)
+
+@kpi_evaluation_bp.route('/api/simulate', methods=['POST'])
+@login_required
+def simulate_kpi():
+    """What-if: chấm lại KPI với ngưỡng/trọng số đề xuất, không ghi DB (dùng snapshot số liệu ERP)."""
+    user_code = session.get('user_code')
+    is_admin = str(session.get('user_role', '')).strip().upper() == 'ADMIN'
+
+    data = request.json or {}
+    target_user = data.get('user_code') or user_code
+    year = data.get('year')
+    month = data.get('month')
+    if not all([year, month]):
+        return jsonify({'success': False, 'message': 'Thiếu tham số bắt buộc.'}), 400
+    if not is_admin and target_user != user_code:
+        target_user = user_code
+
+    result = current_app.kpi_service.simulate_kpi(
+        target_user, int(year), int(month),
+        overrides=data.get('overrides') or {}, force_refresh=bool(data.get('refresh'))
+    )
+    return jsonify(result)
+
 # --- TRONG FILE blueprints/kpi_evaluation_bp.py ---
 
 @kpi_evaluation_bp.route('/manual-scoring', methods=['GET'])
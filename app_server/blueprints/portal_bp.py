@@ -5,70 +5,44 @@ from utils import login_required, permission_required, get_user_ip, record_activ
 
 portal_bp = Blueprint('portal_bp', __name__)
 
-# ---------------------------------------------------------
-# [NEW] HÀM TẠO KEY CACHE CHO PORTAL
-# ---------------------------------------------------------
-def make_portal_cache_key():
-    """Key cache phụ thuộc vào User đang đăng nhập"""
-    user_code = session.get('user_code', 'anon')
-    # Key ví dụ: portal_data_KD010
-    return f"portal_data_{user_code}"
-
 @portal_bp.route('/portal')
 def portal_dashboard():
     # Kiểm tra đăng nhập (Giữ nguyên logic của bạn)
     if not session.get('logged_in'):
         return redirect(url_for('login'))
     
-    # 1. KIỂM TRA CACHE
-    cache_key = make_portal_cache_key()
-    
-    # Thử lấy dữ liệu Dashboard từ Redis
-    # Lưu ý: Chỉ cache cục dữ liệu nặng (dashboard_data), không cache session hay datetime
-    dashboard_data = current_app.cache.get(cache_key)
-    
-    # 2. MISS CACHE: TÍNH TOÁN DỮ LIỆU TỪ SQL
-    if not dashboard_data:
-        # current_app.logger.info(f"PORTAL CACHE MISS: {cache_key}")
-        
-        portal_service = current_app.portal_service
+    portal_service = current_app.portal_service
+    user_code = session.get('user_code')
+    bo_phan = session.get('bo_phan', '').strip().upper()
 
-        user_code = session.get('user_code')
-        bo_phan = session.get('bo_phan', '').strip().upper()
-        role = session.get('user_role', '').strip().upper()
-        
-        try:
-            # Gọi Service (Query nặng)
-            dashboard_data = portal_service.get_all_dashboard_data(user_code, bo_phan, role)
-            
-            # Lưu vào Redis trong 3 tiếng (10800 giây)
-            if dashboard_data:
-                current_app.cache.set(cache_key, dashboard_data, timeout=10800)
-                
-        except Exception as e:
-            current_app.logger.error(f"Lỗi tải dữ liệu Portal: {e}")
-            dashboard_data = {} # Trả về rỗng để không crash trang
+    # Mỗi khối (doanh số, task, công nợ...) tự cache với TTL riêng và tải song song khi MISS
+    # Lưu ý: Chỉ cache dữ liệu nặng (dashboard_data), không cache session hay datetime
+    try:
+        dashboard_data = portal_service.get_all_dashboard_data(user_code, bo_phan) or {}
+    except Exception as e:
+        current_app.logger.error(f"Lỗi tải dữ liệu Portal: {e}")
+        dashboard_data = {} # Trả về rỗng để không crash trang
 
-    # 3. RENDER TEMPLATE
     # [QUAN TRỌNG NHẤT]: Truyền thẳng object dashboard_data sang HTML
     return render_template(
         'portal_dashboard.html',
         user=session,                                   # Luôn lấy session hiện tại
         now_date=datetime.now().strftime('%d/%m/%Y'),   # Luôn lấy giờ hiện tại
-        dashboard_data=dashboard_data                   # <-- ĐÃ SỬA GỌN GÀNG TẠI ĐÂY
+        dashboard_data=dashboard_data
     )
 
 # ---------------------------------------------------------
-# [NEW] ROUTE LÀM MỚI DỮ LIỆU (XÓA CACHE)
-# Gọi link này khi user bấm nút "Làm mới" trên giao diện
+# ROUTE LÀM MỚI DỮ LIỆU (XÓA CACHE)
+# /portal/refresh                      -> làm mới mọi khối của user
+# /portal/refresh?section=sales_kpi    -> chỉ làm mới khối doanh số (có thể lặp nhiều section)
 # ---------------------------------------------------------
 @portal_bp.route('/portal/refresh')
 def refresh_portal():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-        
-    cache_key = make_portal_cache_key()
-    current_app.cache.delete(cache_key)
+
+    sections = request.args.getlist('section') or None
+    current_app.portal_service.invalidate_sections(session.get('user_code'), sections)
     
     flash("Đã cập nhật dữ liệu mới nhất.", "success")
     return redirect(url_for('portal_bp.portal_dashboard'))
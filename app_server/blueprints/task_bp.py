@@ -1,10 +1,15 @@
 from flask import current_app
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app, Response, stream_with_context
 # FIX: Chỉ import login_required từ utils.py
 from utils import login_required, permission_required # Import thêm
 from datetime import datetime
 from db_manager import safe_float # Cần cho format/validation
+from services.task_events import get_event_hub, event_visible_to, STREAM_ENVIRON_KEY
 import config 
+import queue
+import json
+import time
+from urllib.parse import urlsplit
 task_bp = Blueprint('task_bp', __name__)
 
 # [HÀM HELPER CẦN THIẾT]
@@ -385,3 +390,56 @@ def api_task_recent_updates():
         current_app.logger.error(f"LỖI API GET RECENT UPDATES: {e}")
         return jsonify({'error': 'Lỗi khi tải cập nhật gần nhất.'}), 500
 
+STREAM_HEARTBEAT = 25  # giây: comment giữ kết nối (proxy/IIS cắt kết nối im lặng) + phát hiện client đã đóng
+
+@task_bp.route('/api/task/stream', methods=['GET'])
+@login_required
+def api_task_stream():
+    """
+    SSE: đẩy event thay đổi Task theo phạm vi của user (thay polling recent_updates).
+    Chỉ phục vụ qua server SSE riêng (task_events.serve_task_stream, cổng TASK_STREAM_PORT):
+    gọi vào server chính -> 503, không để kết nối mở lâu giữ luồng waitress chính.
+    """
+    hub = get_event_hub()
+    # Sai server / không có Redis / hết suất kết nối -> 503, JS poll tạm rồi thử mở lại sau
+    if (not request.environ.get(STREAM_ENVIRON_KEY) or not hub
+            or hub.client_count() >= config.TASK_STREAM_MAX_CLIENTS):
+        return _stream_cors(jsonify({'error': 'Kênh realtime không khả dụng.'})), 503
+
+    user_code = session.get('user_code')
+    is_admin = session.get('user_role', '').strip().upper() == config.ROLE_ADMIN
+    view_mode = request.args.get('view', 'USER').upper()
+    client_queue = hub.subscribe()
+
+    def generate():
+        close_at = time.monotonic() + config.TASK_STREAM_MAX_LIFETIME
+        try:
+            yield "retry: 10000\n\n"
+            while True:
+                remaining = close_at - time.monotonic()
+                if remaining <= 0:
+                    return  # Trả luồng waitress; EventSource tự kết nối lại sau 'retry'
+                try:
+                    event = client_queue.get(timeout=min(STREAM_HEARTBEAT, remaining))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if event_visible_to(event, user_code, is_admin, view_mode):
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            hub.unsubscribe(client_queue)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return _stream_cors(response)
+
+def _stream_cors(response):
+    """Trang (cổng chính) mở SSE sang cổng TASK_STREAM_PORT: cho phép origin cùng hostname, kèm cookie session."""
+    origin = request.headers.get('Origin', '')
+    if origin and urlsplit(origin).hostname == request.host.split(':')[0]:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Vary'] = 'Origin'
+    return response
+
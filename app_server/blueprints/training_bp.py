@@ -66,6 +66,31 @@ def api_library_chat():
     res = current_app.training_service.chat_with_document(material_id, question)
     return jsonify(res)
 
+@training_bp.route('/api/library/ingest', methods=['POST'])
+@login_required
+def api_library_ingest():
+    """Xếp hàng xử lý (lại) 1 tài liệu: trích text -> chunk -> embed -> ghi chunk RAG. Trả về ngay - chỉ Admin."""
+    user_role = str(session.get('user_role', '')).strip().upper()
+    if user_role != 'ADMIN':
+        return jsonify({'success': False, 'message': 'Chỉ Admin được nạp lại tài liệu.'}), 403
+
+    data = request.json or {}
+    material_id = data.get('material_id')
+    if not material_id:
+        return jsonify({'success': False, 'message': 'Thiếu material_id.'}), 400
+
+    progress = current_app.ingestion_service.enqueue(material_id, force=bool(data.get('force')))
+    return jsonify({'success': True, 'progress': progress}), 202
+
+@training_bp.route('/api/library/ingest/<int:material_id>', methods=['GET'])
+@login_required
+def api_library_ingest_status(material_id):
+    """Tiến độ nạp tài liệu: stage (extract/chunk/embed/write/done), done/total, status, error."""
+    progress = current_app.ingestion_service.get_progress(material_id)
+    if not progress:
+        return jsonify({'success': False, 'message': 'Chưa có job nạp cho tài liệu này.'}), 404
+    return jsonify({'success': True, 'progress': progress})
+
 @training_bp.route('/api/training/progress', methods=['POST'])
 @login_required
 def api_update_progress():
@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, jsonify, session, redirec
 from utils import login_required, permission_required, record_activity, get_user_ip # Thêm record_activity, get_user_ip
 import config
 import pandas as pd # <--- [THÊM] Import thư viện này để xử lý lỗi ngày tháng
-from datetime import datetime, date
+from datetime import datetime
+from services.user_cache import invalidate_user_cache
 
 
 user_bp = Blueprint('user_bp', __name__)
@@ -283,6 +284,7 @@ def claim_mail():
         cursor.execute("UPDATE TitanOS_Game_Mailbox SET IsClaimed=1, ClaimedTime=GETDATE() WHERE MailID=?", (mail_id,))
         
         conn.commit()
+        invalidate_user_cache(user_code)  # Level/XP/Coins đã đổi
 
         # --- GHI LOG NHẬN THƯỚNG ---
         ip = get_user_ip()
@@ -329,19 +331,9 @@ def audit_logs_dashboard():
     if session.get('user_role', '').strip().upper() != config.ROLE_ADMIN:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    db = current_app.db_manager
-    today = date.today().strftime('%Y-%m-%d')
-    
-    # 1. Lấy 4 chỉ số KPI tổng quan trong ngày (SỬA CreatedAt -> [Timestamp])
-    stats = {}
+    # 1. Lấy 4 chỉ số KPI tổng quan trong ngày (1 câu aggregate / bảng tổng hợp theo ngày)
     try:
-        stats['total_today'] = db.get_data("SELECT COUNT(1) as Cnt FROM dbo.AUDIT_LOGS WHERE CAST([Timestamp] AS DATE) = ?", (today,))[0]['Cnt']
-        
-        stats['alerts'] = db.get_data("SELECT COUNT(1) as Cnt FROM dbo.AUDIT_LOGS WHERE CAST([Timestamp] AS DATE) = ? AND Severity IN ('WARNING', 'CRITICAL')", (today,))[0]['Cnt']
-        
-        stats['failed_logins'] = db.get_data("SELECT COUNT(1) as Cnt FROM dbo.AUDIT_LOGS WHERE CAST([Timestamp] AS DATE) = ? AND ActionType = 'LOGIN_FAILED'", (today,))[0]['Cnt']
-        
-        stats['active_users'] = db.get_data("SELECT COUNT(DISTINCT UserCode) as Cnt FROM dbo.AUDIT_LOGS WHERE CAST([Timestamp] AS DATE) = ?", (today,))[0]['Cnt']
+        stats = current_app.audit_query_service.get_day_stats()
     except Exception as e:
         current_app.logger.error(f"Lỗi lấy Audit Stats: {e}")
         stats = {'total_today': 0, 'alerts': 0, 'failed_logins': 0, 'active_users': 0}
@@ -357,38 +349,25 @@ def api_stream_logs():
         return jsonify([]), 403
         
     # Nâng limit lên 500 vì sếp xem 2-3 ngày/lần
-    limit = int(request.args.get('limit', 500)) 
-    severity_filter = request.args.get('severity', '') 
-    user_filter = request.args.get('user', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    query = "SELECT TOP (?) LogID, UserCode, ActionType, Severity, Details, IPAddress, [Timestamp] AS CreatedAt FROM dbo.AUDIT_LOGS WHERE 1=1 "
-    params = [limit]
-    
-    if severity_filter:
-        query += " AND Severity = ?"
-        params.append(severity_filter)
-        
-    if user_filter:
-        query += " AND (UserCode LIKE ? OR Details LIKE ?)"
-        params.extend([f"%{user_filter}%", f"%{user_filter}%"])
-        
-    # Thêm bộ lọc Ngày tháng
-    if date_from:
-        query += " AND CAST([Timestamp] AS DATE) >= ?"
-        params.append(date_from)
-    if date_to:
-        query += " AND CAST([Timestamp] AS DATE) <= ?"
-        params.append(date_to)
-        
-    query += " ORDER BY [Timestamp] DESC"
-    
-    logs = current_app.db_manager.get_data(query, tuple(params))
+    # Trang sau: gửi lại giá trị header X-Next-Cursor qua tham số ?cursor=
+    try:
+        logs, next_cursor = current_app.audit_query_service.get_logs_page(
+            limit=request.args.get('limit', 500),
+            severity=request.args.get('severity', ''),
+            user=request.args.get('user', ''),
+            date_from=request.args.get('date_from', ''),
+            date_to=request.args.get('date_to', ''),
+            cursor=request.args.get('cursor', '')
+        )
+    except ValueError:
+        return jsonify({'error': 'Tham số không hợp lệ'}), 400
     
     # Chuẩn hóa ngày tháng
     for log in logs:
         if log.get('CreatedAt'):
             log['CreatedAt'] = log['CreatedAt'].strftime('%H:%M:%S %d/%m/%Y')
             
-    return jsonify(logs)
\ No newline at end of file
+    response = jsonify(logs)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
\ No newline at end of file
@@ -23,12 +23,26 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
 UPLOAD_FOLDER_PATH = os.path.abspath('attachments')
 UPLOAD_FOLDER = 'path/to/your/attachments' # Cần trỏ đúng đường dẫn thực tế trên Server
+RAG_SNAPSHOT_DIR = os.path.abspath('rag_snapshot') # Snapshot embedding (.npy memmap) cho Chatbot RAG
+DOC_TEXT_CACHE_DIR = os.path.abspath('doc_text_cache') # Text PDF đã trích + chỉ mục trang cho "Chat với tài liệu"
+DOC_CHAT_MAX_PAGES = 4       # Số trang liên quan nhất đưa vào prompt
+DOC_CHAT_MAX_CHARS = 8000    # Ngân sách ký tự context / câu hỏi (trước: 15000)
+INGEST_JOB_DIR = os.path.abspath('ingest_jobs') # Checkpoint embedding của job nạp tài liệu (chạy lại không embed lại)
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'docx', 'xlsx', 'pptx', 'txt', 'zip', 'rar'}
 
 # Redis (Real-time)
 REDIS_HOST = os.getenv('REDIS_HOST') or 'localhost'
 REDIS_PORT = int(os.getenv('REDIS_PORT') or 6379)
 REDIS_CHANNEL = 'crm_task_notifications_channel'
+# SSE Task Dashboard chạy trên server waitress RIÊNG (cổng TASK_STREAM_PORT, pool luồng riêng = số suất),
+# không chiếm luồng của server chính (threads=12). Hết suất -> 503, JS poll tạm rồi tự mở lại SSE (backoff).
+# Mỗi kết nối tự đóng sau TASK_STREAM_MAX_LIFETIME giây, EventSource tự kết nối lại.
+TASK_STREAM_PORT = int(os.getenv('TASK_STREAM_PORT') or 5001)
+TASK_STREAM_MAX_CLIENTS = 60
+TASK_STREAM_MAX_LIFETIME = 900
+
+# Lịch làm nóng cache Dashboard (giờ, phút): trước giờ làm + sau các đợt đồng bộ ERP
+CACHE_PREWARM_SCHEDULE = [(7, 30), (12, 15), (16, 45)]
 
 # --- CẤU HÌNH KẾT NỐI CSDL (HYBRID) ---
 
@@ -213,6 +227,7 @@ BOSUNG_CHAOGIA_TABLE = 'dbo.BOSUNG_CHAOGIA'
 CRM_DTCL = '[dbo].[DTCL]' 
 LOG_DUYETCT_TABLE = 'DUYETCT' 
 LOG_AUDIT_TABLE = 'dbo.AUDIT_LOGS'
+LOG_AUDIT_DAILY_TABLE = 'dbo.AUDIT_LOGS_DAILY'
 TABLE_COMMISSION_MASTER = '[dbo].[DE XUAT BAO HANH_MASTER]'
 TABLE_COMMISSION_INVOICES = '[dbo].[DE XUAT BAO HANH_DS]' # Đổi tên biến này cho rõ nghĩa (Bảng chứa hóa đơn)
 TABLE_COMMISSION_RECIPIENTS = '[dbo].[DE XUAT BAO HANH_DETAIL]'
@@ -273,6 +288,8 @@ SP_CREATE_COMMISSION = 'dbo.sp_CreateCommissionProposal'
 
 # Widget Portal (Dùng trong portal_service để hiện gợi ý dự phòng ngoài trang chủ)
 SP_REPLENISH_PORTAL = 'dbo.sp_GetPortalReplenishment'
+# Tổng hợp Audit Log theo ngày cho KPI "Mắt Thần" (job định kỳ, tự tạo bảng + index)
+SP_ROLLUP_AUDIT_LOGS = 'dbo.sp_Job_RollupAuditLogsDaily'
 
 # --- E. BẢNG GAMIFICATION & PROFILE (TITAN OS) ---
 TABLE_TITAN_ITEMS = '[dbo].[TitanOS_SystemItems]'
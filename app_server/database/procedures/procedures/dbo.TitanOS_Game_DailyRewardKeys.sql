@@ -0,0 +1,14 @@
+-- Khóa chống gửi trùng quà tổng kết ngày (GamificationService.process_daily_rewards, job 20:00).
+-- Mỗi (UserCode, RewardDate) chỉ có 1 dòng: job chạy lại / chạy chồng không gửi thư 2 lần.
+-- Chạy 1 lần khi triển khai (trước khi bật job), bằng tài khoản có quyền CREATE TABLE.
+IF OBJECT_ID('dbo.TitanOS_Game_DailyRewardKeys', 'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[TitanOS_Game_DailyRewardKeys] (
+        UserCode     NVARCHAR(50) NOT NULL,
+        RewardDate   DATE         NOT NULL,
+        CreatedTime  DATETIME     NOT NULL,
+        CONSTRAINT PK_TitanOS_Game_DailyRewardKeys PRIMARY KEY (UserCode, RewardDate)
+    );
+END;
+
+GO
@@ -0,0 +1,52 @@
+CREATE PROCEDURE [dbo].[sp_Job_RollupAuditLogsDaily]
+    @Days INT = 2  -- Tính lại N ngày gần nhất (hôm nay + hôm qua để chốt số cuối ngày)
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    -- 0. Bảng tổng hợp theo ngày (tạo 1 lần) + index cho truy vấn theo khoảng thời gian
+    IF OBJECT_ID('dbo.AUDIT_LOGS_DAILY', 'U') IS NULL
+    BEGIN
+        CREATE TABLE [dbo].[AUDIT_LOGS_DAILY] (
+            LogDate       DATE      NOT NULL PRIMARY KEY,
+            TotalCount    INT       NOT NULL,
+            AlertCount    INT       NOT NULL,
+            FailedLogins  INT       NOT NULL,
+            ActiveUsers   INT       NOT NULL,
+            RefreshedAt   DATETIME  NOT NULL
+        );
+    END;
+
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_AUDIT_LOGS_Timestamp_LogID' AND object_id = OBJECT_ID('dbo.AUDIT_LOGS'))
+    BEGIN
+        CREATE NONCLUSTERED INDEX [IX_AUDIT_LOGS_Timestamp_LogID]
+            ON [dbo].[AUDIT_LOGS] ([Timestamp] DESC, LogID DESC)
+            INCLUDE (UserCode, ActionType, Severity);
+    END;
+
+    -- 1. Khoảng nửa mở [@From, @To) -> dùng được index, không CAST cột
+    DECLARE @From DATETIME = DATEADD(DAY, 1 - @Days, CAST(CAST(GETDATE() AS DATE) AS DATETIME));
+    DECLARE @To   DATETIME = DATEADD(DAY, 1, CAST(CAST(GETDATE() AS DATE) AS DATETIME));
+
+    ;WITH Agg AS (
+        SELECT
+            CAST([Timestamp] AS DATE) AS LogDate,
+            COUNT(1) AS TotalCount,
+            SUM(CASE WHEN Severity IN ('WARNING', 'CRITICAL') THEN 1 ELSE 0 END) AS AlertCount,
+            SUM(CASE WHEN ActionType = 'LOGIN_FAILED' THEN 1 ELSE 0 END) AS FailedLogins,
+            COUNT(DISTINCT UserCode) AS ActiveUsers
+        FROM [dbo].[AUDIT_LOGS]
+        WHERE [Timestamp] >= @From AND [Timestamp] < @To
+        GROUP BY CAST([Timestamp] AS DATE)
+    )
+    MERGE [dbo].[AUDIT_LOGS_DAILY] AS T
+    USING Agg AS S ON T.LogDate = S.LogDate
+    WHEN MATCHED THEN
+        UPDATE SET TotalCount = S.TotalCount, AlertCount = S.AlertCount,
+                   FailedLogins = S.FailedLogins, ActiveUsers = S.ActiveUsers, RefreshedAt = GETDATE()
+    WHEN NOT MATCHED THEN
+        INSERT (LogDate, TotalCount, AlertCount, FailedLogins, ActiveUsers, RefreshedAt)
+        VALUES (S.LogDate, S.TotalCount, S.AlertCount, S.FailedLogins, S.ActiveUsers, GETDATE());
+END;
+
+GO
@@ -6,6 +6,8 @@ from sqlalchemy import create_engine, text
 import config
 import time
 import math
+import decimal
+import numpy as np
 import logging  # <--- Thêm dòng này
 # =========================================================================
 # HÀM HELPER XỬ LÝ DỮ LIỆU
@@ -54,6 +56,95 @@ def evaluate_condition(value, operator, threshold):
     elif operator == '!=': return value != threshold
     return True
 
+# =========================================================================
+# FAST READ ENGINE (Đọc thẳng từ cursor PyODBC, không qua Pandas)
+# =========================================================================
+FETCH_BATCH_SIZE = 5000  # Số dòng mỗi lần fetchmany
+
+def _clean_text(v):
+    return '' if v is None else v.strip()
+
+def _clean_bytes(v):
+    return '' if v is None else v.decode('utf-8', errors='ignore')
+
+def _clean_decimal(v):
+    return None if v is None else float(v)
+
+def _column_cleaner(type_code, sample):
+    """
+    Chọn hàm làm sạch cho 1 cột (quyết định 1 lần/cột thay vì isinstance từng ô).
+    PyODBC trả type_code là class Python (str, Decimal...). Driver khác (sqlite)
+    trả None -> đoán theo giá trị khác None đầu tiên của batch đầu.
+    """
+    kind = type_code if isinstance(type_code, type) else (type(sample) if sample is not None else None)
+    if kind is None:
+        return None
+    if issubclass(kind, str): return _clean_text
+    if issubclass(kind, (bytes, bytearray)): return _clean_bytes
+    if issubclass(kind, decimal.Decimal): return _clean_decimal  # Giống coerce_float của pd.read_sql
+    return None  # Số, ngày tháng, bool -> giữ nguyên
+
+def _skip_to_resultset(cursor):
+    """Bỏ qua các result set rỗng (rowcount của INSERT/UPDATE trong SP khi thiếu SET NOCOUNT ON)."""
+    while cursor.description is None:
+        if not cursor.nextset():
+            return False
+    return True
+
+def _iter_clean_batches(cursor, batch_size=FETCH_BATCH_SIZE):
+    """
+    Generator đọc cursor theo batch (fetchmany) và làm sạch theo CỘT.
+    Yield (columns, list_cột) với list_cột[i] là list giá trị đã làm sạch của cột i.
+    """
+    columns = [c[0] for c in cursor.description]
+    type_codes = [c[1] for c in cursor.description]
+    cleaners = None
+
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        col_values = list(zip(*batch))
+
+        if cleaners is None:
+            cleaners = []
+            for i, values in enumerate(col_values):
+                sample = next((v for v in values if v is not None), None)
+                cleaners.append(_column_cleaner(type_codes[i], sample))
+
+        yield columns, [list(map(fn, vals)) if fn else list(vals) for fn, vals in zip(cleaners, col_values)]
+
+def fetch_records(cursor, batch_size=FETCH_BATCH_SIZE):
+    """Đọc toàn bộ result set hiện tại thành list[dict] (cùng contract với get_data)."""
+    if not _skip_to_resultset(cursor):
+        return []
+    records = []
+    for columns, col_values in _iter_clean_batches(cursor, batch_size):
+        records.extend(dict(zip(columns, row)) for row in zip(*col_values))
+    return records
+
+def fetch_columns(cursor, batch_size=FETCH_BATCH_SIZE, as_numpy=False):
+    """
+    Đọc result set hiện tại dạng CỘT: {tên_cột: list}.
+    as_numpy=True: cột số -> np.ndarray float64 (None -> NaN), cột khác -> ndarray object.
+    """
+    if not _skip_to_resultset(cursor):
+        return {}
+    columns = [c[0] for c in cursor.description]
+    result = {col: [] for col in columns}
+    for _, col_values in _iter_clean_batches(cursor, batch_size):
+        for col, values in zip(columns, col_values):
+            result[col].extend(values)
+
+    if as_numpy:
+        for col, values in result.items():
+            sample = next((v for v in values if v is not None), None)
+            if isinstance(sample, (int, float)):  # bool là subclass của int
+                result[col] = np.array(values, dtype=np.float64)
+            else:
+                result[col] = np.array(values, dtype=object)
+    return result
+
 # =========================================================================
 # DATA ACCESS LAYER (DAL)
 # =========================================================================
@@ -108,6 +199,74 @@ class DBManager:
                 
             return []
 
+    # 1b. PHƯƠNG THỨC ĐỌC NHANH (Result set lớn: Tồn kho, Cross-sell...)
+    def get_data_fast(self, query, params=None, batch_size=FETCH_BATCH_SIZE):
+        """
+        Thực thi SELECT/SP qua cursor thô + fetchmany, KHÔNG qua Pandas.
+        Cùng contract với get_data (list[dict], chuỗi đã strip, lỗi -> []).
+        Khác biệt: NULL ở cột số/ngày trả về None thay vì NaN/NaT.
+        """
+        conn = None
+        try:
+            conn = self.engine.raw_connection()
+            cursor = conn.cursor()
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return fetch_records(cursor, batch_size)
+        except Exception as e:
+            current_app.logger.error(f"Lỗi get_data_fast: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
+    def get_columns(self, query, params=None, as_numpy=False, batch_size=FETCH_BATCH_SIZE):
+        """
+        Thực thi SELECT/SP và trả kết quả dạng CỘT {tên_cột: list | np.ndarray}.
+        Dành cho các hàm chỉ cần tổng hợp (sum/group) -> tránh tạo hàng nghìn dict.
+        """
+        conn = None
+        try:
+            conn = self.engine.raw_connection()
+            cursor = conn.cursor()
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return fetch_columns(cursor, batch_size, as_numpy)
+        except Exception as e:
+            current_app.logger.error(f"Lỗi get_columns: {e}")
+            return {}
+        finally:
+            if conn: conn.close()
+
+    def iter_rows(self, query, params=None, batch_size=FETCH_BATCH_SIZE):
+        """
+        Generator đọc từng dòng (dict đã làm sạch) theo batch fetchmany.
+        Chỉ giữ 1 batch trong RAM; kết nối Pool được giữ trong lúc duyệt và
+        trả lại ngay khi duyệt xong / break / lỗi.
+        Lỗi (kể cả giữa chừng) -> log rồi RAISE: bên gọi không được nhận nhầm số tổng hợp bị cắt cụt.
+        """
+        conn = None
+        try:
+            conn = self.engine.raw_connection()
+            cursor = conn.cursor()
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            if not _skip_to_resultset(cursor):
+                return
+            for columns, col_values in _iter_clean_batches(cursor, batch_size):
+                for row in zip(*col_values):
+                    yield dict(zip(columns, row))
+        except Exception as e:
+            current_app.logger.error(f"Lỗi iter_rows: {e}")
+            raise
+        finally:
+            if conn: conn.close()
+
     # 2. PHƯƠNG THỨC THỰC THI (QUAN TRỌNG: ĐÃ SỬA ĐỂ DÙNG RAW CONNECTION)
     def execute_non_query(self, query, params=None):
         """
@@ -197,6 +356,33 @@ class DBManager:
             if conn:
                 conn.close() # Trả kết nối về Pool
 
+    def execute_query_multi(self, query, params=None):
+        """
+        Thực thi 1 batch SQL gồm NHIỀU câu SELECT (1 round-trip) -> list các result set.
+        Batch nên bắt đầu bằng SET NOCOUNT ON. Lỗi -> [].
+        """
+        conn = None
+        results = []
+        try:
+            conn = self.engine.raw_connection()
+            cursor = conn.cursor()
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+
+            while True:
+                if cursor.description:
+                    results.append(fetch_records(cursor))
+                if not cursor.nextset():
+                    break
+            return results
+        except Exception as e:
+            current_app.logger.error(f"Lỗi execute_query_multi: {e}")
+            return []
+        finally:
+            if conn: conn.close()
+
     # --- CÁC HÀM CỤ THỂ KHÁC ---
 
     def write_audit_log(self, user_code, action_type, severity, details, ip_address):
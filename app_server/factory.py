@@ -35,6 +35,11 @@ from services.customer_analysis_service import CustomerAnalysisService
 from services.gamification_service import GamificationService
 from services.training_service import TrainingService  # <--- [THÊM MỚI]
 from services.kpi_service import KPIService
+from services.audit_writer import AuditLogWriter
+from services.activity_writer import ActivityLogWriter
+from services.library_service import LibraryService
+from services.ingestion_service import IngestionService
+from services.audit_query_service import AuditQueryService
 
 # 2. Import Blueprints
 from blueprints.crm_bp import crm_bp
@@ -131,6 +136,8 @@ def create_app():
     # Gắn DB và Redis vào app
     app.db_manager = db_manager
     app.redis_client = redis_client
+    app.audit_writer = AuditLogWriter(db_manager)  # Ghi Audit Log bất đồng bộ theo lô
+    app.audit_query_service = AuditQueryService(db_manager)
 
     # Khởi tạo các Service và gắn vào app
     app.sales_service = SalesService(db_manager)
@@ -153,7 +160,8 @@ def create_app():
     # [FIX] Khởi tạo và gắn PortalService
     app.portal_service = PortalService(db_manager)
     app.user_service = UserService(db_manager)
-    app.gamification_service = GamificationService(db_manager)
+    app.activity_writer = ActivityLogWriter(db_manager)  # Log Gamification ghi sau theo lô
+    app.gamification_service = GamificationService(db_manager, app.activity_writer)
     # [THÊM MỚI] Khởi tạo Training Service và gắn vào App
     app.training_service = TrainingService(db_manager, app.gamification_service)
     app.chatbot_service = ChatbotService(
@@ -164,6 +172,12 @@ def create_app():
         app.config,
         db_manager           # <--- THÊM DÒNG NÀY (để query trực tiếp)
     )
+    # Thư viện tài liệu: PDF upload được xử lý ở hàng đợi nền (trích text bằng pool process, embed theo lô)
+    app.library_service = LibraryService(db_manager, app.chatbot_service.rag_service)
+    app.ingestion_service = IngestionService(db_manager, app.chatbot_service.rag_service, app,
+                                             summarize_fn=app.library_service._ai_categorize_document)
+    app.library_service.ingestion_service = app.ingestion_service
+    # Job dở dang trước lần restart: server.py gọi ingestion_service.resume_unfinished() (chỉ ở entry point)
 
     # 4. ĐĂNG KÝ BLUEPRINTS
     app.register_blueprint(portal_bp)
@@ -207,34 +221,26 @@ def create_app():
         # [NEW] LẤY DỮ LIỆU TỪ DB NẾU ĐÃ LOGIN
         if user_code:
             try:
-                # 1. Gọi Service lấy Full Profile (Gộp cả Stats + Visuals)
-                # Hàm này đã có cơ chế "Self-healing" (Tự tạo data nếu thiếu)
-                profile_data = current_app.user_service.get_user_profile(user_code)
+                # 1. Lấy Profile (Stats + Visuals) + Theme đã mở khóa từ cache theo UserCode
+                # MISS mới gọi get_user_profile (có "Self-healing") + query Inventory
+                user_ctx = current_app.user_service.get_user_context(user_code)
+                profile_data = user_ctx['profile']
                 
                 if profile_data:
                     user_data_combined.update(profile_data)
                     
                     # [LOGIC MỚI] Ưu tiên Nickname
                     if profile_data.get('Nickname'):
-                        # Ghi đè SHORTNAME hiển thị bằng Nickname
-                        session['user_shortname'] = profile_data['Nickname'] 
+                        # Ghi đè SHORTNAME hiển thị bằng Nickname (chỉ ghi khi khác -> không ghi lại session mỗi request)
+                        if session.get('user_shortname') != profile_data['Nickname']:
+                            session['user_shortname'] = profile_data['Nickname'] 
                         # Hoặc tạo biến riêng hiển thị
                         user_data_combined['DisplayName'] = profile_data['Nickname']
                     else:
                         user_data_combined['DisplayName'] = session.get('user_shortname')
 
-                # 2. Lấy danh sách Theme đã mở khóa (Query trực tiếp bảng Inventory)
-                # Vì UserService không return full inventory trong hàm get_user_profile
-                inv_query = "SELECT ItemCode FROM TitanOS_UserInventory WHERE UserCode = ?"
-                inv_data = current_app.db_manager.get_data(inv_query, (user_code,))
-                
-                if inv_data:
-                    owned_items = [row['ItemCode'] for row in inv_data]
-                    # Chỉ lọc lấy các item là theme để đưa vào switcher
-                    valid_themes = ['dark', 'fantasy', 'adorable']
-                    for t in valid_themes:
-                        if t in owned_items:
-                            unlocked_themes.append(t)
+                # 2. Danh sách Theme đã mở khóa (đưa vào switcher)
+                unlocked_themes += user_ctx['unlocked_themes']
 
             except Exception as e:
                 current_app.logger.error(f"Lỗi load User Context: {e}")
@@ -337,8 +343,9 @@ def create_app():
             action_type = f"AUTO_{request.method}"
             details = f"[{request.endpoint}] {request.path} | HTTP {response.status_code} | Data: {payload_str}"
 
-            if hasattr(app, 'db_manager'):
-                app.db_manager.write_audit_log(
+            # Đẩy vào hàng đợi, luồng nền ghi theo lô -> request không phải chờ INSERT/commit
+            if hasattr(app, 'audit_writer'):
+                app.audit_writer.enqueue(
                     user_code=user_code,
                     action_type=action_type,
                     severity=severity,
@@ -377,104 +377,93 @@ class InventoryService:
         """
         # [CONFIG]: SP_GET_INVENTORY_AGING
         sp_query = f"{{CALL {config.SP_GET_INVENTORY_AGING} (?)}}" 
-        aging_data = []
-        try:
-            raw_data = self.db.get_data(sp_query, (None,))
-            if raw_data: aging_data = raw_data
-        except Exception as e:
-            current_app.logger.error(f"Lỗi SP Aging: {e}")
-            return [], {'total_inventory': 0, 'total_quantity': 0, 'total_new_6_months': 0, 'total_over_2_years': 0, 'total_clc_value': 0}
 
-        # [CONFIG]: ERP_IT1302
-        i04_map = {}
         try:
+            # [CONFIG]: ERP_IT1302 (Duyệt stream, không giữ cả bảng vật tư trong RAM)
+            i04_map = {}
             query_i04 = f"SELECT InventoryID, I04ID FROM {config.ERP_IT1302}"
-            i04_data = self.db.get_data(query_i04)
-            if i04_data:
-                for row in i04_data:
-                    i04_map[row['InventoryID']] = row['I04ID'] if row['I04ID'] and row['I04ID'].strip() else 'KHÁC'
-        except Exception as e:
-            current_app.logger.error(f"Lỗi mapping I04ID: {e}")
+            for row in self.db.iter_rows(query_i04):
+                i04_map[row['InventoryID']] = row['I04ID'] if row['I04ID'] else 'KHÁC'
 
-        # [CONFIG]: TEN_BANG_NOI_DUNG_HD (Lấy tên nhóm I04)
-        i04_name_map = {}
-        try:
+            # [CONFIG]: TEN_BANG_NOI_DUNG_HD (Lấy tên nhóm I04)
+            i04_name_map = {}
             query_name = f"SELECT [LOAI], [TEN] FROM {config.TEN_BANG_NOI_DUNG_HD}"
-            name_data = self.db.get_data(query_name)
-            if name_data:
-                for row in name_data:
-                    i04_name_map[row['LOAI']] = row['TEN']
-        except Exception as e:
-            current_app.logger.error(f"Lỗi lấy tên nhóm I04: {e}")
-
-        totals = {'total_inventory': 0, 'total_quantity': 0, 'total_new_6_months': 0, 'total_over_2_years': 0, 'total_clc_value': 0}
-        groups = {}
-
-        qty_op, qty_thresh = parse_filter_string(qty_filter)
-        val_op, val_thresh = parse_filter_string(value_filter)
-        search_terms = [t.strip().lower() for t in item_filter_term.split(';') if t.strip()]
-
-        for row in aging_data:
-            # Ép kiểu an toàn
-            row['TotalCurrentValue'] = safe_float(row.get('TotalCurrentValue'))
-            row['TotalCurrentQuantity'] = safe_float(row.get('TotalCurrentQuantity'))
-            row['Range_0_180_V'] = safe_float(row.get('Range_0_180_V'))
-            row['Range_181_360_V'] = safe_float(row.get('Range_181_360_V'))
-            row['Range_361_540_V'] = safe_float(row.get('Range_361_540_V'))
-            row['Range_541_720_V'] = safe_float(row.get('Range_541_720_V'))
-            row['Range_Over_720_V'] = safe_float(row.get('Range_Over_720_V'))
-            
-            # [CONFIG]: RISK_INVENTORY_VALUE
-            stock_class = str(row.get('StockClass', '')).strip().upper()
-            row['Risk_CLC_Value'] = 0.0
-            if stock_class != 'D' and row['Range_Over_720_V'] > config.RISK_INVENTORY_VALUE:
-                row['Risk_CLC_Value'] = row['Range_Over_720_V']
-
-            is_match = True
-            if search_terms:
-                inv_str = str(row.get('InventoryID', '')).lower()
-                name_str = str(row.get('InventoryName', '')).lower()
-                if not any(term in inv_str or term in name_str for term in search_terms): is_match = False
-            
-            if is_match and category_filter:
-                cat_filter_val = category_filter.replace('!=', '').replace('<>', '').strip().lower()
-                item_cat = str(row.get('InventoryTypeName', '')).lower()
-                item_cat_code = str(row.get('ItemCategory', '')).lower()
-                is_cat_match = (cat_filter_val in item_cat) or (cat_filter_val == item_cat_code)
-                if category_filter.startswith(('!=', '<>')):
-                    if is_cat_match: is_match = False
-                else:
-                    if not is_cat_match: is_match = False
-
-            if is_match and i05id_filter:
-                i05_val = i05id_filter.replace('!=', '').replace('<>', '').strip().upper()
-                if i05id_filter.startswith(('!=', '<>')):
-                    if stock_class == i05_val: is_match = False
-                else:
-                    if stock_class != i05_val: is_match = False
+            for row in self.db.iter_rows(query_name):
+                i04_name_map[row['LOAI']] = row['TEN']
 
-            if is_match and qty_thresh is not None: is_match = evaluate_condition(row['TotalCurrentQuantity'], qty_op, qty_thresh)
-            if is_match and val_thresh is not None: is_match = evaluate_condition(row['TotalCurrentValue'], val_op, val_thresh)
+            totals = {'total_inventory': 0, 'total_quantity': 0, 'total_new_6_months': 0, 'total_over_2_years': 0, 'total_clc_value': 0}
+            groups = {}
 
-            if is_match:
-                totals['total_inventory'] += row['TotalCurrentValue']
-                totals['total_quantity'] += row['TotalCurrentQuantity']
-                totals['total_new_6_months'] += row['Range_0_180_V']
-                totals['total_over_2_years'] += row['Range_Over_720_V']
-                totals['total_clc_value'] += row['Risk_CLC_Value']
+            qty_op, qty_thresh = parse_filter_string(qty_filter)
+            val_op, val_thresh = parse_filter_string(value_filter)
+            search_terms = [t.strip().lower() for t in item_filter_term.split(';') if t.strip()]
 
-                i04_code = i04_map.get(row['InventoryID'], 'KHÁC')
-                i04_name = i04_name_map.get(i04_code, i04_code)
-                if i04_code == 'KHÁC': i04_name = 'Khác / Chưa phân loại'
+            # Stream kết quả SP: chỉ giữ lại các dòng khớp bộ lọc (Items), dòng bị lọc được giải phóng ngay
+            for row in self.db.iter_rows(sp_query, (None,)):
+                # Ép kiểu an toàn
+                row['TotalCurrentValue'] = safe_float(row.get('TotalCurrentValue'))
+                row['TotalCurrentQuantity'] = safe_float(row.get('TotalCurrentQuantity'))
+                row['Range_0_180_V'] = safe_float(row.get('Range_0_180_V'))
+                row['Range_181_360_V'] = safe_float(row.get('Range_181_360_V'))
+                row['Range_361_540_V'] = safe_float(row.get('Range_361_540_V'))
+                row['Range_541_720_V'] = safe_float(row.get('Range_541_720_V'))
+                row['Range_Over_720_V'] = safe_float(row.get('Range_Over_720_V'))
+            
+                # [CONFIG]: RISK_INVENTORY_VALUE
+                stock_class = str(row.get('StockClass', '')).strip().upper()
+                row['Risk_CLC_Value'] = 0.0
+                if stock_class != 'D' and row['Range_Over_720_V'] > config.RISK_INVENTORY_VALUE:
+                    row['Risk_CLC_Value'] = row['Range_Over_720_V']
+
+                is_match = True
+                if search_terms:
+                    inv_str = str(row.get('InventoryID', '')).lower()
+                    name_str = str(row.get('InventoryName', '')).lower()
+                    if not any(term in inv_str or term in name_str for term in search_terms): is_match = False
+            
+                if is_match and category_filter:
+                    cat_filter_val = category_filter.replace('!=', '').replace('<>', '').strip().lower()
+                    item_cat = str(row.get('InventoryTypeName', '')).lower()
+                    item_cat_code = str(row.get('ItemCategory', '')).lower()
+                    is_cat_match = (cat_filter_val in item_cat) or (cat_filter_val == item_cat_code)
+                    if category_filter.startswith(('!=', '<>')):
+                        if is_cat_match: is_match = False
+                    else:
+                        if not is_cat_match: is_match = False
+
+                if is_match and i05id_filter:
+                    i05_val = i05id_filter.replace('!=', '').replace('<>', '').strip().upper()
+                    if i05id_filter.startswith(('!=', '<>')):
+                        if stock_class == i05_val: is_match = False
+                    else:
+                        if stock_class != i05_val: is_match = False
+
+                if is_match and qty_thresh is not None: is_match = evaluate_condition(row['TotalCurrentQuantity'], qty_op, qty_thresh)
+                if is_match and val_thresh is not None: is_match = evaluate_condition(row['TotalCurrentValue'], val_op, val_thresh)
+
+                if is_match:
+                    totals['total_inventory'] += row['TotalCurrentValue']
+                    totals['total_quantity'] += row['TotalCurrentQuantity']
+                    totals['total_new_6_months'] += row['Range_0_180_V']
+                    totals['total_over_2_years'] += row['Range_Over_720_V']
+                    totals['total_clc_value'] += row['Risk_CLC_Value']
+
+                    i04_code = i04_map.get(row['InventoryID'], 'KHÁC')
+                    i04_name = i04_name_map.get(i04_code, i04_code)
+                    if i04_code == 'KHÁC': i04_name = 'Khác / Chưa phân loại'
                 
-                if i04_code not in groups:
-                    groups[i04_code] = {'GroupID': i04_code, 'GroupName': i04_name, 'Items': [], 'Group_TotalVal': 0.0, 'Group_TotalQty': 0.0, 'Group_Over720': 0.0, 'Group_CLC': 0.0}
+                    if i04_code not in groups:
+                        groups[i04_code] = {'GroupID': i04_code, 'GroupName': i04_name, 'Items': [], 'Group_TotalVal': 0.0, 'Group_TotalQty': 0.0, 'Group_Over720': 0.0, 'Group_CLC': 0.0}
                 
-                groups[i04_code]['Items'].append(row)
-                groups[i04_code]['Group_TotalVal'] += row['TotalCurrentValue']
-                groups[i04_code]['Group_TotalQty'] += row['TotalCurrentQuantity']
-                groups[i04_code]['Group_Over720'] += row['Range_Over_720_V']
-                groups[i04_code]['Group_CLC'] += row['Risk_CLC_Value']
+                    groups[i04_code]['Items'].append(row)
+                    groups[i04_code]['Group_TotalVal'] += row['TotalCurrentValue']
+                    groups[i04_code]['Group_TotalQty'] += row['TotalCurrentQuantity']
+                    groups[i04_code]['Group_Over720'] += row['Range_Over_720_V']
+                    groups[i04_code]['Group_CLC'] += row['Risk_CLC_Value']
+        except Exception as e:
+            # Lỗi giữa chừng -> không trả tổng tồn kho bị cắt cụt
+            current_app.logger.error(f"Lỗi tổng hợp tồn kho: {e}")
+            return [], {'total_inventory': 0, 'total_quantity': 0, 'total_new_6_months': 0, 'total_over_2_years': 0, 'total_clc_value': 0}
 
         sorted_groups = sorted(groups.values(), key=lambda g: (g['Group_CLC'], g['Group_Over720']), reverse=True)
         for group in sorted_groups:
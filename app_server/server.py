@@ -4,12 +4,18 @@
 import logging
 from datetime import datetime
 import os
+import sys
+import signal
 import schedule
 import time
 import threading
 
-# Import ứng dụng Flask (Biến 'app' này đã chứa sẵn chatbot_service nhờ factory.py)
-from app import app
+# Biến 'app' (đã chứa sẵn chatbot_service nhờ factory.py) được tạo trong khối __main__ bên dưới:
+# process con của pool trích PDF (spawn trên Windows) import lại file này dưới tên __mp_main__,
+# không được tạo lại app / scheduler / luồng nền trong process con.
+# IngestionService chỉ dùng pool process khi module main khai báo cờ này (xem _get_pool).
+SPAWN_SAFE_MAIN = True
+import config
 from waitress import serve
 from apscheduler.schedulers.background import BackgroundScheduler
 
@@ -29,13 +35,9 @@ def run_daily_challenge_job():
                 messages = app.chatbot_service.training_service.distribute_daily_questions()
                 
                 
-                count = 0
-                if messages:
-                    for item in messages:
-                        # [TODO] Sếp thêm logic gửi tin nhắn (Zalo/Socket) ở đây
-                        # Ví dụ: notification_service.send(item['user_code'], item['message'])
-                        print(f"   -> Gửi challenge cho {item['user_code']}")
-                        count += 1
+                # [TODO] Sếp thêm logic gửi tin nhắn (Zalo/Socket) ở đây: mỗi phần tử chỉ có 'user_code',
+                # nội dung câu hỏi đã nằm trong hòm thư (TitanOS_Game_Mailbox)
+                count = len(messages or [])
                 print(f"✅ Đã gửi {count} câu hỏi daily.")
             else:
                 print("❌ Lỗi: app.chatbot_service chưa được khởi tạo.")
@@ -95,18 +97,44 @@ def run_grading_job():
         try:
             if hasattr(app, 'training_service'):
                 # Gọi hàm xử lý chấm điểm hàng loạt đã viết trong Service
-                app.training_service.process_pending_grading()
-                print("✅ Đã hoàn tất đợt chấm điểm AI.")
+                report = app.training_service.process_pending_grading()
+                print(f"✅ Đã hoàn tất đợt chấm điểm AI: {report or 'không có bài'}")
             else:
                 print("❌ Lỗi: training_service chưa được khởi tạo trong app.")
         except Exception as e:
             print(f"❌ Lỗi Job chấm điểm: {e}")
 
+# =======================================================
+# LÀM NÓNG CACHE DASHBOARD (TRƯỚC GIỜ LÀM + SAU ĐỒNG BỘ ERP)
+# =======================================================
+def run_cache_warm_job():
+    """Tính sẵn cache Cockpit / Sales / Realtime / Portal để người mở đầu tiên không phải chờ."""
+    print(f"🔥 [Cron] Làm nóng cache Dashboard: {datetime.now().strftime('%H:%M:%S')}")
+    with app.app_context():
+        try:
+            from services.cache_warmer import warm_dashboard_caches
+            timings = warm_dashboard_caches()
+            print(f"✅ Đã làm nóng {len(timings) - 1} key trong {timings['total']} ms.")
+        except Exception as e:
+            print(f"❌ Lỗi Job làm nóng cache: {e}")
+
+def run_audit_rollup_job():
+    """Cập nhật bảng tổng hợp Audit Log theo ngày (KPI Mắt Thần)."""
+    with app.app_context():
+        try:
+            app.audit_query_service.refresh_daily_rollup()
+        except Exception as e:
+            print(f"❌ Lỗi Job tổng hợp Audit Log: {e}")
+
 # =========================================================================
 # 4. MAIN ENTRY POINT (CẬP NHẬT SCHEDULER)
 # =========================================================================
 if __name__ == '__main__':
     logger_setup()
+    from app import app
+
+    # Job nạp tài liệu dở dang trước lần restart -> chạy tiếp từ checkpoint (chỉ process server, 1 lần)
+    app.ingestion_service.resume_unfinished()
 
     # --- CẤU HÌNH APSCHEDULER ---
     scheduler = BackgroundScheduler()
@@ -118,14 +146,21 @@ if __name__ == '__main__':
     
     # [2] Lên lịch CHẤM ĐIỂM tự động (Trễ hơn 16 phút so với mốc phát đề)
     # 9:05 + 16p = 9:21
-    scheduler.add_job(run_grading_job, 'cron', hour=8, minute=20)
+    scheduler.add_job(run_grading_job, 'cron', hour=8, minute=20, max_instances=1, coalesce=True)
     # 14:47 + 16p = 15:03
-    scheduler.add_job(run_grading_job, 'cron', hour=13, minute=20)
+    scheduler.add_job(run_grading_job, 'cron', hour=13, minute=20, max_instances=1, coalesce=True)
     # 17:05 + 16p = 17:21
-    scheduler.add_job(run_grading_job, 'cron', hour=17, minute=20)
+    scheduler.add_job(run_grading_job, 'cron', hour=17, minute=20, max_instances=1, coalesce=True)
     
     # [3] Lên lịch quét quà tổng kết ngày (20:00)
     scheduler.add_job(run_daily_gamification, 'cron', hour=20, minute=0)
+
+    # [4] Làm nóng cache Dashboard (trước 8:00 + sau các đợt đồng bộ ERP)
+    for hour, minute in config.CACHE_PREWARM_SCHEDULE:
+        scheduler.add_job(run_cache_warm_job, 'cron', hour=hour, minute=minute, max_instances=1, coalesce=True)
+
+    # [5] Tổng hợp Audit Log theo ngày (5 phút/lần, bảng cũ > 15 phút thì dashboard tự đếm trực tiếp)
+    scheduler.add_job(run_audit_rollup_job, 'interval', minutes=5, max_instances=1, coalesce=True)
     
     scheduler.start()
 
@@ -136,4 +171,14 @@ if __name__ == '__main__':
     print("Server is running at: http://0.0.0.0:5000")
     print("-------------------------------------------------------")
     
+    # Dừng bằng SIGTERM / Ctrl+Break (dịch vụ Windows) -> thoát qua SystemExit để các hook atexit
+    # (audit_writer, activity_writer) ghi nốt hàng đợi xuống SQL trước khi tắt
+    for sig_name in ('SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, sig_name):
+            signal.signal(getattr(signal, sig_name), lambda signum, frame: sys.exit(0))
+
+    # Kênh SSE Task Dashboard: server riêng (pool luồng riêng) trên cổng TASK_STREAM_PORT
+    from services.task_events import serve_task_stream
+    threading.Thread(target=serve_task_stream, args=(app,), daemon=True, name='task-stream-server').start()
+
     serve(app, host='0.0.0.0', port=5000, threads=12)
\ No newline at end of file
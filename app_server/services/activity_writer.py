@@ -0,0 +1,163 @@
+# services/activity_writer.py
+# --- GHI LOG HOẠT ĐỘNG GAMIFICATION BẤT ĐỒNG BỘ (WRITE-BEHIND) ---
+# log_activity được gọi ngay trong request (tạo báo cáo, đóng task...). Trước đây mỗi
+# sự kiện = 1 INSERT + 1 commit đồng bộ. Giờ:
+#  - Request chỉ đẩy (UserCode, ActivityCode) vào hàng đợi RAM.
+#  - 1 luồng nền gom lô -> executemany vào TitanOS_Game_DailyLogs, 1 commit / lô.
+#  - SQL lỗi -> ghi tạm ra file JSONL (logs/activity_spill.jsonl), tự nạp lại khi SQL sống lại.
+#  - Tắt server (atexit) -> ghi nốt hàng đợi, không mất sự kiện.
+# Daily_Limit không kiểm tra ở đây: job chốt thưởng (process_daily_rewards) áp giới hạn khi tổng kết.
+
+from datetime import datetime
+import threading
+import logging
+import atexit
+import queue
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = "INSERT INTO TitanOS_Game_DailyLogs (UserCode, ActivityCode) VALUES (?, ?)"
+QUEUE_MAX = 10000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 2.0      # giây
+REPLAY_INTERVAL = 60.0    # giây: chu kỳ thử nạp lại file spill
+SPILL_FILE = os.path.join(os.path.abspath('logs'), 'activity_spill.jsonl')
+
+class ActivityLogWriter:
+    def __init__(self, db_manager, spill_file=SPILL_FILE):
+        self.db = db_manager
+        self.spill_file = spill_file
+        self._queue = queue.Queue(maxsize=QUEUE_MAX)
+        self._stop = threading.Event()
+        self._io_lock = threading.Lock()  # Tuần tự hóa flush (luồng nền + atexit)
+        self._stats_lock = threading.Lock()
+        self._last_replay = 0.0
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'failed_batches': 0}
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name='activity-writer')
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, user_code, activity_code):
+        """Không chặn: hàng đợi đầy thì bỏ sự kiện (tăng dropped)."""
+        try:
+            self._queue.put_nowait((user_code, activity_code))
+            with self._stats_lock: self.stats['enqueued'] += 1
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['dropped'] += 1
+                dropped = self.stats['dropped']
+            if dropped % 100 == 1:
+                logger.warning(f"Activity queue đầy ({QUEUE_MAX}) -> đã bỏ {dropped} sự kiện")
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats, queue_depth=self._queue.qsize())
+
+    # -------------------------------------------------------------------------
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(BATCH_SIZE, FLUSH_INTERVAL)
+            if batch:
+                self._flush(batch)
+            if self._now() - self._last_replay > REPLAY_INTERVAL and os.path.exists(self.spill_file):
+                self._replay_spill()
+
+    def _now(self):
+        return datetime.now().timestamp()
+
+    def _drain(self, max_rows, timeout):
+        """Chờ dòng đầu tối đa timeout giây, sau đó gom thêm tới max_rows hoặc hết hạn."""
+        batch = []
+        deadline = self._now() + timeout
+        while len(batch) < max_rows:
+            remaining = deadline - self._now()
+            if remaining <= 0: break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows):
+        conn = self.db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True  # PyODBC: gửi cả lô trong 1 round-trip
+            except AttributeError:
+                pass
+            cursor.executemany(INSERT_SQL, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _flush(self, batch):
+        with self._io_lock:
+            try:
+                self._insert(batch)
+                with self._stats_lock: self.stats['written'] += len(batch)
+            except Exception as e:
+                with self._stats_lock: self.stats['failed_batches'] += 1
+                logger.error(f"Activity flush lỗi ({len(batch)} dòng) -> ghi tạm ra file: {e}")
+                self._spill(batch)
+
+    def _spill(self, rows):
+        try:
+            os.makedirs(os.path.dirname(self.spill_file), exist_ok=True)
+            with open(self.spill_file, 'a', encoding='utf-8') as f:
+                for r in rows:
+                    f.write(json.dumps(list(r), ensure_ascii=False) + '\n')
+            with self._stats_lock: self.stats['spilled'] += len(rows)
+        except Exception as e:
+            with self._stats_lock: self.stats['dropped'] += len(rows)
+            logger.error(f"Activity spill lỗi, mất {len(rows)} dòng: {e}")
+
+    def _replay_spill(self):
+        """
+        Nạp lại file spill vào SQL theo lô. Mỗi lô commit xong -> ghi lại file chỉ còn các dòng CHƯA nạp
+        (file tạm + os.replace), nên lỗi giữa chừng không nạp trùng lô đã vào SQL (trùng = cộng XP 2 lần
+        với hoạt động Daily_Limit = 0). Lỗi -> giữ phần còn lại, thử lại sau REPLAY_INTERVAL.
+        """
+        self._last_replay = self._now()
+        with self._io_lock:
+            written = 0
+            try:
+                with open(self.spill_file, 'r', encoding='utf-8') as f:
+                    rows = [tuple(json.loads(line)) for line in f if line.strip()]
+                if not rows:
+                    self._rewrite_spill([])  # File rỗng -> xóa, khỏi quét lại
+                chunk_size = BATCH_SIZE * 5
+                for i in range(0, len(rows), chunk_size):
+                    self._insert(rows[i:i + chunk_size])
+                    written += len(rows[i:i + chunk_size])
+                    self._rewrite_spill(rows[i + chunk_size:])
+                if written:
+                    logger.info(f"Activity: đã nạp lại {written} dòng từ file spill")
+            except Exception as e:
+                logger.warning(f"Activity: chưa nạp lại được file spill (đã nạp {written} dòng): {e}")
+            finally:
+                with self._stats_lock: self.stats['written'] += written
+
+    def _rewrite_spill(self, remaining):
+        """Thay file spill bằng các dòng còn lại (hết dòng -> xóa file)."""
+        if not remaining:
+            os.remove(self.spill_file)
+            return
+        tmp_path = f"{self.spill_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for r in remaining:
+                f.write(json.dumps(list(r), ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.spill_file)
+
+    def stop(self):
+        """Dừng luồng nền và ghi nốt những gì còn trong hàng đợi (gọi khi tắt server)."""
+        if self._stop.is_set(): return
+        self._stop.set()
+        self._thread.join(timeout=FLUSH_INTERVAL + 5)
+        while True:
+            batch = self._drain(BATCH_SIZE * 5, 0.01)
+            if not batch: break
+            self._flush(batch)
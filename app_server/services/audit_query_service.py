@@ -0,0 +1,126 @@
+# services/audit_query_service.py
+# --- TRUY VẤN AUDIT LOG CHO "MẮT THẦN" ---
+# Mọi điều kiện thời gian đều là khoảng nửa mở [from, to) trên cột [Timestamp]
+# (không CAST cột -> dùng được index IX_AUDIT_LOGS_Timestamp_LogID).
+#  - KPI trong ngày: 1 câu aggregate duy nhất, ưu tiên đọc bảng tổng hợp AUDIT_LOGS_DAILY.
+#  - Danh sách log: phân trang keyset theo ([Timestamp], LogID) thay cho TOP (?).
+
+from datetime import datetime, date, timedelta
+import config
+
+ROLLUP_MAX_AGE = timedelta(minutes=15)  # Bảng tổng hợp cũ hơn mức này -> đếm trực tiếp
+MAX_PAGE_SIZE = 1000
+CURSOR_TS_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+EMPTY_STATS = {'total_today': 0, 'alerts': 0, 'failed_logins': 0, 'active_users': 0}
+
+class AuditQueryService:
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    # =========================================================================
+    # 1. KPI TỔNG QUAN
+    # =========================================================================
+    def get_stats(self, start, end):
+        """4 chỉ số KPI trong khoảng [start, end) bằng 1 lần quét."""
+        query = f"""
+            SELECT
+                COUNT(1) AS total_today,
+                ISNULL(SUM(CASE WHEN Severity IN ('WARNING', 'CRITICAL') THEN 1 ELSE 0 END), 0) AS alerts,
+                ISNULL(SUM(CASE WHEN ActionType = 'LOGIN_FAILED' THEN 1 ELSE 0 END), 0) AS failed_logins,
+                COUNT(DISTINCT UserCode) AS active_users
+            FROM {config.LOG_AUDIT_TABLE}
+            WHERE [Timestamp] >= ? AND [Timestamp] < ?
+        """
+        data = self.db.get_data_fast(query, (start, end))
+        if not data:
+            return dict(EMPTY_STATS)
+        return {k: int(data[0].get(k) or 0) for k in EMPTY_STATS}
+
+    def _get_rollup_stats(self, day):
+        query = f"""
+            SELECT TotalCount, AlertCount, FailedLogins, ActiveUsers, RefreshedAt
+            FROM {config.LOG_AUDIT_DAILY_TABLE} WHERE LogDate = ?
+        """
+        data = self.db.get_data_fast(query, (day.strftime('%Y-%m-%d'),))
+        if not data or not data[0].get('RefreshedAt'):
+            return None
+        row = data[0]
+        if datetime.now() - row['RefreshedAt'] > ROLLUP_MAX_AGE:
+            return None
+        return {
+            'total_today': int(row['TotalCount']), 'alerts': int(row['AlertCount']),
+            'failed_logins': int(row['FailedLogins']), 'active_users': int(row['ActiveUsers'])
+        }
+
+    def get_day_stats(self, day=None):
+        """KPI 1 ngày: bảng tổng hợp (nếu còn mới) -> không thì đếm trực tiếp."""
+        day = day or date.today()
+        stats = self._get_rollup_stats(day)
+        if stats is not None:
+            return stats
+        start = datetime.combine(day, datetime.min.time())
+        return self.get_stats(start, start + timedelta(days=1))
+
+    def refresh_daily_rollup(self, days=2):
+        """Job định kỳ: tính lại N ngày gần nhất vào AUDIT_LOGS_DAILY."""
+        return self.db.execute_non_query(f"EXEC {config.SP_ROLLUP_AUDIT_LOGS} ?", (days,))
+
+    # =========================================================================
+    # 2. DANH SÁCH LOG (KEYSET PAGINATION)
+    # =========================================================================
+    @staticmethod
+    def encode_cursor(row):
+        return f"{row['CreatedAt'].strftime(CURSOR_TS_FORMAT)}|{row['LogID']}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            ts, log_id = cursor.split('|')
+            return datetime.strptime(ts, CURSOR_TS_FORMAT), int(log_id)
+        except (ValueError, AttributeError):
+            return None
+
+    def get_logs_page(self, limit=500, severity=None, user=None, date_from=None, date_to=None, cursor=None):
+        """
+        Trả về (logs, next_cursor). date_from/date_to: 'YYYY-MM-DD' (bao gồm cả ngày date_to).
+        next_cursor = None khi đã hết dữ liệu.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = f"""
+            SELECT TOP (?) LogID, UserCode, ActionType, Severity, Details, IPAddress, [Timestamp] AS CreatedAt
+            FROM {config.LOG_AUDIT_TABLE} WHERE 1=1
+        """
+        params = [limit + 1]  # Lấy dư 1 dòng để biết còn trang sau
+
+        if severity:
+            query += " AND Severity = ?"
+            params.append(severity)
+        if user:
+            query += " AND (UserCode LIKE ? OR Details LIKE ?)"
+            params.extend([f"%{user}%", f"%{user}%"])
+
+        # Khoảng nửa mở trên [Timestamp]
+        if date_from:
+            query += " AND [Timestamp] >= ?"
+            params.append(datetime.strptime(date_from, '%Y-%m-%d'))
+        if date_to:
+            query += " AND [Timestamp] < ?"
+            params.append(datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+
+        position = self.decode_cursor(cursor) if cursor else None
+        if position:
+            # Cột [Timestamp] là DATETIME (làm tròn 1/300 giây), tham số pyodbc gửi dạng DATETIME2 micro giây:
+            # so sánh trực tiếp thì nhánh "=" không bao giờ khớp -> mất/lặp dòng ở ranh giới trang.
+            # CAST tham số (không CAST cột) về DATETIME để so sánh đúng kiểu mà vẫn dùng được index.
+            query += " AND ([Timestamp] < CAST(? AS DATETIME) OR ([Timestamp] = CAST(? AS DATETIME) AND LogID < ?))"
+            params.extend([position[0], position[0], position[1]])
+
+        query += " ORDER BY [Timestamp] DESC, LogID DESC"
+
+        logs = self.db.get_data_fast(query, tuple(params))
+        next_cursor = None
+        if len(logs) > limit:
+            logs = logs[:limit]
+            next_cursor = self.encode_cursor(logs[-1])
+        return logs, next_cursor
@@ -0,0 +1,150 @@
+# services/audit_writer.py
+# --- GHI AUDIT LOG BẤT ĐỒNG BỘ THEO LÔ ---
+# auto_audit_logger (after_request) chỉ đẩy dòng log vào hàng đợi trong RAM rồi trả
+# response ngay. 1 luồng nền gom lô -> executemany 1 lần / 1 commit.
+#  - Flush khi đủ BATCH_SIZE dòng hoặc sau FLUSH_INTERVAL giây.
+#  - SQL lỗi -> ghi tạm ra file JSONL (logs/audit_spill.jsonl), tự nạp lại khi SQL sống lại.
+#  - Hàng đợi đầy -> bỏ dòng mới và tăng bộ đếm dropped (không bao giờ chặn request).
+
+from datetime import datetime
+import threading
+import logging
+import atexit
+import queue
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = """
+    INSERT INTO dbo.AUDIT_LOGS (UserCode, ActionType, Severity, Details, IPAddress, [Timestamp])
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+QUEUE_MAX = 10000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 2.0      # giây
+REPLAY_INTERVAL = 60.0    # giây: chu kỳ thử nạp lại file spill
+SPILL_FILE = os.path.join(os.path.abspath('logs'), 'audit_spill.jsonl')
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+class AuditLogWriter:
+    def __init__(self, db_manager, spill_file=SPILL_FILE):
+        self.db = db_manager
+        self.spill_file = spill_file
+        self._queue = queue.Queue(maxsize=QUEUE_MAX)
+        self._stop = threading.Event()
+        self._io_lock = threading.Lock()  # Tuần tự hóa flush (luồng nền + atexit)
+        self._stats_lock = threading.Lock()
+        self._last_replay = 0.0
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'failed_batches': 0}
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name='audit-writer')
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, user_code, action_type, severity, details, ip_address):
+        """Không chặn: hàng đợi đầy thì bỏ dòng (tăng dropped)."""
+        # Chốt thời điểm phát sinh ngay (ghi theo lô sẽ trễ vài giây so với GETDATE())
+        row = (user_code, action_type, severity, details, ip_address, datetime.now())
+        try:
+            self._queue.put_nowait(row)
+            with self._stats_lock: self.stats['enqueued'] += 1
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['dropped'] += 1
+                dropped = self.stats['dropped']
+            if dropped % 100 == 1:
+                logger.warning(f"Audit queue đầy ({QUEUE_MAX}) -> đã bỏ {dropped} dòng")
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats, queue_depth=self._queue.qsize())
+
+    # -------------------------------------------------------------------------
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(BATCH_SIZE, FLUSH_INTERVAL)
+            if batch:
+                self._flush(batch)
+            if self._now() - self._last_replay > REPLAY_INTERVAL and os.path.exists(self.spill_file):
+                self._replay_spill()
+
+    def _now(self):
+        return datetime.now().timestamp()
+
+    def _drain(self, max_rows, timeout):
+        """Chờ dòng đầu tối đa timeout giây, sau đó gom thêm tới max_rows hoặc hết hạn."""
+        batch = []
+        deadline = self._now() + timeout
+        while len(batch) < max_rows:
+            remaining = deadline - self._now()
+            if remaining <= 0: break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows):
+        conn = self.db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True  # PyODBC: gửi cả lô trong 1 round-trip
+            except AttributeError:
+                pass
+            cursor.executemany(INSERT_SQL, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _flush(self, batch):
+        with self._io_lock:
+            try:
+                self._insert(batch)
+                self.stats['written'] += len(batch)
+            except Exception as e:
+                self.stats['failed_batches'] += 1
+                logger.error(f"Audit flush lỗi ({len(batch)} dòng) -> ghi tạm ra file: {e}")
+                self._spill(batch)
+
+    def _spill(self, rows):
+        try:
+            os.makedirs(os.path.dirname(self.spill_file), exist_ok=True)
+            with open(self.spill_file, 'a', encoding='utf-8') as f:
+                for r in rows:
+                    f.write(json.dumps(list(r[:5]) + [r[5].strftime(TS_FORMAT)], ensure_ascii=False) + '\n')
+            self.stats['spilled'] += len(rows)
+        except Exception as e:
+            with self._stats_lock: self.stats['dropped'] += len(rows)
+            logger.error(f"Audit spill lỗi, mất {len(rows)} dòng: {e}")
+
+    def _replay_spill(self):
+        """Nạp lại file spill vào SQL. Lỗi -> giữ nguyên file, thử lại sau REPLAY_INTERVAL."""
+        self._last_replay = self._now()
+        with self._io_lock:
+            try:
+                with open(self.spill_file, 'r', encoding='utf-8') as f:
+                    rows = []
+                    for line in f:
+                        if not line.strip(): continue
+                        r = json.loads(line)
+                        rows.append(tuple(r[:5]) + (datetime.strptime(r[5], TS_FORMAT),))
+                for i in range(0, len(rows), BATCH_SIZE * 5):
+                    self._insert(rows[i:i + BATCH_SIZE * 5])
+                # Chỉ xóa khi toàn bộ đã vào SQL (lỗi giữa chừng có thể nạp trùng vài lô - chấp nhận cho log)
+                os.remove(self.spill_file)
+                self.stats['written'] += len(rows)
+                logger.info(f"Audit: đã nạp lại {len(rows)} dòng từ file spill")
+            except Exception as e:
+                logger.warning(f"Audit: chưa nạp lại được file spill: {e}")
+
+    def stop(self):
+        """Dừng luồng nền và ghi nốt những gì còn trong hàng đợi (gọi khi tắt server)."""
+        if self._stop.is_set(): return
+        self._stop.set()
+        self._thread.join(timeout=FLUSH_INTERVAL + 5)
+        while True:
+            batch = self._drain(BATCH_SIZE * 5, 0.01)
+            if not batch: break
+            self._flush(batch)
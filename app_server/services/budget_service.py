@@ -368,11 +368,8 @@ class BudgetService:
             FROM {config.TABLE_BUDGET_MASTER} 
             WHERE ParentCode IS NOT NULL AND ParentCode <> ''
         """
-        mapping_data = self.db.get_data(query_map)
-        
         # Tạo Dictionary: Key=ParentCode (tức Ana03ID), Value=ReportGroup
         # Ví dụ: {'CP_BH': 'Chi phí Bán Hàng', 'CP_QL': 'Chi phí Quản lý'}
-        ana03_to_group = {row['ParentCode']: (row['ReportGroup'] or 'Khác') for row in mapping_data}
 
         # --- BƯỚC 2: LẤY SỐ LIỆU PLAN (NGÂN SÁCH) ---
         # Logic: Ngân sách được lập chi tiết (BudgetCode), ta cần sum lên theo ReportGroup
@@ -386,7 +383,6 @@ class BudgetService:
             WHERE P.FiscalYear = ?
             GROUP BY M.ReportGroup, P.[Month]
         """
-        plan_raw = self.db.get_data(query_plan, (year,))
 
         # --- BƯỚC 3: LẤY SỐ LIỆU ACTUAL (THỰC TẾ) ---
         # Logic: Lấy từ GT9000 theo Ana03ID.
@@ -404,7 +400,6 @@ class BudgetService:
               AND (DebitAccountID LIKE '6%' OR DebitAccountID LIKE '8%') -- Chỉ lấy các đầu tài khoản chi phí
             GROUP BY Ana03ID, TranMonth
         """
-        actual_raw = self.db.get_data(query_actual, (year,))
 
         # --- BƯỚC 4: TỔNG HỢP DỮ LIỆU (AGGREGATION) ---
         groups_data = {}
@@ -419,29 +414,34 @@ class BudgetService:
                 }
             return groups_data[g_name]
 
-        # 4.1. Đổ dữ liệu Plan vào
-        if plan_raw:
-            for p in plan_raw:
+        try:
+            ana03_to_group = {row['ParentCode']: (row['ReportGroup'] or 'Khác') for row in self.db.iter_rows(query_map)}
+
+            # 4.1. Đổ dữ liệu Plan vào (Stream từng dòng)
+            for p in self.db.iter_rows(query_plan, (year,)):
                 g_name = p['ReportGroup'] or 'Chưa phân nhóm'
                 month = p['Month']
                 amount = safe_float(p['PlanAmount'])
-                
+            
                 entry = get_group_entry(g_name)
                 entry['Plan_Month'][month] = entry['Plan_Month'].get(month, 0) + amount
 
-        # 4.2. Đổ dữ liệu Actual vào (Có Mapping)
-        if actual_raw:
-            for a in actual_raw:
+            # 4.2. Đổ dữ liệu Actual vào (Có Mapping, Stream từng dòng)
+            for a in self.db.iter_rows(query_actual, (year,)):
                 ana03_id = a['Ana03ID']
                 month = a['TranMonth']
                 amount = safe_float(a['ActualAmount'])
-                
+            
                 # Tìm ReportGroup tương ứng với Ana03ID này
                 # Nếu không tìm thấy trong mapping -> Cho vào nhóm "Chi phí khác (ERP)"
                 g_name = ana03_to_group.get(ana03_id, 'Chi phí khác (Chưa mapping)')
-                
+            
                 entry = get_group_entry(g_name)
                 entry['Actual_Month'][month] = entry['Actual_Month'].get(month, 0) + amount
+        except Exception as e:
+            # Lỗi giữa chừng -> không trả báo cáo thiếu số (Plan/Actual lệch nhau)
+            current_app.logger.error(f"Lỗi tổng hợp báo cáo ngân sách YTD {year}: {e}")
+            return []
 
         # --- BƯỚC 5: TÍNH TOÁN YTD & FORMAT BÁO CÁO ---
         current_month = datetime.now().month
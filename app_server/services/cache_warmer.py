@@ -0,0 +1,99 @@
+# services/cache_warmer.py
+# --- LÀM NÓNG CACHE DASHBOARD THEO LỊCH ---
+# Chạy trước giờ làm (và sau các đợt đồng bộ ERP) để người mở Dashboard đầu tiên
+# không phải chờ SP nguội. Tính sẵn đúng các key mà route sẽ đọc:
+#   - CEO Cockpit tháng hiện tại
+#   - Sales Dashboard (view mặc định) của từng Admin (mỗi Division)
+#   - Realtime Dashboard của từng Admin + từng Sales có chỉ tiêu năm nay
+#   - Portal (từng khối) của các user trên
+# Báo cáo thời gian làm nóng từng key: log + Redis (cache_warm:last_report).
+
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import config
+from services.parallel_loader import load_sections
+from services.swr_cache import refresh
+
+REPORT_KEY = 'cache_warm:last_report'
+WARM_TIMEOUT = 900  # giây cho cả đợt
+WARM_WORKERS = 3    # Ít luồng: job chạy lúc vắng nhưng mỗi key có thể tự fan-out ra pool dashboard
+
+def _get_warm_users(db, current_year):
+    """Admin + nhân viên có chỉ tiêu doanh số năm nay (DTCL)."""
+    query = f"""
+        SELECT USERCODE, [ROLE], [Division], [BO PHAN]
+        FROM {config.TEN_BANG_NGUOI_DUNG}
+        WHERE UPPER(LTRIM(RTRIM([ROLE]))) = ?
+           OR USERCODE IN (SELECT DISTINCT [PHU TRACH DS] FROM {config.CRM_DTCL} WHERE [Nam] = ?)
+    """
+    return db.get_data_fast(query, (config.ROLE_ADMIN, current_year))
+
+def build_warm_plan(current_year, current_month):
+    """Danh sách {cache_key: (hàm refresh, tham số, None)} cho load_sections."""
+    # Import trễ: blueprints import services -> tránh vòng lặp import khi khởi động
+    from blueprints.kpi_bp import (
+        build_sales_dashboard_context, build_realtime_context,
+        sales_dashboard_cache_key, realtime_cache_key,
+        SALES_DASHBOARD_TTL, SALES_DASHBOARD_STALE_TTL, REALTIME_TTL, REALTIME_STALE_TTL
+    )
+    from services.executive_service import ExecutiveService
+
+    def job(key, fn, args, ttl, stale_ttl):
+        return (refresh, (key, fn, args, ttl, stale_ttl), None)
+
+    executive = ExecutiveService(current_app.db_manager)
+    cockpit_key = executive.cache_key(current_year, current_month)
+    plan = {
+        cockpit_key: job(cockpit_key, executive._calculate_dashboard_data, (current_year, current_month),
+                         executive.CACHE_TTL, executive.CACHE_STALE_TTL)
+    }
+
+    for user in _get_warm_users(current_app.db_manager, current_year):
+        user_code = user['USERCODE']
+        role = str(user.get('ROLE') or '').strip().upper()
+        # Chuẩn hóa giống lúc login (app.py) để key/tham số khớp với session
+        division = str(user.get('Division') or '').strip().upper()
+        bo_phan = "".join((user.get('BO PHAN') or '').split()).upper()
+        is_admin = role == config.ROLE_ADMIN
+
+        if is_admin:
+            key = sales_dashboard_cache_key(user_code)
+            plan[key] = job(key, build_sales_dashboard_context, (current_year, user_code, True, division),
+                            SALES_DASHBOARD_TTL, SALES_DASHBOARD_STALE_TTL)
+
+        # Realtime view mặc định: Admin xem tất cả, Sales xem của chính mình
+        key = realtime_cache_key(user_code, 'all', current_year)
+        plan[key] = job(key, build_realtime_context,
+                        (user_code, division, is_admin, None if is_admin else user_code, current_year),
+                        REALTIME_TTL, REALTIME_STALE_TTL)
+
+        # Portal tự cache theo từng khối -> gọi với force_refresh để ghi đè mọi khối
+        plan[f"portal:{user_code}"] = (current_app.portal_service.get_all_dashboard_data,
+                                       (user_code, bo_phan, True), None)
+    return plan
+
+def warm_dashboard_caches():
+    """Chạy toàn bộ kế hoạch làm nóng trên pool giới hạn. Trả về {key: ms | 'timeout' | 'error'}."""
+    now = datetime.now()
+    plan = build_warm_plan(now.year, now.month)
+    # Pool riêng: các key (Cockpit, Portal) lại fan-out vào pool dashboard chung bên trong
+    with ThreadPoolExecutor(max_workers=WARM_WORKERS, thread_name_prefix='cache-warm') as executor:
+        _, timings = load_sections(plan, timeout=WARM_TIMEOUT, executor=executor)
+
+    slowest = sorted(((k, v) for k, v in timings.items() if k != 'total' and isinstance(v, float)),
+                     key=lambda kv: kv[1], reverse=True)[:5]
+    failed = [k for k, v in timings.items() if not isinstance(v, float)]
+    current_app.logger.info(
+        f"Cache warm: {len(plan)} key trong {timings['total']} ms | chậm nhất: {slowest} | lỗi/timeout: {failed}"
+    )
+
+    redis_client = getattr(current_app, 'redis_client', None)
+    if redis_client:
+        try:
+            report = {'started_at': now.strftime('%Y-%m-%d %H:%M:%S'), 'timings': timings}
+            redis_client.set(REPORT_KEY, json.dumps(report, ensure_ascii=False))
+        except Exception as e:
+            current_app.logger.warning(f"Cache warm: lỗi lưu báo cáo: {e}")
+    return timings
@@ -13,6 +13,7 @@ from services.rag_memory_service import RagMemoryService
 from services.chatbot_ui_helper import ChatbotUIHelper
 from services.training_service import TrainingService
 from services.gamification_service import GamificationService
+from services.user_cache import get_user_cache, set_user_cache, CHAT_CONTEXT_PREFIX, CHAT_CONTEXT_TTL
 
 logger = logging.getLogger(__name__)
 
@@ -65,29 +66,71 @@ class ChatbotService:
             'search_company_documents': self._wrapper_search_documents
         }
 
+    # =========================================================================
+    # CHAT CONTEXT (GỘP TRUY VẤN THEO USER VÀO 1 ROUND-TRIP + CACHE REDIS)
+    # =========================================================================
+    def _load_chat_context(self, user_code):
+        """
+        Lấy Level, Nickname, Pet, Skill đã sở hữu của user trong 1 batch SQL (5 result set).
+        Cache Redis theo UserCode; bị xóa qua invalidate_user_cache khi Profile/Inventory thay đổi.
+        """
+        cached = get_user_cache(CHAT_CONTEXT_PREFIX, user_code)
+        if cached is not None: return cached
+
+        skill_codes = list(set(self.skill_mapping.values()))
+        placeholders = ', '.join(['?'] * len(skill_codes))
+        sql = f"""
+            SET NOCOUNT ON;
+            SELECT Level FROM TitanOS_UserStats WHERE UserCode = ?;
+            SELECT P.Nickname, U.SHORTNAME FROM TitanOS_UserProfile P JOIN {config.TEN_BANG_NGUOI_DUNG} U ON P.UserCode = U.USERCODE WHERE P.UserCode = ?;
+            SELECT T2.ItemName, T2.ItemCode FROM TitanOS_UserProfile T1 JOIN TitanOS_SystemItems T2 ON T1.EquippedPet = T2.ItemCode WHERE T1.UserCode = ?;
+            SELECT DISTINCT ItemCode FROM TitanOS_UserInventory WHERE UserCode = ? AND IsActive = 1 AND ItemCode IN ({placeholders});
+            SELECT ItemCode, ItemName FROM TitanOS_SystemItems WHERE ItemCode IN ({placeholders});
+        """
+        params = (user_code, user_code, user_code, user_code, *skill_codes, *skill_codes)
+        results = self.db.execute_query_multi(sql, params)
+
+        ctx = {'level': None, 'nickname': '', 'shortname': '', 'pet_code': None, 'pet_name': None,
+               'owned_skills': [], 'skill_names': {}}
+        if len(results) < 5: return ctx  # Lỗi DB -> không cache để lần sau thử lại
+
+        stats, profile, pet, owned, skill_items = results[:5]
+        if stats: ctx['level'] = stats[0].get('Level')
+        if profile:
+            ctx['nickname'] = profile[0].get('Nickname') or ''
+            ctx['shortname'] = profile[0].get('SHORTNAME') or ''
+        if pet:
+            ctx['pet_code'] = pet[0]['ItemCode']
+            ctx['pet_name'] = pet[0]['ItemName']
+        ctx['owned_skills'] = [row['ItemCode'] for row in owned]
+        ctx['skill_names'] = {row['ItemCode']: row['ItemName'] for row in skill_items}
+
+        set_user_cache(CHAT_CONTEXT_PREFIX, user_code, ctx, CHAT_CONTEXT_TTL)
+        return ctx
+
     # =========================================================================
     # HÀM XỬ LÝ QUYỀN VÀ RATE LIMIT
     # =========================================================================
-    def _check_user_has_skill(self, user_code, func_name):
+    def _check_user_has_skill(self, user_code, func_name, ctx=None):
         if func_name not in self.skill_mapping: return True, None
         required_item_code = self.skill_mapping[func_name]
-        check = self.db.get_data("SELECT TOP 1 ID FROM TitanOS_UserInventory WHERE UserCode = ? AND ItemCode = ? AND IsActive = 1", (user_code, required_item_code))
-        if check: return True, None
-        skill_info = self.db.get_data("SELECT ItemName FROM TitanOS_SystemItems WHERE ItemCode = ?", (required_item_code,))
-        return False, skill_info[0]['ItemName'] if skill_info else required_item_code
+        if ctx is None: ctx = self._load_chat_context(user_code)
+        if required_item_code in ctx['owned_skills']: return True, None
+        return False, ctx['skill_names'].get(required_item_code, required_item_code)
         
-    def _get_equipped_pet_info(self, user_code):
-        data = self.db.get_data("SELECT T2.ItemName, T2.ItemCode FROM TitanOS_UserProfile T1 JOIN TitanOS_SystemItems T2 ON T1.EquippedPet = T2.ItemCode WHERE T1.UserCode = ?", (user_code,))
-        if data:
+    def _get_equipped_pet_info(self, user_code, ctx=None):
+        if ctx is None: ctx = self._load_chat_context(user_code)
+        if ctx['pet_code']:
             nicknames = {'fox': 'Bé Cáo AI', 'bear': 'Bé Gấu Mặp', 'dragon': 'Bé Rồng Bự', 'monkey': 'Bé Khỉ Thiền', 'cat': 'Bé Mèo Béo', 'deer': 'Bé Nai Ngơ'}
-            return nicknames.get(data[0]['ItemCode'], data[0]['ItemName'])
+            return nicknames.get(ctx['pet_code'], ctx['pet_name'])
         return "Bé Titan" 
 
-    def _check_ai_rate_limit(self, user_code, user_role):
+    def _check_ai_rate_limit(self, user_code, user_role, ctx=None):
         base_limit, bonus_per_level = 20, 2
         if user_role == 'ADMIN': max_limit = base_limit * 100 
         else:
-            try: max_limit = base_limit + (int(self.db.get_data("SELECT Level FROM TitanOS_UserStats WHERE UserCode = ?", (user_code,))[0]['Level']) * bonus_per_level)
+            if ctx is None: ctx = self._load_chat_context(user_code)
+            try: max_limit = base_limit + (int(ctx['level']) * bonus_per_level)
             except: max_limit = base_limit + bonus_per_level
 
         redis_client = current_app.redis_client
@@ -109,15 +152,17 @@ class ChatbotService:
     # =========================================================================
     def process_message(self, message_text, user_code, user_role, theme='light'):
         try:
+            # 1 round-trip (hoặc 0 nếu cache hit) cho toàn bộ dữ liệu user của lượt chat này
+            ctx = self._load_chat_context(user_code)
+
             clean_msg_for_check = message_text.strip().upper()
             if not (len(clean_msg_for_check) == 1 and clean_msg_for_check in ['A', 'B', 'C', 'D']):
-                is_allowed, max_limit, current_usage = self._check_ai_rate_limit(user_code, user_role)
+                is_allowed, max_limit, current_usage = self._check_ai_rate_limit(user_code, user_role, ctx)
                 if not is_allowed:
                     return f"⚡ **Cảnh báo Năng lượng:** Sếp đã dùng hết giới hạn AI hôm nay ({max_limit}/{max_limit} lượt)."
         
-            user_profile = self.db.get_data("SELECT Nickname, SHORTNAME FROM TitanOS_UserProfile P JOIN [GD - NGUOI DUNG] U ON P.UserCode = U.USERCODE WHERE P.UserCode = ?", (user_code,))
-            user_name = user_profile[0].get('Nickname') or user_profile[0].get('SHORTNAME') if user_profile else "Sếp"
-            pet_name = self._get_equipped_pet_info(user_code) if theme == 'adorable' else "AI"
+            user_name = ctx['nickname'] or ctx['shortname'] or "Sếp"
+            pet_name = self._get_equipped_pet_info(user_code, ctx) if theme == 'adorable' else "AI"
             
             base_personas = {
                 'light': "Bạn là Trợ lý Kinh doanh Titan (Business Style). Trả lời rành mạch, tập trung vào số liệu.",
@@ -165,7 +210,7 @@ class ChatbotService:
                 
                 if current_app: current_app.logger.info(f"🤖 AI Calling Tool: {func_name} | Args: {func_args}")
 
-                has_permission, skill_name = self._check_user_has_skill(user_code, func_name)
+                has_permission, skill_name = self._check_user_has_skill(user_code, func_name, ctx)
 
                 if not has_permission:
                     api_result = f"SYSTEM_ALERT: Người dùng CHƯA sở hữu kỹ năng '{skill_name}'. Hãy từ chối thực hiện và yêu cầu họ vào 'Cửa hàng'."
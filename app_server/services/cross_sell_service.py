@@ -66,41 +66,44 @@ class CrossSellService:
             GROUP BY T1.ObjectID, T3.ShortObjectName, T3.ObjectName, T2.I04ID
         """
         
-        raw_data = self.db.get_data(query) # Không cần truyền tham số năm nữa
-        
-        if not raw_data:
-            return {'buckets': {'titan': [], 'diamond': [], 'growth': [], 'opp': []}, 
-                    'summary': {'titan_count':0, 'diamond_count':0, 'growth_count':0, 'opp_count':0}, 
-                    'master_dna': master_i04_list}
-
-        # 3. Xử lý dữ liệu
+        # 3. Xử lý dữ liệu (Stream từng dòng, không giữ toàn bộ kết quả GT9000 trong RAM)
         customers = {}
         
-        for row in raw_data:
-            client_id = row['ClientID']
-            i04_id = row['I04ID']
-            rev = safe_float(row['Revenue'])
-            cogs = safe_float(row['COGS'])
+        try:
+            for row in self.db.iter_rows(query): # Không cần truyền tham số năm nữa
+                client_id = row['ClientID']
+                i04_id = row['I04ID']
+                rev = safe_float(row['Revenue'])
+                cogs = safe_float(row['COGS'])
             
-            if client_id not in customers:
-                customers[client_id] = {
-                    'ClientID': client_id,
-                    'ClientName': row['ClientName'] or client_id,
-                    'TotalRevenue': 0.0,
-                    'TotalProfit': 0.0,
-                    'Purchased_I04': set(),
-                    'DNA_Map': {}
-                }
+                if client_id not in customers:
+                    customers[client_id] = {
+                        'ClientID': client_id,
+                        'ClientName': row['ClientName'] or client_id,
+                        'TotalRevenue': 0.0,
+                        'TotalProfit': 0.0,
+                        'Purchased_I04': set(),
+                        'DNA_Map': {}
+                    }
             
-            cust = customers[client_id]
-            cust['TotalRevenue'] += rev
-            cust['TotalProfit'] += (rev - cogs)
+                cust = customers[client_id]
+                cust['TotalRevenue'] += rev
+                cust['TotalProfit'] += (rev - cogs)
             
-            if rev > 0:
-                cust['Purchased_I04'].add(i04_id)
-                cust['DNA_Map'][i04_id] = {
-                    'Margin': ((rev - cogs) / rev * 100) if rev > 0 else 0
-                }
+                if rev > 0:
+                    cust['Purchased_I04'].add(i04_id)
+                    cust['DNA_Map'][i04_id] = {
+                        'Margin': ((rev - cogs) / rev * 100) if rev > 0 else 0
+                    }
+        except Exception as e:
+            # Lỗi giữa chừng -> không trả số liệu cắt cụt, coi như chưa có dữ liệu
+            current_app.logger.error(f"Lỗi tổng hợp Cross-sell DNA: {e}")
+            customers = {}
+
+        if not customers:
+            return {'buckets': {'titan': [], 'diamond': [], 'growth': [], 'opp': []}, 
+                    'summary': {'titan_count':0, 'diamond_count':0, 'growth_count':0, 'opp_count':0}, 
+                    'master_dna': master_i04_list}
 
         # 4. Phân loại & Tạo Visual
         buckets = {'titan': [], 'diamond': [], 'growth': [], 'opp': []}
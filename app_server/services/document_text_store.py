@@ -0,0 +1,213 @@
+# services/document_text_store.py
+# --- KHO TEXT PDF ĐÃ TRÍCH SẴN, ĐÁNH CHỈ MỤC THEO TRANG (CHO "CHAT VỚI TÀI LIỆU") ---
+# Trước đây mỗi câu hỏi mở lại PDF bằng PyPDF2, trích lại 10 trang đầu rồi gửi ~15k ký tự cho Gemini.
+#  - Text từng trang được trích 1 LẦN / (MaterialID, mtime file), nén zlib từng trang vào 1 file .bin.
+#    File PDF thay đổi (mtime khác) -> tự trích lại, bản cũ bị xóa.
+#  - File .idx.json nhỏ chứa offset từng trang + chỉ mục từ khóa (BM25) -> chỉ giải nén trang cần dùng.
+#  - Câu hỏi -> chấm điểm BM25 từng trang -> chỉ các trang liên quan nhất vào prompt (thay vì luôn trang 1-10).
+# Nguồn text: file <pdf>.json do LibraryService.process_new_document ghi lúc upload (nếu còn mới), không thì PyPDF2.
+
+from collections import OrderedDict, Counter
+import unicodedata
+import threading
+import logging
+import PyPDF2
+import zlib
+import math
+import json
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+LRU_SIZE = 32             # Số tài liệu giữ chỉ mục trong RAM / process
+BM25_K1 = 1.5
+BM25_B = 0.75
+MIN_TOKEN_LEN = 2
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def fold_text(text):
+    """Chữ thường + bỏ dấu tiếng Việt: gõ 'cong no' vẫn khớp 'công nợ'."""
+    text = unicodedata.normalize('NFD', str(text or '').lower())
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd')
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(fold_text(text)) if len(t) >= MIN_TOKEN_LEN and not t.isdigit()]
+
+class DocumentIndex:
+    """Chỉ mục 1 tài liệu: metadata + BM25 trong RAM, text trang đọc lười từ file .bin."""
+    def __init__(self, bin_path, meta):
+        self.bin_path = bin_path
+        self.offsets = meta['offsets']            # [[offset, length], ...] theo thứ tự trang
+        self.page_lens = meta['page_lens']        # Số token từng trang
+        self.postings = meta['postings']          # {token: [[page_idx, tf], ...]}
+        self.total_pages = len(self.offsets)
+        self.avg_len = (sum(self.page_lens) / self.total_pages) if self.total_pages else 0.0
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get_page(self, page_no):
+        """Text trang page_no (đánh số từ 1). Giải nén lần đầu rồi giữ lại."""
+        idx = page_no - 1
+        if idx < 0 or idx >= self.total_pages: return ''
+        with self._lock:
+            if idx not in self._pages:
+                offset, length = self.offsets[idx]
+                with open(self.bin_path, 'rb') as f:
+                    f.seek(offset)
+                    self._pages[idx] = zlib.decompress(f.read(length)).decode('utf-8')
+            return self._pages[idx]
+
+    def score_pages(self, question):
+        """BM25 của từng trang theo câu hỏi -> [(page_no, score)] giảm dần, chỉ trang có điểm > 0."""
+        scores = Counter()
+        n = self.total_pages
+        for token in set(tokenize(question)):
+            postings = self.postings.get(token)
+            if not postings: continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for page_idx, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.page_lens[page_idx] / (self.avg_len or 1))
+                scores[page_idx + 1] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def select_pages(self, question, max_pages=4, max_chars=8000):
+        """
+        Trang liên quan nhất (theo thứ tự trang) trong ngân sách ký tự -> [(page_no, text)].
+        Không trang nào khớp từ khóa -> các trang đầu (hành vi cũ), cũng trong ngân sách.
+        """
+        ranked = [p for p, _ in self.score_pages(question)[:max_pages]]
+        if not ranked:
+            ranked = list(range(1, min(self.total_pages, max_pages) + 1))
+
+        selected, used = [], 0
+        for page_no in ranked:
+            text = self.get_page(page_no).strip()
+            if not text: continue
+            if used + len(text) > max_chars:
+                text = text[:max(0, max_chars - used)]
+            if not text: break
+            selected.append((page_no, text))
+            used += len(text)
+        return sorted(selected)
+
+class DocumentTextStore:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def get_index(self, material_id, pdf_path, pages=None, pages_fn=None):
+        """
+        Chỉ mục của tài liệu ứng với phiên bản file hiện tại (mtime).
+        pages: list text từng trang nếu bên gọi đã trích sẵn (lúc upload) -> không đọc lại PDF.
+        pages_fn: hàm trích text riêng (vd. pool process), chỉ gọi khi chưa có bản trên đĩa.
+        """
+        mtime = os.stat(pdf_path).st_mtime_ns
+        key = (str(material_id), mtime)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            build_lock = self._build_locks.setdefault(str(material_id), threading.Lock())
+
+        with build_lock:  # 2 câu hỏi cùng lúc vào tài liệu mới -> chỉ trích 1 lần
+            index = self._load(material_id, mtime)
+            if index is None:
+                if pages is None and pages_fn is not None:
+                    pages = pages_fn()
+                index = self._build(material_id, mtime, pdf_path, pages)
+
+        with self._lock:
+            self._lru[key] = index
+            self._lru.move_to_end(key)
+            while len(self._lru) > LRU_SIZE:
+                self._lru.popitem(last=False)
+        return index
+
+    # -------------------------------------------------------------------------
+    def _paths(self, material_id, mtime):
+        base = os.path.join(self.cache_dir, f"{material_id}_{mtime}")
+        return base + '.bin', base + '.idx.json'
+
+    def _load(self, material_id, mtime):
+        bin_path, idx_path = self._paths(material_id, mtime)
+        if not (os.path.exists(bin_path) and os.path.exists(idx_path)): return None
+        try:
+            with open(idx_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != INDEX_VERSION: return None
+            return DocumentIndex(bin_path, meta)
+        except Exception as e:
+            logger.warning(f"DocTextStore: chỉ mục #{material_id} hỏng, trích lại: {e}")
+            return None
+
+    def _extract_pages(self, pdf_path):
+        """Ưu tiên file <pdf>.json (ghi lúc upload) nếu mới hơn PDF, không thì trích bằng PyPDF2."""
+        json_path = pdf_path + '.json'
+        if os.path.exists(json_path) and os.path.getmtime(json_path) >= os.path.getmtime(pdf_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    page_map = json.load(f)
+                return [p.get('content') or '' for p in sorted(page_map, key=lambda p: p['page'])]
+            except Exception as e:
+                logger.warning(f"DocTextStore: không đọc được {json_path}, trích lại từ PDF: {e}")
+        reader = PyPDF2.PdfReader(pdf_path)
+        return [page.extract_text() or '' for page in reader.pages]
+
+    def _build(self, material_id, mtime, pdf_path, pages=None):
+        pages = pages if pages is not None else self._extract_pages(pdf_path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        bin_path, idx_path = self._paths(material_id, mtime)
+
+        offsets, page_lens, postings = [], [], {}
+        blob = bytearray()
+        for idx, text in enumerate(pages):
+            data = zlib.compress((text or '').encode('utf-8'), 6)
+            offsets.append([len(blob), len(data)])
+            blob.extend(data)
+            tokens = tokenize(text)
+            page_lens.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                postings.setdefault(token, []).append([idx, tf])
+        meta = {'version': INDEX_VERSION, 'material_id': str(material_id), 'mtime': mtime,
+                'offsets': offsets, 'page_lens': page_lens, 'postings': postings}
+
+        # Ghi file tạm rồi os.replace (process khác không đọc phải file dở); .bin trước, .idx sau
+        pid = os.getpid()
+        with open(f"{bin_path}.{pid}.tmp", 'wb') as f:
+            f.write(blob)
+        os.replace(f"{bin_path}.{pid}.tmp", bin_path)
+        with open(f"{idx_path}.{pid}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{idx_path}.{pid}.tmp", idx_path)
+
+        self._remove_old_versions(material_id, mtime)
+        logger.info(f"DocTextStore: #{material_id} {len(pages)} trang, {len(blob) // 1024} KB nén")
+        return DocumentIndex(bin_path, meta)
+
+    def _remove_old_versions(self, material_id, keep_mtime):
+        prefix = f"{material_id}_"
+        keep = f"{material_id}_{keep_mtime}."
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix) and not name.startswith(keep) and not name.endswith('.tmp'):
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError as e:
+            logger.warning(f"DocTextStore: không dọn được bản cũ #{material_id}: {e}")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_document_store():
+    """Kho dùng chung của process (thư mục config.DOC_TEXT_CACHE_DIR)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            import config
+            _store = DocumentTextStore(config.DOC_TEXT_CACHE_DIR)
+        return _store
@@ -0,0 +1,102 @@
+# services/embedding_cache.py
+# --- CACHE 2 TẦNG CHO RAG: LRU TRONG PROCESS + REDIS ---
+# Người dùng hỏi lặp lại cùng 1 câu ("quy trình nghỉ phép", "chính sách công nợ")
+# cả ngày -> cache embedding của câu hỏi (tiết kiệm quota + độ trễ gọi Gemini)
+# và cache luôn chuỗi context top-k theo (câu hỏi, phiên bản index).
+
+from flask import current_app
+from collections import OrderedDict
+import numpy as np
+import unicodedata
+import threading
+import hashlib
+import base64
+import re
+
+def _get_redis():
+    try:
+        return getattr(current_app, 'redis_client', None)
+    except RuntimeError:  # Luồng nền không có app_context
+        return None
+
+def normalize_query(text):
+    """Chuẩn hóa câu hỏi để các biến thể gõ khác nhau dùng chung 1 key."""
+    text = unicodedata.normalize('NFC', str(text or '')).lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(' ?!.…')
+
+def query_hash(text):
+    return hashlib.sha1(normalize_query(text).encode('utf-8')).hexdigest()
+
+class TwoTierCache:
+    """
+    LRU trong RAM (nhanh, riêng từng process) đứng trước Redis (dùng chung, có TTL).
+    Redis lỗi / không có -> chỉ dùng LRU. Đếm hit/miss để theo dõi hiệu quả.
+    """
+    def __init__(self, prefix, maxsize=512, ttl=86400, encode=None, decode=None):
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._encode = encode or (lambda v: v)
+        self._decode = decode or (lambda v: v)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return self._lru[key]
+
+        redis_client = _get_redis()
+        if redis_client:
+            try:
+                raw = redis_client.get(f"{self.prefix}:{key}")
+                if raw is not None:
+                    value = self._decode(raw)
+                    self._remember(key, value)
+                    with self._lock: self.stats['redis_hits'] += 1
+                    return value
+            except Exception as e:
+                current_app.logger.warning(f"Lỗi đọc cache {self.prefix}: {e}")
+
+        with self._lock: self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        self._remember(key, value)
+        redis_client = _get_redis()
+        if redis_client:
+            try:
+                redis_client.setex(f"{self.prefix}:{key}", self.ttl, self._encode(value))
+            except Exception as e:
+                current_app.logger.warning(f"Lỗi ghi cache {self.prefix}: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, size=len(self._lru))
+        total = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = round((total - stats['misses']) / total, 3) if total else 0.0
+        return stats
+
+# Redis client đang decode_responses=True -> vector float32 mã hóa base64 (gọn hơn JSON ~5 lần)
+def _encode_vector(vec):
+    return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode('ascii')
+
+def _decode_vector(raw):
+    return np.frombuffer(base64.b64decode(raw), dtype=np.float32)
+
+# Embedding của 1 câu hỏi không đổi theo thời gian (chỉ đổi khi đổi model -> model nằm trong key)
+EMBEDDING_CACHE = TwoTierCache('rag:emb', maxsize=2048, ttl=7 * 86400,
+                               encode=_encode_vector, decode=_decode_vector)
+# Context top-k phụ thuộc nội dung index -> key kèm phiên bản index, TTL ngắn để tự dọn
+CONTEXT_CACHE = TwoTierCache('rag:ctx', maxsize=512, ttl=3600)
@@ -4,48 +4,53 @@ from flask import current_app
 from db_manager import DBManager, safe_float
 from datetime import datetime, timedelta
 import config
+from services.parallel_loader import load_sections
+from services.swr_cache import get_or_compute
 
 class ExecutiveService:
     """
     Service chuyên biệt cho CEO Cockpit (Version 3.2 - Fix Conflict).
     """
     
+    CACHE_TTL = 600
+    CACHE_STALE_TTL = 3000
+
     def __init__(self, db_manager: DBManager):
         self.db = db_manager
 
     def get_dashboard_data_cached(self, year, month):
-        cache_key = f"ceo_cockpit_data_{year}_{month}"
-        try:
-            cached_data = current_app.cache.get(cache_key)
-            if cached_data:
-                current_app.logger.info(f"CEO Cockpit: HIT Global Cache ({cache_key})")
-                return cached_data
-        except Exception as e:
-            current_app.logger.warning(f"Cache Warning: {e}")
+        # Tươi 10 phút, được phục vụ bản cũ thêm 50 phút trong lúc 1 worker tính lại ở nền
+        return get_or_compute(self.cache_key(year, month), self._calculate_dashboard_data, (year, month),
+                              ttl=self.CACHE_TTL, stale_ttl=self.CACHE_STALE_TTL)
 
-        current_app.logger.info(f"CEO Cockpit: MISS Cache -> Calculating DB...")
-        data = self._calculate_dashboard_data(year, month)
-        
-        try:
-            current_app.cache.set(cache_key, data, timeout=600)
-        except Exception:
-            pass
-            
-        return data
+    @staticmethod
+    def cache_key(year, month):
+        return f"ceo_cockpit_data_{year}_{month}"
 
     def _calculate_dashboard_data(self, current_year, current_month):
-        kpi_data = self.get_kpi_scorecards(current_year, current_month)
+        # Các khối độc lập -> chạy song song, mỗi khối 1 connection riêng từ pool
+        empty_chart = {'categories': [], 'revenue': [], 'profit': [], 'margin': []}
+        sections, timings = load_sections({
+            'kpi':       (self.get_kpi_scorecards, (current_year, current_month), self._empty_kpi()),
+            'inventory': (self.get_inventory_aging_chart_data, (), {'labels': [], 'series': [], 'drilldown': {}}),
+            'category':  (self.get_top_categories_performance, (current_year,), empty_chart),
+            'financial': (self.get_profit_trend_chart, (), {'categories': [], 'revenue': [], 'profit': [], 'expenses': [], 'net_profit': []}),
+            'funnel':    (self.get_sales_funnel_data, (), {}),
+            'top_sales': (self.get_top_sales_leaderboard, (current_year,), []),
+            'actions':   (self.get_pending_actions_count, (), {'Quotes': 0, 'Budgets': 0, 'Orders': 0, 'UrgentTasks': 0, 'Total': 0}),
+        })
+        kpi_data = sections['kpi']
         
         charts = {
-            'inventory': self.get_inventory_aging_chart_data(),
-            'category': self.get_top_categories_performance(current_year),
-            'financial': self.get_profit_trend_chart(),
-            'funnel': self.get_sales_funnel_data()
+            'inventory': sections['inventory'],
+            'category': sections['category'],
+            'financial': sections['financial'],
+            'funnel': sections['funnel']
         }
         
         lists = {
-            'top_sales': self.get_top_sales_leaderboard(current_year),
-            'actions': self.get_pending_actions_count()
+            'top_sales': sections['top_sales'],
+            'actions': sections['actions']
         }
 
         profit_summary = {
@@ -70,11 +75,12 @@ class ExecutiveService:
             'lists': lists,
             'profit_summary': profit_summary,
             'finance_summary': finance_summary,
-            'risk_summary': risk_summary
+            'risk_summary': risk_summary,
+            'timings': timings  # ms từng khối (profiling)
         }
 
-    def get_kpi_scorecards(self, current_year, current_month):
-        kpi_data = {
+    def _empty_kpi(self):
+        return {
             'Sales_YTD': 0, 'TargetYear': 0, 'Percent': 0,
             'GrossProfit_YTD': 0, 'AvgMargin_YTD': 0,
             'TotalExpenses_YTD': 0, 'BudgetPlan_YTD': 0,
@@ -85,6 +91,9 @@ class ExecutiveService:
             'OTIF_Month': 0, 'OTIF_YTD': 0
         }
 
+    def get_kpi_scorecards(self, current_year, current_month):
+        kpi_data = self._empty_kpi()
+
         try:
             result = self.db.execute_sp_multi('sp_GetExecutiveKPI', (current_year, current_month))
             if result and result[0]:
@@ -223,19 +232,21 @@ class ExecutiveService:
     def get_pending_actions_count(self):
         counts = {'Quotes': 0, 'Budgets': 0, 'Orders': 0, 'UrgentTasks': 0, 'Total': 0}
         try:
-            c_q = self.db.get_data(f"SELECT COUNT(*) FROM {config.ERP_QUOTES} WHERE OrderStatus = 0")
-            counts['Quotes'] = safe_float(list(c_q[0].values())[0]) if c_q else 0
-            c_b = self.db.get_data(f"SELECT COUNT(*) FROM {config.TABLE_EXPENSE_REQUEST} WHERE Status = 'PENDING'")
-            counts['Budgets'] = safe_float(list(c_b[0].values())[0]) if c_b else 0
-            c_o = self.db.get_data(f"SELECT COUNT(*) FROM {config.ERP_OT2001} WHERE OrderStatus = 0")
-            counts['Orders'] = safe_float(list(c_o[0].values())[0]) if c_o else 0
-            q_task = f"""
-                SELECT COUNT(*) FROM {config.TASK_TABLE} 
-                WHERE Status IN ('{config.TASK_STATUS_BLOCKED}', '{config.TASK_STATUS_HELP}') 
-                OR (Priority = 'HIGH' AND Status NOT IN ('{config.TASK_STATUS_COMPLETED}', 'CANCELLED'))
+            # Gộp 4 lệnh COUNT thành 1 round-trip
+            query = f"""
+                SELECT
+                    (SELECT COUNT(*) FROM {config.ERP_QUOTES} WHERE OrderStatus = 0) AS Quotes,
+                    (SELECT COUNT(*) FROM {config.TABLE_EXPENSE_REQUEST} WHERE Status = 'PENDING') AS Budgets,
+                    (SELECT COUNT(*) FROM {config.ERP_OT2001} WHERE OrderStatus = 0) AS Orders,
+                    (SELECT COUNT(*) FROM {config.TASK_TABLE} 
+                     WHERE Status IN ('{config.TASK_STATUS_BLOCKED}', '{config.TASK_STATUS_HELP}') 
+                     OR (Priority = 'HIGH' AND Status NOT IN ('{config.TASK_STATUS_COMPLETED}', 'CANCELLED'))) AS UrgentTasks
             """
-            c_t = self.db.get_data(q_task)
-            counts['UrgentTasks'] = safe_float(list(c_t[0].values())[0]) if c_t else 0
+            data = self.db.get_data(query)
+            if data:
+                row = data[0]
+                for key in ('Quotes', 'Budgets', 'Orders', 'UrgentTasks'):
+                    counts[key] = safe_float(row.get(key, 0))
             counts['Total'] = int(counts['Quotes'] + counts['Budgets'] + counts['Orders'] + counts['UrgentTasks'])
         except Exception: pass
         return counts
@@ -1,10 +1,16 @@
 # services/gamification_service.py
-from datetime import datetime
+from datetime import datetime, date
+import time
 import config
 
+# Khóa chống gửi trùng thư tổng kết ngày: 1 dòng / (user, ngày).
+# Tạo bảng bằng database/procedures/procedures/dbo.TitanOS_Game_DailyRewardKeys.sql (chạy 1 lần khi triển khai).
+REWARD_KEY_TABLE = 'TitanOS_Game_DailyRewardKeys'
+
 class GamificationService:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, activity_writer=None):
         self.db = db_manager
+        self.activity_writer = activity_writer  # Ghi log bất đồng bộ theo lô (None -> ghi SQL trực tiếp)
         self.MAX_DAILY_XP = 2607 # Giới hạn cứng theo yêu cầu
 
     def log_activity(self, user_code, activity_code):
@@ -13,7 +19,12 @@ class GamificationService:
         Hàm này chạy Real-time khi user thao tác.
         """
         try:
-            # Chỉ ghi log, chưa tính toán gì để đảm bảo tốc độ app
+            # Chỉ ghi log, chưa tính toán gì để đảm bảo tốc độ app.
+            # Luôn ghi (kể cả đã đủ Daily_Limit): process_daily_rewards tự áp giới hạn theo kỳ chốt thưởng,
+            # log sau giờ chốt (20:00) được tính vào kỳ của ngày hôm sau.
+            if self.activity_writer:
+                self.activity_writer.enqueue(user_code, activity_code)
+                return
             query = "INSERT INTO TitanOS_Game_DailyLogs (UserCode, ActivityCode) VALUES (?, ?)"
             self.db.execute_non_query(query, (user_code, activity_code))
         except Exception as e:
@@ -22,101 +33,135 @@ class GamificationService:
     def process_daily_rewards(self):
         """
         [CRON JOB 20:00] Tổng kết và gửi quà.
-        ĐÃ CẬP NHẬT: Chống gửi trùng lặp (Idempotency Check).
+        Xử lý theo lô: 1 query gom log của mọi user -> tính thưởng trong RAM -> 1 transaction ghi.
+        Chống gửi trùng bằng khóa (UserCode, RewardDate) trong REWARD_KEY_TABLE (thay cho quét Title LIKE).
+        Trả về báo cáo: số user, số thư, số user bỏ qua vì đã nhận, thời gian từng bước.
         """
         print(f">>> Bắt đầu quét thưởng ngày {datetime.now().strftime('%d/%m/%Y')}...")
-        
-        # 1. Lấy danh sách User có hoạt động chưa xử lý
-        users_query = "SELECT DISTINCT UserCode FROM TitanOS_Game_DailyLogs WHERE IsProcessed = 0"
-        users = self.db.get_data(users_query)
+        timings = {}
+        t_start = time.perf_counter()
+
+        # 1. Gom log chưa xử lý của TẤT CẢ user theo (user, hoạt động). MaxLogID chốt phạm vi từng cặp:
+        #    log phát sinh trong lúc job chạy giữ nguyên IsProcessed = 0 cho lần sau.
+        #    LogID: khóa IDENTITY của TitanOS_Game_DailyLogs (INSERT chỉ ghi UserCode, ActivityCode; bản cũ
+        #    _generate_daily_mail_for_user cũng đếm COUNT(L.LogID)) -> tăng dần theo thứ tự ghi.
+        log_sql = """
+            SELECT L.UserCode, L.ActivityCode, COUNT(*) as Count, MAX(L.LogID) as MaxLogID,
+                   A.XP_Reward, A.Coin_Reward, A.Description, A.Daily_Limit
+            FROM TitanOS_Game_DailyLogs L
+            JOIN TitanOS_Game_Activities A ON L.ActivityCode = A.ActivityCode
+            WHERE L.IsProcessed = 0
+            GROUP BY L.UserCode, L.ActivityCode, A.XP_Reward, A.Coin_Reward, A.Description, A.Daily_Limit
+            ORDER BY L.UserCode, L.ActivityCode
+        """
+        t0 = time.perf_counter()
+        logs = self.db.get_data_fast(log_sql)
+        timings['read'] = (time.perf_counter() - t0) * 1000
 
-        if not users:
+        if not logs:
             print(">>> Không có hoạt động nào mới.")
-            return
-
-        today_str = datetime.now().strftime('%d/%m')
-        mail_title_prefix = f"🎁 Tổng kết hoạt động ngày {today_str}"
-
-        count_sent = 0
-
-        for u in users:
-            user_code = u['UserCode']
-            
-            # --- [LOGIC MỚI] CHECK TRÙNG LẶP ---
-            # Kiểm tra xem user này đã nhận thư tổng kết hôm nay chưa
-            check_mail_sql = """
-                SELECT MailID FROM TitanOS_Game_Mailbox 
-                WHERE UserCode = ? AND Title LIKE ?
-            """
-            # Dùng LIKE để tìm tiêu đề chứa ngày hôm nay
-            is_rewarded = self.db.get_data(check_mail_sql, (user_code, f"{mail_title_prefix}%"))
-            
-            if is_rewarded:
-                print(f"⚠️ User {user_code} đã nhận quà hôm nay rồi -> Bỏ qua.")
-                # Tùy chọn: Có thể update luôn các log còn sót thành đã xử lý để dọn dẹp
-                self.db.execute_non_query(
-                    "UPDATE TitanOS_Game_DailyLogs SET IsProcessed = 1 WHERE UserCode = ? AND IsProcessed = 0", 
-                    (user_code,)
+            return None
+
+        # 2. Tính thưởng trong 1 lượt (log đã sắp theo UserCode)
+        t0 = time.perf_counter()
+        rewards = self._compute_daily_rewards(logs)
+        # Chỉ đánh dấu đúng các cặp (user, hoạt động) đã đọc, tới LogID lớn nhất đã đọc của từng cặp
+        processed_keys = [(log['UserCode'], log['ActivityCode'], int(log['MaxLogID'])) for log in logs]
+        timings['compute'] = (time.perf_counter() - t0) * 1000
+
+        # 3. Ghi trong 1 transaction: khóa idempotency + hòm thư + đánh dấu log
+        today = date.today()
+        mail_title = f"🎁 Tổng kết hoạt động ngày {today.strftime('%d/%m')}"
+        t0 = time.perf_counter()
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True  # PyODBC: gửi cả lô trong 1 round-trip
+            except AttributeError:
+                pass
+
+            # User đã nhận quà hôm nay (lần chạy trước / chạy chồng): khóa lại đến hết transaction
+            cursor.execute(
+                f"SELECT UserCode FROM {REWARD_KEY_TABLE} WITH (UPDLOCK, HOLDLOCK) WHERE RewardDate = ?", (today,)
+            )
+            already = {str(row[0]).strip() for row in cursor.fetchall()}
+            to_send = [r for r in rewards if r['user_code'] not in already and (r['xp'] > 0 or r['coins'] > 0)]
+            for r in rewards:
+                if r['user_code'] in already:
+                    print(f"⚠️ User {r['user_code']} đã nhận quà hôm nay rồi -> Bỏ qua.")
+
+            if to_send:
+                cursor.executemany(
+                    f"INSERT INTO {REWARD_KEY_TABLE} (UserCode, RewardDate, CreatedTime) VALUES (?, ?, GETDATE())",
+                    [(r['user_code'], today) for r in to_send]
                 )
-                continue
-            # -----------------------------------
-
-            # 2. Tính toán điểm thưởng
-            # Lấy chi tiết log
-            log_sql = """
-                SELECT L.ActivityCode, COUNT(*) as Count, A.XP_Reward, A.Coin_Reward, A.Description, A.Daily_Limit
-                FROM TitanOS_Game_DailyLogs L
-                JOIN TitanOS_Game_Activities A ON L.ActivityCode = A.ActivityCode
-                WHERE L.UserCode = ? AND L.IsProcessed = 0
-                GROUP BY L.ActivityCode, A.XP_Reward, A.Coin_Reward, A.Description, A.Daily_Limit
-            """
-            logs = self.db.get_data(log_sql, (user_code,))
-            
-            if not logs: continue
-
-            total_xp = 0
-            total_coins = 0
-            details_html = "<ul>"
-
-            for log in logs:
-                count = log['Count']
-                limit = log['Daily_Limit']
-                
-                # Logic giới hạn số lần (Capping per activity)
-                valid_count = count if (limit == 0 or count <= limit) else limit
-                
-                xp_earn = valid_count * log['XP_Reward']
-                coin_earn = valid_count * log['Coin_Reward']
-                
-                total_xp += xp_earn
-                total_coins += coin_earn
-                
-                details_html += f"<li>{log['Description']}: {valid_count} lần (+{xp_earn} XP)</li>"
-
-            details_html += "</ul>"
-            
-            # Logic giới hạn tổng XP ngày (Global Cap)
-            if total_xp > self.MAX_DAILY_XP:
-                total_xp = self.MAX_DAILY_XP
-                details_html += f"<p class='text-danger small'>*(Đã đạt giới hạn {self.MAX_DAILY_XP} XP/ngày)</p>"
-
-            # 3. Gửi thư (Insert Mailbox)
-            if total_xp > 0 or total_coins > 0:
-                mail_sql = """
+                cursor.executemany(
+                    """
                     INSERT INTO TitanOS_Game_Mailbox 
                     (UserCode, Title, Content, Total_XP, Total_Coins, CreatedTime, IsClaimed)
                     VALUES (?, ?, ?, ?, ?, GETDATE(), 0)
-                """
-                self.db.execute_non_query(mail_sql, (user_code, mail_title_prefix, details_html, total_xp, total_coins))
-                count_sent += 1
+                    """,
+                    [(r['user_code'], mail_title, r['details_html'], r['xp'], r['coins']) for r in to_send]
+                )
 
-            # 4. Đánh dấu Log đã xử lý
-            self.db.execute_non_query(
-                "UPDATE TitanOS_Game_DailyLogs SET IsProcessed = 1 WHERE UserCode = ? AND IsProcessed = 0", 
-                (user_code,)
+            # Log của user đã nhận quà cũng được dọn (giống hành vi cũ)
+            cursor.executemany(
+                """
+                UPDATE TitanOS_Game_DailyLogs SET IsProcessed = 1
+                WHERE IsProcessed = 0 AND UserCode = ? AND ActivityCode = ? AND LogID <= ?
+                """,
+                processed_keys
             )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Lỗi ghi thưởng ngày (đã rollback, log giữ nguyên cho lần sau): {e}")
+            return None
+        finally:
+            conn.close()
+        timings['write'] = (time.perf_counter() - t0) * 1000
+        timings['total'] = (time.perf_counter() - t_start) * 1000
+
+        report = {
+            'users': len(rewards), 'sent': len(to_send), 'skipped': len(already & {r['user_code'] for r in rewards}),
+            'timings_ms': {k: round(v, 1) for k, v in timings.items()},
+        }
+        print(f">>> Hoàn tất. Đã gửi quà cho {report['sent']}/{report['users']} user "
+              f"(bỏ qua {report['skipped']}) | " + ", ".join(f"{k} {v:.0f} ms" for k, v in timings.items()))
+        return report
+
+    def _compute_daily_rewards(self, logs):
+        """
+        logs: các dòng (UserCode, ActivityCode, Count, XP_Reward, Coin_Reward, Description, Daily_Limit) sắp theo UserCode.
+        Áp giới hạn số lần / hoạt động (Daily_Limit, 0 = không giới hạn) rồi giới hạn tổng XP ngày (MAX_DAILY_XP).
+        """
+        rewards = []
+        current = None
+        for log in logs:
+            user_code = str(log['UserCode']).strip()
+            if current is None or current['user_code'] != user_code:
+                current = {'user_code': user_code, 'xp': 0, 'coins': 0, 'items': []}
+                rewards.append(current)
+
+            count = int(log['Count'])
+            limit = int(log['Daily_Limit'] or 0)
+            # Logic giới hạn số lần (Capping per activity)
+            valid_count = count if (limit == 0 or count <= limit) else limit
 
-        print(f">>> Hoàn tất. Đã gửi quà cho {count_sent} user.")
+            xp_earn = valid_count * int(log['XP_Reward'] or 0)
+            current['xp'] += xp_earn
+            current['coins'] += valid_count * int(log['Coin_Reward'] or 0)
+            current['items'].append(f"<li>{log['Description']}: {valid_count} lần (+{xp_earn} XP)</li>")
+
+        for r in rewards:
+            details_html = "<ul>" + "".join(r.pop('items')) + "</ul>"
+            # Logic giới hạn tổng XP ngày (Global Cap)
+            if r['xp'] > self.MAX_DAILY_XP:
+                r['xp'] = self.MAX_DAILY_XP
+                details_html += f"<p class='text-danger small'>*(Đã đạt giới hạn {self.MAX_DAILY_XP} XP/ngày)</p>"
+            r['details_html'] = details_html
+        return rewards
 
     def _generate_daily_mail_for_user(self, user_code):
         # 2. Lấy chi tiết hoạt động và cấu hình điểm
@@ -0,0 +1,106 @@
+# services/grading_pool.py
+# --- CHẤM BÀI AI SONG SONG (DAILY CHALLENGE) ---
+# Mỗi bài tự luận = 1 lần gọi LLM (1-5 giây). Chấm tuần tự 100 bài -> vài phút.
+#  - Pool luồng giới hạn cho lời gọi LLM, mỗi lời gọi có timeout + thử lại (backoff lũy thừa + jitter).
+#  - Kết quả gom theo chunk -> hàm ghi (1 transaction / chunk) chạy trên luồng gọi run().
+#    Chunk nào đã ghi là đã chốt: chết giữa chừng thì lần chạy sau chỉ chấm phần còn lại.
+#  - Báo cáo thông lượng: bài/giây, độ trễ LLM p50/p95, số lần thử lại, số bài lỗi.
+# grader là hàm thuần (question, standard, answer) -> kết quả: thay bằng grader giả để chạy thử cục bộ.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+import logging
+import random
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+GRADING_WORKERS = 4      # Số lời gọi LLM đồng thời (giới hạn quota Gemini)
+CALL_TIMEOUT = 45        # giây / lời gọi
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 1.0       # giây: 1s, 2s, 4s (+ jitter)
+CHUNK_SIZE = 20          # Số bài / transaction ghi
+RUN_TIMEOUT = 20 * 60    # giây cho cả đợt: quá hạn -> bài còn lại để lần sau
+
+def call_with_retry(fn, args, attempts=MAX_ATTEMPTS, backoff=BACKOFF_BASE, sleep=time.sleep):
+    """Gọi fn(*args), lỗi thì thử lại với backoff. Trả về (kết quả, ms lần gọi thành công, số lần thử)."""
+    for attempt in range(1, attempts + 1):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args), (time.perf_counter() - t0) * 1000, attempt
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.25)
+            logger.warning(f"{getattr(fn, '__name__', 'call')}: lỗi lần {attempt}/{attempts} ({e}) -> thử lại sau {delay:.1f}s")
+            sleep(delay)
+
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))  # nearest-rank
+    return round(ordered[rank - 1], 1)
+
+class GradingPipeline:
+    """
+    grade_fn(item) -> kết quả 1 bài (gọi LLM, chạy trên pool)
+    write_fn(list kết quả) -> số bài đã ghi (chạy trên luồng gọi run, 1 lần / chunk)
+    """
+    def __init__(self, grade_fn, write_fn, workers=GRADING_WORKERS, chunk_size=CHUNK_SIZE,
+                 attempts=MAX_ATTEMPTS, backoff=BACKOFF_BASE, run_timeout=RUN_TIMEOUT):
+        self.grade_fn = grade_fn
+        self.write_fn = write_fn
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.attempts = attempts
+        self.backoff = backoff
+        self.run_timeout = run_timeout
+
+    def run(self, items):
+        t_start = time.perf_counter()
+        latencies, buffer = [], []
+        report = {'total': len(items), 'graded': 0, 'written': 0, 'failed': 0, 'retries': 0, 'timed_out': 0}
+
+        def flush():
+            if not buffer: return
+            try:
+                report['written'] += self.write_fn(list(buffer)) or 0
+            except Exception as e:
+                # Chunk lỗi ghi -> các bài này vẫn chưa chấm trong DB, lần chạy sau chấm lại
+                logger.error(f"Grading: lỗi ghi chunk {len(buffer)} bài: {e}")
+            buffer.clear()
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ai-grading')
+        try:
+            futures = [executor.submit(call_with_retry, self.grade_fn, (item,), self.attempts, self.backoff)
+                       for item in items]
+            try:
+                for future in as_completed(futures, timeout=self.run_timeout):
+                    try:
+                        result, elapsed_ms, attempt = future.result()
+                    except Exception as e:
+                        report['failed'] += 1
+                        logger.error(f"Grading: bỏ qua 1 bài sau {self.attempts} lần thử: {e}")
+                        continue
+                    latencies.append(elapsed_ms)
+                    report['retries'] += attempt - 1
+                    report['graded'] += 1
+                    buffer.append(result)
+                    if len(buffer) >= self.chunk_size:
+                        flush()
+            except FutureTimeout:
+                report['timed_out'] = sum(1 for f in futures if not f.done())
+                for f in futures: f.cancel()
+            flush()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = time.perf_counter() - t_start
+        report.update({
+            'elapsed_s': round(elapsed, 2),
+            'per_second': round(report['graded'] / elapsed, 2) if elapsed > 0 else 0.0,
+            'llm_p50_ms': percentile(latencies, 50),
+            'llm_p95_ms': percentile(latencies, 95),
+        })
+        return report
@@ -0,0 +1,305 @@
+# services/ingestion_service.py
+# --- HÀNG ĐỢI NẠP TÀI LIỆU ĐÀO TẠO (PDF) CHẠY NỀN ---
+# Upload xong chỉ đẩy MaterialID vào hàng đợi rồi trả về ngay. 1 luồng nền chạy pipeline:
+#   extract (pool process, CPU) -> chunk -> embed (Gemini, theo lô) -> write TRAINING_KNOWLEDGE_CHUNKS
+#   -> nạp vào RAG index đang chạy (RagMemoryService.ingest_material).
+# Tiến độ từng MaterialID: RAM + Redis hash ingest:job:<id> (mọi process waitress đều xem được).
+# Chạy lại an toàn (idempotent):
+#  - Text trang lưu trong DocumentTextStore theo (MaterialID, mtime) -> lần sau không trích lại.
+#  - Embedding ghi checkpoint theo lô (ingest_jobs/<id>_<mtime>.vectors.jsonl) -> chết giữa chừng chỉ embed phần còn lại.
+#  - Bước write xóa chunk cũ + chèn mới trong 1 transaction -> chạy lại không nhân đôi chunk.
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import sys
+from contextlib import nullcontext
+from datetime import datetime
+import google.generativeai as genai
+import threading
+import logging
+import queue
+import json
+import re
+import os
+import config
+from services.document_text_store import get_document_store
+from services.grading_pool import call_with_retry
+from services.pdf_extract import count_pages, extract_page_range
+from services.rag_memory_service import EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+INGEST_PROCESSES = 2        # Process con trích text (CPU-bound)
+PAGES_PER_TASK = 25         # Số trang / tác vụ gửi sang process con
+CHUNK_CHARS = 1200          # Độ dài chunk (ký tự)
+CHUNK_OVERLAP = 200         # Phần gối đầu giữa 2 chunk liền nhau
+EMBED_BATCH = 50            # Số chunk / lời gọi embed_content
+WRITE_BATCH = 200           # Số dòng / executemany
+JOB_KEY = 'ingest:job:{}'
+JOB_TTL = 7 * 24 * 3600
+
+INSERT_CHUNK_SQL = "INSERT INTO TRAINING_KNOWLEDGE_CHUNKS (MaterialID, ChunkText, VectorData, PageIndex) VALUES (?, ?, ?, ?)"
+
+def split_page_chunks(page_texts, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """[(PageIndex (từ 1), đoạn text)]: cắt từng trang theo khoảng trắng gần nhất, gối đầu overlap ký tự."""
+    chunks = []
+    for page_no, text in enumerate(page_texts, start=1):
+        text = re.sub(r'\s+', ' ', text or '').strip()
+        start = 0
+        while start < len(text):
+            end = min(len(text), start + size)
+            if end < len(text):
+                cut = text.rfind(' ', start + size // 2, end)
+                if cut > start: end = cut
+            piece = text[start:end].strip()
+            if len(piece) >= 30:  # Bỏ mẩu vụn (số trang, header)
+                chunks.append((page_no, piece))
+            if end >= len(text): break
+            start = max(end - overlap, start + 1)
+    return chunks
+
+class IngestionService:
+    def __init__(self, db_manager, rag_service=None, app=None, summarize_fn=None, job_dir=None):
+        self.db = db_manager
+        self.rag_service = rag_service
+        self.app = app                        # Luồng nền chạy trong app_context (DBManager log qua current_app)
+        self.root_path = app.root_path if app else ''
+        self.redis = getattr(app, 'redis_client', None)
+        self.summarize_fn = summarize_fn      # text 5 trang đầu -> tóm tắt (LibraryService._ai_categorize_document)
+        self.job_dir = job_dir or config.INGEST_JOB_DIR
+        self._queue = queue.Queue()
+        self._pending = set()                 # MaterialID đang chờ / đang chạy (chống enqueue trùng)
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name='ingestion')
+        self._thread.start()
+
+    # =========================================================================
+    # API
+    # =========================================================================
+    def enqueue(self, material_id, file_path=None, force=False):
+        """Không chặn: trả về tiến độ hiện tại. force=True -> bỏ checkpoint, embed lại từ đầu."""
+        mid = str(material_id)
+        with self._lock:
+            if mid in self._pending:
+                return self.get_progress(mid)
+            self._pending.add(mid)
+        self._set_progress(mid, stage='queued', status='QUEUED', done=0, total=0, error='')
+        self._queue.put((mid, file_path, force))
+        return self.get_progress(mid)
+
+    def get_progress(self, material_id):
+        mid = str(material_id)
+        if self.redis:
+            try:
+                data = self.redis.hgetall(JOB_KEY.format(mid))
+                if data: return data
+            except Exception:
+                pass
+        with self._lock:
+            return dict(self._progress.get(mid, {}))
+
+    def resume_unfinished(self):
+        """Gọi lúc khởi động: job đang dở (server tắt giữa chừng) -> đưa lại vào hàng đợi, chạy tiếp từ checkpoint."""
+        if not self.redis: return 0
+        count = 0
+        try:
+            for key in self.redis.scan_iter(match=JOB_KEY.format('*')):
+                if self.redis.hget(key, 'status') in ('QUEUED', 'RUNNING'):
+                    self.enqueue(key.rsplit(':', 1)[-1])
+                    count += 1
+        except Exception as e:
+            logger.warning(f"Ingestion: không quét được job dở: {e}")
+        return count
+
+    # =========================================================================
+    # VÒNG LẶP NỀN
+    # =========================================================================
+    def _run(self):
+        while True:
+            mid, file_path, force = self._queue.get()
+            try:
+                with (self.app.app_context() if self.app else nullcontext()):
+                    self._process(mid, file_path, force)
+            except Exception as e:
+                logger.error(f"Ingestion: tài liệu #{mid} lỗi: {e}")
+                self._set_progress(mid, status='FAILED', error=str(e)[:500])
+            finally:
+                with self._lock:
+                    self._pending.discard(mid)
+
+    def _set_progress(self, mid, **fields):
+        fields['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._progress.setdefault(mid, {}).update(fields)
+        if self.redis:
+            try:
+                key = JOB_KEY.format(mid)
+                self.redis.hset(key, mapping={k: str(v) for k, v in fields.items()})
+                self.redis.expire(key, JOB_TTL)
+            except Exception:
+                pass
+
+    def _resolve_path(self, mid, file_path):
+        """(đường dẫn thật, đã có TotalPages/Summary chưa)."""
+        rows = self.db.get_data_fast("SELECT FilePath, AI_Processed FROM TRAINING_MATERIALS WHERE MaterialID = ?", (mid,))
+        if not rows: raise ValueError("Tài liệu không tồn tại")
+        file_path = file_path or rows[0]['FilePath']
+        # Cùng quy ước với chat_with_document: '/static/...' là đường dẫn tương đối thư mục app
+        if file_path.startswith('/'):
+            file_path = os.path.join(self.root_path, file_path.lstrip('/'))
+        if not os.path.exists(file_path): raise FileNotFoundError(file_path)
+        return file_path, bool(rows[0].get('AI_Processed'))
+
+    def _process(self, mid, file_path, force):
+        file_path, has_meta = self._resolve_path(mid, file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        self._set_progress(mid, status='RUNNING', file_mtime=mtime, error='')
+
+        # 1. EXTRACT (kho text đã có bản ứng với mtime này -> không trích lại)
+        self._set_progress(mid, stage='extract', done=0, total=0)
+        extracted = []
+        def extract():
+            extracted.append(True)
+            return self._extract_parallel(mid, file_path)
+        doc_index = get_document_store().get_index(mid, file_path, pages_fn=extract)
+        page_texts = [doc_index.get_page(p) for p in range(1, doc_index.total_pages + 1)]
+        if extracted or force or not has_meta:
+            self._write_material_meta(mid, page_texts)
+
+        # 2. CHUNK
+        self._set_progress(mid, stage='chunk', done=0, total=doc_index.total_pages)
+        chunks = split_page_chunks(page_texts)
+        self._set_progress(mid, done=doc_index.total_pages)
+
+        # 3. EMBED (theo lô, checkpoint ra file sau mỗi lô)
+        vectors = self._embed_with_checkpoint(mid, mtime, chunks, force)
+
+        # 4. WRITE (thay toàn bộ chunk của tài liệu trong 1 transaction)
+        self._set_progress(mid, stage='write', done=0, total=len(chunks))
+        self._write_chunks(mid, chunks, vectors)
+        self._set_progress(mid, done=len(chunks))
+
+        if self.rag_service:
+            self.rag_service.ingest_material(mid)
+        self._remove_checkpoints(mid)
+        self._set_progress(mid, stage='done', status='DONE', chunks=len(chunks), pages=doc_index.total_pages)
+        logger.info(f"Ingestion: tài liệu #{mid} xong ({doc_index.total_pages} trang, {len(chunks)} chunk)")
+
+    # -------------------------------------------------------------------------
+    def _get_pool(self):
+        """
+        Pool trích text, tạo 1 lần / process. Luôn dùng spawn (như Windows) kể cả trên Linux:
+        fork sẽ chép cả luồng nền + connection pool DB đang mở sang process con.
+        Process con spawn import lại module main của process cha. Chỉ entry point khai báo
+        SPAWN_SAFE_MAIN = True (server.py: tạo app trong khối __main__) mới dùng process;
+        entry point khác (python app.py, waitress-serve...) -> pool luồng, tránh mỗi process con chạy create_app.
+        """
+        if self._pool is None:
+            if getattr(sys.modules.get('__main__'), 'SPAWN_SAFE_MAIN', False):
+                self._pool = ProcessPoolExecutor(max_workers=INGEST_PROCESSES,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            else:
+                logger.info("Ingestion: entry point không an toàn với spawn -> trích text bằng luồng")
+                self._pool = ThreadPoolExecutor(max_workers=INGEST_PROCESSES, thread_name_prefix='ingest-extract')
+        return self._pool
+
+    def _extract_parallel(self, mid, file_path):
+        pool = self._get_pool()
+        total = pool.submit(count_pages, file_path).result()
+        self._set_progress(mid, total=total)
+        futures = [pool.submit(extract_page_range, file_path, start, start + PAGES_PER_TASK)
+                   for start in range(0, total, PAGES_PER_TASK)]
+        pages = [''] * total
+        done = 0
+        for future in futures:
+            start, texts = future.result()
+            pages[start:start + len(texts)] = texts
+            done += len(texts)
+            self._set_progress(mid, done=done)
+        return pages
+
+    def _write_material_meta(self, mid, pages):
+        """TotalPages + tóm tắt AI cho trang thư viện (như process_new_document trước đây)."""
+        summary = None
+        if self.summarize_fn:
+            try:
+                summary = self.summarize_fn("\n".join(pages[:5]))
+            except Exception as e:
+                logger.warning(f"Ingestion: không tóm tắt được #{mid}: {e}")
+        if summary:
+            self.db.execute_non_query("UPDATE TRAINING_MATERIALS SET TotalPages=?, Summary=?, AI_Processed=1 WHERE MaterialID=?",
+                                      (len(pages), summary, mid))
+        else:
+            self.db.execute_non_query("UPDATE TRAINING_MATERIALS SET TotalPages=?, AI_Processed=1 WHERE MaterialID=?",
+                                      (len(pages), mid))
+
+    def _checkpoint_path(self, mid, mtime):
+        return os.path.join(self.job_dir, f"{mid}_{mtime}.vectors.jsonl")
+
+    def _embed_batch(self, texts):
+        response = genai.embed_content(model=EMBEDDING_MODEL, content=texts, task_type="retrieval_document")
+        vectors = response['embedding']
+        if len(vectors) != len(texts): raise ValueError("Số vector trả về khác số chunk")
+        return vectors
+
+    def _embed_with_checkpoint(self, mid, mtime, chunks, force):
+        path = self._checkpoint_path(mid, mtime)
+        os.makedirs(self.job_dir, exist_ok=True)
+        vectors = []
+        if force and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        vectors.append(json.loads(line))
+                    except ValueError:
+                        break  # Dòng cuối ghi dở -> embed lại từ đây
+            vectors = vectors[:len(chunks)]
+            # Ghi lại phần hợp lệ (bỏ dòng dở) trước khi nối thêm
+            with open(path, 'w', encoding='utf-8') as f:
+                for v in vectors:
+                    f.write(json.dumps(v) + '\n')
+
+        self._set_progress(mid, stage='embed', done=len(vectors), total=len(chunks))
+        with open(path, 'a', encoding='utf-8') as f:
+            for start in range(len(vectors), len(chunks), EMBED_BATCH):
+                batch = [text for _, text in chunks[start:start + EMBED_BATCH]]
+                batch_vectors, _, _ = call_with_retry(self._embed_batch, (batch,))
+                for v in batch_vectors:
+                    f.write(json.dumps([round(float(x), 7) for x in v]) + '\n')
+                f.flush()
+                vectors.extend(batch_vectors)
+                self._set_progress(mid, done=len(vectors))
+        return vectors
+
+    def _write_chunks(self, mid, chunks, vectors):
+        rows = [(int(mid), text, json.dumps([float(x) for x in vec]), page_no)
+                for (page_no, text), vec in zip(chunks, vectors)]
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True  # PyODBC: gửi cả lô trong 1 round-trip
+            except AttributeError:
+                pass
+            cursor.execute("DELETE FROM TRAINING_KNOWLEDGE_CHUNKS WHERE MaterialID = ?", (int(mid),))
+            for i in range(0, len(rows), WRITE_BATCH):
+                cursor.executemany(INSERT_CHUNK_SQL, rows[i:i + WRITE_BATCH])
+                self._set_progress(mid, done=min(i + WRITE_BATCH, len(rows)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _remove_checkpoints(self, mid):
+        try:
+            for name in os.listdir(self.job_dir):
+                if name.startswith(f"{mid}_") and name.endswith('.vectors.jsonl'):
+                    os.remove(os.path.join(self.job_dir, name))
+        except OSError:
+            pass
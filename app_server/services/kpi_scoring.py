@@ -0,0 +1,40 @@
+# services/kpi_scoring.py
+# --- CHẤM ĐIỂM KPI THEO KHUNG NGƯỠNG (VECTOR HÓA BẰNG NUMPY) ---
+# Cùng quy tắc với KPIService.calculate_bucket_score nhưng chấm cả mảng (user, tiêu chí)
+# trong 1 lượt: dùng cho chốt KPI hàng loạt và mô phỏng "what-if" đổi ngưỡng.
+# Đối chiếu kết quả từng phần tử với bản vô hướng: benchmarks/bench_kpi_scoring.py
+
+import numpy as np
+from db_manager import safe_float
+
+THRESHOLD_COLUMNS = ['Threshold_100', 'Threshold_85', 'Threshold_70', 'Threshold_50', 'Threshold_30', 'Threshold_0']
+# Điểm của từng khung theo thứ tự dò; không lọt khung nào -> 0 (Threshold_0 chỉ để hiển thị)
+BUCKET_SCORES = np.array([100, 85, 70, 50, 30], dtype=np.int64)
+
+def score_buckets(actuals, thresholds, is_higher_better, weights=None):
+    """
+    actuals: (n,) giá trị thực tế
+    thresholds: (n, 6) theo thứ tự THRESHOLD_COLUMNS
+    is_higher_better: (n,) bool
+    weights: (n,) trọng số (None -> chỉ trả raw)
+    Trả về (raw_scores int64 (n,), weighted_scores float64 (n,) | None)
+    """
+    actuals = np.asarray(actuals, dtype=np.float64).reshape(-1, 1)
+    thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1, 6)[:, :len(BUCKET_SCORES)]
+    higher = np.asarray(is_higher_better, dtype=bool).reshape(-1, 1)
+
+    # hits[i, j]: phần tử i lọt khung j; khung đầu tiên lọt (argmax của bool) = nhánh if/elif đầu tiên đúng
+    hits = np.where(higher, actuals >= thresholds, actuals <= thresholds)
+    raw = np.where(hits.any(axis=1), BUCKET_SCORES[hits.argmax(axis=1)], 0)
+
+    if weights is None:
+        return raw, None
+    return raw, raw * np.asarray(weights, dtype=np.float64)
+
+def profiles_to_arrays(profiles):
+    """list dict KPI_USER_PROFILE (+ IsHigherBetter) -> (thresholds (n,6), is_higher_better (n,), weights (n,))."""
+    thresholds = np.array([[safe_float(p[c]) for c in THRESHOLD_COLUMNS] for p in profiles],
+                          dtype=np.float64).reshape(-1, 6)
+    is_higher_better = np.array([bool(p['IsHigherBetter']) for p in profiles], dtype=bool)
+    weights = np.array([safe_float(p['Weight']) for p in profiles], dtype=np.float64)
+    return thresholds, is_higher_better, weights
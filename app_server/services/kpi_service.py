@@ -2,7 +2,25 @@
 
 from db_manager import DBManager, safe_float
 from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from datetime import datetime
+from services.parallel_loader import load_sections
+from services.kpi_scoring import score_buckets, profiles_to_arrays
 import math
+import json
+
+# Chốt KPI hàng loạt: số user gọi bộ 4 SP song song (mỗi luồng 1 connection từ pool DB)
+KPI_FETCH_WORKERS = 4
+KPI_FETCH_TIMEOUT = 1800  # giây cho cả đợt
+KPI_SUBORDINATE_CRITERIA = 'KPI_SYS_04'
+KPI_IN_CHUNK = 1000       # Số UserCode tối đa / mệnh đề IN (...) (SQL Server giới hạn 2100 tham số)
+
+# Snapshot số liệu thực tế (kết quả bộ 4 SP) theo (user, năm, tháng) -> mô phỏng what-if không gọi lại ERP
+KPI_SNAPSHOT_PREFIX = 'kpi_actuals'
+KPI_SNAPSHOT_MAX_AGE = 6 * 3600      # giây: cũ hơn -> mô phỏng tự lấy lại từ ERP
+KPI_SNAPSHOT_TTL = 40 * 86400        # giữ qua kỳ chốt tháng sau
+SNAPSHOT_TS_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 class KPIService:
     def __init__(self, db_manager: DBManager):
@@ -24,16 +42,45 @@ class KPIService:
         sales_target_yr = safe_float(data[0]['SalesTarget']) if data and data[0]['SalesTarget'] else 0
         admin_target_yr = safe_float(data[0]['AdminTarget']) if data and data[0]['AdminTarget'] else 0
         
+        return self._monthly_targets(sales_target_yr, admin_target_yr)
+
+    def _monthly_targets(self, sales_target_yr, admin_target_yr):
         return {
             'sales_month': (sales_target_yr / 12) if sales_target_yr > 0 else 1000000000.0,
             'admin_month': (admin_target_yr / 12) if admin_target_yr > 0 else 1000000000.0
         }
 
+    def _user_chunks(self, user_codes):
+        """None -> [None] (không lọc); list -> các lô <= KPI_IN_CHUNK để ghép mệnh đề IN (...)."""
+        if user_codes is None:
+            return [None]
+        users = sorted({str(u).strip() for u in user_codes})
+        return [users[i:i + KPI_IN_CHUNK] for i in range(0, len(users), KPI_IN_CHUNK)]
+
+    def _get_targets_bulk(self, year, user_codes=None):
+        """Chỉ tiêu tháng của các user trong lô (None = tất cả), mỗi lô IN (...) 1 query."""
+        rows = []
+        for chunk in self._user_chunks(user_codes):
+            user_filter = f" AND RTRIM([PHU TRACH DS]) IN ({','.join(['?'] * len(chunk))})" if chunk else ""
+            query = f"""
+                SELECT RTRIM([PHU TRACH DS]) AS UserCode, SUM(ISNULL(DK, 0)) AS TargetYear
+                FROM [CRM_STDD].[dbo].[DTCL] WHERE Nam = ? AND [PHU TRACH DS] IS NOT NULL{user_filter}
+                GROUP BY RTRIM([PHU TRACH DS])
+            """
+            rows.extend(self.db.get_data(query, (year, *(chunk or []))) or [])
+        targets = {}
+        for row in rows:
+            target_yr = safe_float(row['TargetYear'])
+            # DS hỗ trợ (Thư ký) cũng lấy từ cột [PHU TRACH DS] -> 2 chỉ tiêu trùng nhau
+            targets[str(row['UserCode']).strip()] = self._monthly_targets(target_yr, target_yr)
+        return targets
+
     
-    def fetch_all_actuals(self, year, month, user_code):
+    def fetch_all_actuals(self, year, month, user_code, targets=None):
         """
         Gọi Master SPs để lấy toàn bộ chỉ số thực tế của User.
         Tự động tính toán các chỉ số phái sinh (như % hoàn thành).
+        targets: chỉ tiêu tháng đã nạp sẵn (chốt hàng loạt) -> bỏ qua query _get_targets.
         """
         actuals = {}
         
@@ -45,7 +92,7 @@ class KPIService:
             sd = sales_data[0][0]
             
             # Lấy Target tháng linh hoạt (Sales vs Admin)
-            targets = self._get_targets(user_code, year)
+            targets = targets or self._get_targets(user_code, year)
             
             # --- CHỈ SỐ NHÓM KINH DOANH (SALES) ---
             actual_sales_total = safe_float(sd.get('Actual_Sales_Total', 0))
@@ -178,141 +225,332 @@ class KPIService:
 
     
     def evaluate_monthly_kpi(self, user_code, year, month):
-        """Hàm CHÍNH: Lấy Cấu hình -> Quét Thực tế -> Chấm điểm -> Lưu DB"""
-        
-        # 1. Lấy Profile KPI
-        query_profile = """
-            SELECT P.*, C.CriteriaName, C.CalculationType, C.IsHigherBetter
+        """Hàm CHÍNH: Lấy Cấu hình -> Quét Thực tế -> Chấm điểm -> Lưu DB (1 user = lô 1 phần tử)."""
+        result = self.evaluate_monthly_kpi_bulk(year, month, user_codes=[user_code])
+        if not result.get('success'):
+            return result
+        if user_code not in result['scores']:
+            if user_code in result['failed']:
+                return {"success": False, "message": f"Lỗi lấy dữ liệu thực tế từ ERP cho {user_code}"}
+            return {"success": False, "message": f"Không tìm thấy cấu hình KPI cho {user_code}"}
+        return {"success": True, "total_score": result['scores'][user_code], "message": "Đã quét ERP & chốt KPI thành công."}
+
+    # =========================================================================
+    # CHỐT KPI HÀNG LOẠT (CẢ PHÒNG BAN / CÔNG TY)
+    # Cấu hình, ngưỡng, điểm thủ công, cây [CAP TREN]: mỗi thứ 1 query.
+    # Bộ 4 SP thực tế: chạy song song theo user (SP hiện nhận 1 @UserCode).
+    # Ghi kết quả: 1 transaction, 1 DELETE + 1 executemany.
+    # =========================================================================
+    def _load_profiles_bulk(self, user_codes=None, department=None):
+        """{user: [profile...]} của mọi user có cấu hình KPI đang hiệu lực (lọc theo danh sách / phòng ban)."""
+        query = """
+            SELECT P.UserCode, P.CriteriaID, P.Weight,
+                   P.Threshold_100, P.Threshold_85, P.Threshold_70, P.Threshold_50, P.Threshold_30, P.Threshold_0,
+                   C.CalculationType, C.IsHigherBetter
             FROM dbo.KPI_USER_PROFILE P
             INNER JOIN dbo.KPI_CRITERIA_MASTER C ON P.CriteriaID = C.CriteriaID
-            WHERE P.UserCode = ? AND P.IsActive = 1
+            WHERE P.IsActive = 1
+        """
+        params = []
+        if department:
+            query += " AND P.UserCode IN (SELECT USERCODE FROM [dbo].[GD - NGUOI DUNG] WHERE [BO PHAN] = ?)"
+            params.append(department)
+
+        profiles = defaultdict(list)
+        for chunk in self._user_chunks(user_codes or None):
+            user_filter = f" AND P.UserCode IN ({','.join(['?'] * len(chunk))})" if chunk else ""
+            for p in self.db.get_data(query + user_filter, (*params, *(chunk or []))) or []:
+                profiles[str(p['UserCode']).strip()].append(p)
+        return profiles
+
+    def _load_hierarchy(self, managers=None):
+        """{cấp trên: [cấp dưới...]} từ cột [CAP TREN]. managers: chỉ lấy cấp dưới trực tiếp của các user này."""
+        rows = []
+        for chunk in self._user_chunks(managers):
+            manager_filter = f" AND RTRIM([CAP TREN]) IN ({','.join(['?'] * len(chunk))})" if chunk else ""
+            rows.extend(self.db.get_data(
+                f"SELECT USERCODE, [CAP TREN] FROM [dbo].[GD - NGUOI DUNG] WHERE [CAP TREN] IS NOT NULL{manager_filter}",
+                tuple(chunk or ())
+            ) or [])
+        children = defaultdict(list)
+        for row in rows:
+            manager = str(row['CAP TREN'] or '').strip()
+            if manager:
+                children[manager].append(str(row['USERCODE']).strip())
+        return children
+
+    def _topological_order(self, user_codes, children):
+        """Cấp dưới trước, cấp trên sau (KPI_SYS_04 của sếp cần tổng điểm của nhân viên)."""
+        batch = set(user_codes)
+        pending = {u: sum(1 for c in children.get(u, []) if c in batch and c != u) for u in batch}
+        parent_of = {c: m for m, subs in children.items() if m in batch for c in subs if c in batch and c != m}
+        ready = sorted(u for u, n in pending.items() if n == 0)
+        order = []
+        while ready:
+            user = ready.pop()
+            order.append(user)
+            manager = parent_of.get(user)
+            if manager:
+                pending[manager] -= 1
+                if pending[manager] == 0:
+                    ready.append(manager)
+        if len(order) < len(batch):  # Vòng lặp trong cây [CAP TREN] (dữ liệu lỗi) -> chấm phần còn lại cuối cùng
+            rest = sorted(batch - set(order))
+            current_app.logger.warning(f"KPI: cây [CAP TREN] có vòng lặp quanh {rest}")
+            order.extend(rest)
+        return order
+
+    def fetch_all_actuals_bulk(self, year, month, user_codes):
+        """{user: actuals} cho cả lô. User lỗi/timeout không có trong kết quả (không ghi đè điểm cũ)."""
+        targets = self._get_targets_bulk(year, user_codes)
+        args = {user: (year, month, user, targets.get(user) or self._monthly_targets(0, 0)) for user in user_codes}
+        if len(user_codes) == 1:
+            # Chốt 1 user (màn hình KPI): gọi thẳng trên luồng request, không dựng pool
+            user = user_codes[0]
+            t0 = datetime.now()
+            try:
+                results, timings = {user: self.fetch_all_actuals(*args[user])}, {}
+                timings[user] = round((datetime.now() - t0).total_seconds() * 1000, 1)
+            except Exception as e:
+                current_app.logger.error(f"KPI: lỗi lấy thực tế {user}: {e}")
+                results, timings = {user: None}, {user: 'error'}
+        else:
+            sections = {user: (self.fetch_all_actuals, a, None) for user, a in args.items()}
+            # Pool giới hạn KPI_FETCH_WORKERS: bộ 4 SP nặng, không để 1 đợt chốt chiếm hết connection DB
+            with ThreadPoolExecutor(max_workers=KPI_FETCH_WORKERS, thread_name_prefix='kpi-eval') as executor:
+                results, timings = load_sections(sections, timeout=KPI_FETCH_TIMEOUT, executor=executor)
+        actuals_by_user = {u: a for u, a in results.items() if a is not None}
+        for user, actuals in actuals_by_user.items():
+            self._save_actuals_snapshot(user, year, month, actuals)
+        return actuals_by_user, timings
+
+    # =========================================================================
+    # SNAPSHOT SỐ LIỆU THỰC TẾ + MÔ PHỎNG WHAT-IF
+    # =========================================================================
+    def _snapshot_key(self, user_code, year, month):
+        return f"{KPI_SNAPSHOT_PREFIX}:{str(user_code).strip()}:{int(year)}:{int(month)}"
+
+    def _save_actuals_snapshot(self, user_code, year, month, actuals):
+        redis_client = getattr(current_app, 'redis_client', None)
+        if not redis_client: return
+        try:
+            payload = {'fetched_at': datetime.now().strftime(SNAPSHOT_TS_FORMAT), 'actuals': actuals}
+            redis_client.setex(self._snapshot_key(user_code, year, month), KPI_SNAPSHOT_TTL, json.dumps(payload))
+        except Exception as e:
+            current_app.logger.warning(f"KPI: lỗi lưu snapshot {user_code} {month}/{year}: {e}")
+
+    def get_actuals_snapshot(self, user_code, year, month, max_age=KPI_SNAPSHOT_MAX_AGE, force_refresh=False):
+        """
+        Số liệu thực tế của user trong tháng: dùng snapshot nếu còn mới, ngược lại gọi bộ 4 SP và lưu lại.
+        Trả về (actuals, fetched_at: datetime, from_snapshot: bool).
+        """
+        redis_client = getattr(current_app, 'redis_client', None)
+        if redis_client and not force_refresh:
+            try:
+                raw = redis_client.get(self._snapshot_key(user_code, year, month))
+                if raw:
+                    payload = json.loads(raw)
+                    fetched_at = datetime.strptime(payload['fetched_at'], SNAPSHOT_TS_FORMAT)
+                    if (datetime.now() - fetched_at).total_seconds() < max_age:
+                        return payload['actuals'], fetched_at, True
+            except Exception as e:
+                current_app.logger.warning(f"KPI: lỗi đọc snapshot {user_code} {month}/{year}: {e}")
+
+        actuals = self.fetch_all_actuals(year, month, user_code)
+        self._save_actuals_snapshot(user_code, year, month, actuals)
+        return actuals, datetime.now(), False
+
+    def simulate_kpi(self, user_code, year, month, overrides=None, force_refresh=False):
+        """
+        Chấm lại KPI trong RAM với ngưỡng/trọng số đề xuất - KHÔNG ghi DB, không gọi ERP nếu snapshot còn mới.
+        overrides: {CriteriaID: {'Weight': .., 'Threshold_100': .., ..., 'IsHigherBetter': ..}}
+        Tiêu chí THỦ CÔNG và KPI_SYS_04 giữ điểm thô đã chốt, chỉ nhân lại theo trọng số mới.
         """
-        profiles = self.db.get_data(query_profile, (user_code,))
+        overrides = overrides or {}
+        profiles = self._load_profiles_bulk([user_code]).get(str(user_code).strip())
         if not profiles:
             return {"success": False, "message": f"Không tìm thấy cấu hình KPI cho {user_code}"}
 
-        # 2. Xóa các chỉ số TỰ ĐỘNG cũ, GIỮ LẠI chỉ số THỦ CÔNG (MANUAL)
-        delete_query = """
-            DELETE FROM dbo.KPI_MONTHLY_RESULT 
-            WHERE UserCode = ? AND EvalYear = ? AND EvalMonth = ?
-            AND CriteriaID IN (SELECT CriteriaID FROM dbo.KPI_CRITERIA_MASTER WHERE CalculationType != 'MANUAL')
-        """
-        self.db.execute_non_query(delete_query, (user_code, year, month))
+        actuals, fetched_at, from_snapshot = self.get_actuals_snapshot(user_code, year, month, force_refresh=force_refresh)
+        current = {
+            r['CriteriaID']: r for r in self.db.get_data(
+                "SELECT CriteriaID, ActualValue, RawScore, WeightedScore FROM dbo.KPI_MONTHLY_RESULT WHERE UserCode=? AND EvalYear=? AND EvalMonth=?",
+                (user_code, year, month)
+            ) or []
+        }
 
-        # 3. Lấy dữ liệu thực tế từ ERP
-        actuals_dict = self.fetch_all_actuals(year, month, user_code)
+        allowed = {'Weight', 'IsHigherBetter', 'Threshold_100', 'Threshold_85', 'Threshold_70', 'Threshold_50', 'Threshold_30', 'Threshold_0'}
+        def clean(key, value):
+            # JSON form có thể gửi "0"/"false" cho IsHigherBetter
+            return str(value).strip().lower() in ('1', 'true') if key == 'IsHigherBetter' else safe_float(value)
+        proposed = [dict(p, **{k: clean(k, v) for k, v in (overrides.get(p['CriteriaID']) or {}).items() if k in allowed})
+                    for p in profiles]
+
+        # Tiêu chí chấm lại theo ngưỡng: AUTO (trừ SYS_04 - điểm trung bình cấp dưới, không có khung)
+        auto = [p for p in proposed if p['CalculationType'] != 'MANUAL' and p['CriteriaID'] != KPI_SUBORDINATE_CRITERIA]
+        scored = dict(zip([p['CriteriaID'] for p in auto], self.score_profiles([(p, actuals) for p in auto])))
+
+        criteria, total = [], 0
+        for p in proposed:
+            crit_id = p['CriteriaID']
+            now_row = current.get(crit_id) or {}
+            if crit_id in scored:
+                actual_val, raw, weighted = scored[crit_id]
+            else:
+                actual_val, raw = safe_float(now_row.get('ActualValue')), safe_float(now_row.get('RawScore'))
+                weighted = raw * safe_float(p['Weight'])
+            total += weighted
+            criteria.append({
+                'CriteriaID': crit_id, 'Weight': safe_float(p['Weight']),
+                'ActualValue': actual_val, 'RawScore': raw, 'WeightedScore': round(weighted, 4),
+                'CurrentRawScore': safe_float(now_row.get('RawScore')),
+                'CurrentWeightedScore': safe_float(now_row.get('WeightedScore')),
+            })
 
-        insert_query = """
-            INSERT INTO dbo.KPI_MONTHLY_RESULT 
-            (UserCode, EvalYear, EvalMonth, CriteriaID, ActualValue, RawScore, WeightedScore)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+        return {
+            "success": True,
+            "total_score": round(total, 2),
+            "current_total": round(sum(safe_float(r.get('WeightedScore')) for r in current.values()), 2),
+            "criteria": criteria,
+            "snapshot_at": fetched_at.strftime(SNAPSHOT_TS_FORMAT),
+            "from_snapshot": from_snapshot,
+        }
+
+    def score_profiles(self, items):
         """
-        
-        total_score = 0
-        conn = self.db.get_transaction_connection()
-        cursor = conn.cursor()
-        
-        try:
-            for p in profiles:
+        Chấm 1 lượt vector cho list (profile, actuals) - cùng kết quả với calculate_bucket_score từng dòng.
+        Trả về list (actual, raw, weighted) theo đúng thứ tự đầu vào.
+        """
+        if not items: return []
+        actual_vals = [self.get_actual_value_for_criteria(p['CriteriaID'], actuals) for p, actuals in items]
+        thresholds, is_higher_better, weights = profiles_to_arrays([p for p, _ in items])
+        raw, weighted = score_buckets(actual_vals, thresholds, is_higher_better, weights)
+        return [(a, int(r), float(w)) for a, r, w in zip(actual_vals, raw, weighted)]
+
+    def evaluate_monthly_kpi_bulk(self, year, month, user_codes=None, department=None):
+        """
+        Chốt KPI tháng cho nhiều user trong 1 lần chạy.
+        Trả về {success, scores: {user: tổng điểm}, skipped: [không có cấu hình], failed: [lỗi ERP], timings}.
+        """
+        profiles = self._load_profiles_bulk(user_codes, department)
+        requested = [str(u).strip() for u in user_codes] if user_codes else list(profiles)
+        skipped = [u for u in requested if u not in profiles]
+        if not profiles:
+            return {"success": True, "scores": {}, "skipped": skipped, "failed": [], "timings": {}}
+
+        actuals_by_user, timings = self.fetch_all_actuals_bulk(year, month, list(profiles))
+        failed = [u for u in profiles if u not in actuals_by_user]
+        batch = list(actuals_by_user)
+
+        # Chốt cả công ty (không lọc) -> đọc cả tháng 1 lần; có lọc -> chỉ đọc user liên quan (IN ...)
+        scoped = bool(user_codes or department)
+        children = self._load_hierarchy(batch if scoped else None)
+
+        # Điểm thủ công đã chấm của lô + tổng điểm hiện có của cấp dưới nằm ngoài lô (cho KPI_SYS_04)
+        manual_scores = {}
+        for chunk in self._user_chunks(batch if scoped else None):
+            user_filter = f" AND R.UserCode IN ({','.join(['?'] * len(chunk))})" if chunk else ""
+            for r in self.db.get_data(f"""
+                SELECT R.UserCode, R.CriteriaID, R.WeightedScore
+                FROM dbo.KPI_MONTHLY_RESULT R
+                INNER JOIN dbo.KPI_CRITERIA_MASTER C ON R.CriteriaID = C.CriteriaID
+                WHERE R.EvalYear = ? AND R.EvalMonth = ? AND C.CalculationType = 'MANUAL'{user_filter}
+            """, (year, month, *(chunk or []))) or []:
+                manual_scores[(str(r['UserCode']).strip(), r['CriteriaID'])] = safe_float(r['WeightedScore'])
+
+        outside_subs = {c for u in batch for c in children.get(u, []) if c not in actuals_by_user}
+        existing_totals = {}
+        for chunk in (self._user_chunks(outside_subs) if scoped else [None]):
+            user_filter = f" AND UserCode IN ({','.join(['?'] * len(chunk))})" if chunk else ""
+            for r in self.db.get_data(f"""
+                SELECT UserCode, SUM(WeightedScore) AS Total FROM dbo.KPI_MONTHLY_RESULT
+                WHERE EvalYear = ? AND EvalMonth = ?{user_filter} GROUP BY UserCode
+            """, (year, month, *(chunk or []))) or []:
+                if r['Total'] is not None:
+                    existing_totals[str(r['UserCode']).strip()] = safe_float(r['Total'])
+
+        # Chấm mọi tiêu chí TỰ ĐỘNG của cả lô trong 1 lượt
+        auto_items = [(user, p) for user in actuals_by_user for p in profiles[user] if p['CalculationType'] != 'MANUAL']
+        auto_scores = {
+            (user, p['CriteriaID']): score
+            for (user, p), score in zip(auto_items, self.score_profiles([(p, actuals_by_user[u]) for u, p in auto_items]))
+        }
+
+        inserts, updates, scores = [], [], {}
+        for user in self._topological_order(list(actuals_by_user), children):
+            rows = {}          # CriteriaID -> (actual, raw, weighted) cần ghi
+            manual_total = 0
+            for p in profiles[user]:
                 crit_id = p['CriteriaID']
-                weight = safe_float(p['Weight'])
-                is_higher_better = bool(p['IsHigherBetter'])
-                calc_type = p['CalculationType']
-                
-                # --- [FIX LOGIC MANUAL] QUAN TRỌNG ---
-                if calc_type == 'MANUAL':
-                    # Kiểm tra xem tiêu chí này đã có điểm trong DB chưa
-                    existing_score_query = "SELECT WeightedScore FROM dbo.KPI_MONTHLY_RESULT WHERE UserCode=? AND CriteriaID=? AND EvalYear=? AND EvalMonth=?"
-                    cursor.execute(existing_score_query, (user_code, crit_id, year, month))
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        # Nếu ĐÃ CÓ (đã chấm trước đó), cộng điểm vào tổng
-                        total_score += safe_float(row[0])
+                if p['CalculationType'] == 'MANUAL':
+                    if (user, crit_id) in manual_scores:
+                        manual_total += manual_scores[(user, crit_id)]
                     else:
-                        # Nếu CHƯA CÓ, tạo dòng dữ liệu giữ chỗ (Placeholder) với điểm = 0
-                        # Để Dashboard có thể hiển thị tiêu chí này ra màn hình
-                        cursor.execute(insert_query, (user_code, year, month, crit_id, 0, 0, 0))
-                    
-                    continue # Bỏ qua phần tính toán tự động bên dưới
-
-                # --- TÍNH TOÁN TIÊU CHÍ TỰ ĐỘNG (AUTO) ---
-                actual_val = self.get_actual_value_for_criteria(crit_id, actuals_dict)
-                raw_score = self.calculate_bucket_score(
-                    actual_val, is_higher_better,
-                    safe_float(p['Threshold_100']), safe_float(p['Threshold_85']),
-                    safe_float(p['Threshold_70']), safe_float(p['Threshold_50']),
-                    safe_float(p['Threshold_30']), safe_float(p['Threshold_0'])
-                )
-                
-                weighted_score = raw_score * weight
-                total_score += weighted_score
-
-                cursor.execute(insert_query, (
-                    user_code, year, month, crit_id, 
-                    actual_val, raw_score, weighted_score
-                ))
-
-            # =========================================================================
-            # TÍNH TOÁN KPI_SYS_04: ĐIỂM TRUNG BÌNH CỦA NHÂN VIÊN CẤP DƯỚI
-            # =========================================================================
-            try:
-                # 1. Tìm các nhân viên mà User này là cấp trên
-                cursor.execute("SELECT USERCODE FROM [dbo].[GD - NGUOI DUNG] WHERE [CAP TREN] = ?", (user_code,))
-                subordinates = cursor.fetchall()
-                
-                if subordinates:
-                    sub_codes = [s[0] for s in subordinates] # Lấy cột đầu tiên
-                    if sub_codes:
-                        placeholders = ','.join(['?'] * len(sub_codes))
-                        # Lấy tổng điểm KPI của nhân viên
-                        query_scores = f"""
-                            SELECT SUM(WeightedScore) 
-                            FROM dbo.KPI_MONTHLY_RESULT 
-                            WHERE EvalYear=? AND EvalMonth=? AND UserCode IN ({placeholders})
-                            GROUP BY UserCode
-                        """
-                        params = [year, month] + sub_codes
-                        cursor.execute(query_scores, tuple(params))
-                        scores_data = cursor.fetchall()
-                        
-                        if scores_data:
-                            # Tính trung bình cộng điểm của các nhân viên có dữ liệu
-                            list_scores = [float(x[0]) for x in scores_data if x[0] is not None]
-                            if list_scores:
-                                avg_score = sum(list_scores) / len(list_scores)
-                                
-                                # Lấy trọng số của KPI_SYS_04 cho Sếp
-                                cursor.execute("SELECT Weight FROM dbo.KPI_USER_PROFILE WHERE UserCode=? AND CriteriaID='KPI_SYS_04' AND IsActive=1", (user_code,))
-                                sys04_profile = cursor.fetchone()
-                                
-                                if sys04_profile:
-                                    weight_04 = float(sys04_profile[0])
-                                    weighted_score_04 = avg_score * weight_04
-                                    
-                                    # Upsert vào bảng kết quả (Update nếu có, Insert nếu chưa)
-                                    cursor.execute("SELECT ResultID FROM dbo.KPI_MONTHLY_RESULT WHERE UserCode=? AND CriteriaID='KPI_SYS_04' AND EvalYear=? AND EvalMonth=?", (user_code, year, month))
-                                    check_exist = cursor.fetchone()
-                                    
-                                    if check_exist:
-                                        cursor.execute("UPDATE dbo.KPI_MONTHLY_RESULT SET ActualValue=?, RawScore=?, WeightedScore=? WHERE ResultID=?", (avg_score, avg_score, weighted_score_04, check_exist[0]))
-                                    else:
-                                        cursor.execute("INSERT INTO dbo.KPI_MONTHLY_RESULT (UserCode, EvalYear, EvalMonth, CriteriaID, ActualValue, RawScore, WeightedScore) VALUES (?, ?, ?, 'KPI_SYS_04', ?, ?, ?)", (user_code, year, month, avg_score, avg_score, weighted_score_04))
-                                    
-                                    total_score += weighted_score_04
-
-            except Exception as e_sub:
-                print(f"⚠️ Lỗi tính điểm cấp dưới (KPI_SYS_04): {e_sub}")
+                        rows[crit_id] = (0, 0, 0)  # Giữ chỗ để Dashboard hiển thị tiêu chí chờ chấm tay
+                    continue
+                rows[crit_id] = auto_scores[(user, crit_id)]
+
+            # KPI_SYS_04: trung bình tổng điểm của cấp dưới (đã chấm trước trong lô, hoặc điểm đang có)
+            sys04 = next((p for p in profiles[user] if p['CriteriaID'] == KPI_SUBORDINATE_CRITERIA), None)
+            if sys04:
+                sub_scores = [scores[s] if s in scores else existing_totals[s]
+                              for s in children.get(user, []) if s in scores or s in existing_totals]
+                if sub_scores:
+                    avg_score = sum(sub_scores) / len(sub_scores)
+                    weighted_04 = avg_score * safe_float(sys04['Weight'])
+                    if (user, KPI_SUBORDINATE_CRITERIA) in manual_scores:
+                        # Tiêu chí cấu hình MANUAL: dòng cũ không bị xóa -> cập nhật tại chỗ
+                        manual_total += weighted_04 - manual_scores[(user, KPI_SUBORDINATE_CRITERIA)]
+                        updates.append((avg_score, avg_score, weighted_04, user, year, month, KPI_SUBORDINATE_CRITERIA))
+                    else:
+                        rows[KPI_SUBORDINATE_CRITERIA] = (avg_score, avg_score, weighted_04)
 
-            conn.commit()
-            return {"success": True, "total_score": round(total_score, 2), "message": "Đã quét ERP & chốt KPI thành công."}
+            scores[user] = manual_total + sum(w for _, _, w in rows.values())
+            inserts.extend((user, year, month, crit_id, a, r, w) for crit_id, (a, r, w) in rows.items())
 
+        written_users = list(scores)
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True
+            except AttributeError:
+                pass
+            # Xóa các chỉ số TỰ ĐỘNG cũ, GIỮ LẠI chỉ số THỦ CÔNG (MANUAL); chia lô tránh giới hạn 2100 tham số
+            for i in range(0, len(written_users), 500):
+                chunk = written_users[i:i + 500]
+                cursor.execute(f"""
+                    DELETE FROM dbo.KPI_MONTHLY_RESULT 
+                    WHERE EvalYear = ? AND EvalMonth = ? AND UserCode IN ({','.join(['?'] * len(chunk))})
+                    AND CriteriaID IN (SELECT CriteriaID FROM dbo.KPI_CRITERIA_MASTER WHERE CalculationType != 'MANUAL')
+                """, (year, month, *chunk))
+            if inserts:
+                cursor.executemany("""
+                    INSERT INTO dbo.KPI_MONTHLY_RESULT 
+                    (UserCode, EvalYear, EvalMonth, CriteriaID, ActualValue, RawScore, WeightedScore)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, inserts)
+            if updates:
+                cursor.executemany("""
+                    UPDATE dbo.KPI_MONTHLY_RESULT SET ActualValue=?, RawScore=?, WeightedScore=?
+                    WHERE UserCode=? AND EvalYear=? AND EvalMonth=? AND CriteriaID=?
+                """, updates)
+            conn.commit()
         except Exception as e:
             conn.rollback()
+            current_app.logger.error(f"LỖI CHỐT KPI HÀNG LOẠT ({month}/{year}): {e}")
             return {"success": False, "message": str(e)}
         finally:
             conn.close()
 
+        return {
+            "success": True,
+            "scores": {u: round(v, 2) for u, v in scores.items()},
+            "skipped": skipped,
+            "failed": failed,
+            "timings": timings,
+        }
+
     def get_kpi_results_for_view(self, user_code, year, month):
         """Lấy dữ liệu hiển thị lên Dashboard KPI của nhân viên"""
         """Lấy dữ liệu hiển thị lên Dashboard KPI của nhân viên"""
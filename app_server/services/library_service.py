@@ -3,17 +3,23 @@ import PyPDF2
 from flask import current_app
 import google.generativeai as genai
 import json
+from services.document_text_store import get_document_store
 
 class LibraryService:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, rag_service=None, ingestion_service=None):
         self.db = db_manager
+        self.rag_service = rag_service  # RagMemoryService: nạp chunk mới vào index đang chạy
+        self.ingestion_service = ingestion_service  # Có -> xử lý PDF ở hàng đợi nền, upload trả về ngay
 
     # --- 1. XỬ LÝ FILE PDF KHI UPLOAD ---
     def process_new_document(self, file_path, material_id):
         """
         Đọc PDF, tách text theo từng trang và lưu lại để AI tra cứu sau này.
         (Trong thực tế, đoạn này nên lưu vào Vector DB như ChromaDB/FAISS)
+        Có ingestion_service -> chỉ xếp hàng (extract -> chunk -> embed -> ghi chunk chạy nền), trả về tiến độ ngay.
         """
+        if self.ingestion_service:
+            return self.ingestion_service.enqueue(material_id, file_path)
         try:
             reader = PyPDF2.PdfReader(file_path)
             total_pages = len(reader.pages)
@@ -38,8 +44,18 @@ class LibraryService:
             with open(json_path, 'w', encoding='utf-8') as f:
                 json.dump(full_text_map, f, ensure_ascii=False)
 
+            # Trích sẵn vào kho text theo trang (Chat với tài liệu không phải đọc lại PDF)
+            try:
+                get_document_store().get_index(material_id, file_path, pages=[p['content'] or '' for p in full_text_map])
+            except Exception as e:
+                print(f"Warning: chưa đánh chỉ mục text tài liệu #{material_id}: {e}")
+
             sql = "UPDATE TRAINING_MATERIALS SET TotalPages=?, Summary=?, AI_Processed=1 WHERE MaterialID=?"
             self.db.execute_non_query(sql, (total_pages, summary, material_id))
+
+            # Tài liệu đã có chunk embedding -> đưa ngay vào RAG index (không cần restart)
+            if self.rag_service:
+                self.rag_service.ingest_material(material_id)
             
             return True
         except Exception as e:
@@ -0,0 +1,80 @@
+# services/parallel_loader.py
+# --- CHẠY SONG SONG CÁC KHỐI DASHBOARD ĐỘC LẬP ---
+# Mỗi khối (widget) chạy trên 1 luồng riêng, tự lấy connection riêng từ pool
+# của DBManager. Khối nào chậm quá timeout -> trả giá trị mặc định của khối đó,
+# các khối khác không bị kéo theo. Thời gian cold load = khối chậm nhất.
+# Mỗi lần gọi có pool riêng (1 luồng / khối): request này không phải xếp hàng sau khối của
+# request khác. Số query đồng thời thực tế do pool connection của DBManager chặn (10 + 20 overflow).
+# Timeout tính từ lúc khối BẮT ĐẦU CHẠY, không tính thời gian chờ trong hàng đợi của pool.
+
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+SECTION_TIMEOUT = 20  # giây, tính từ lúc khối bắt đầu chạy
+QUEUE_TIMEOUT = 60    # giây: khối xếp hàng quá lâu trong pool truyền vào (executor=...) mà chưa được chạy -> bỏ
+POLL_INTERVAL = 0.5   # giây: chu kỳ kiểm tra khối vừa bắt đầu chạy
+
+def _run_in_context(app, fn, args, started, name):
+    started[name] = time.perf_counter()
+    with app.app_context():
+        result = fn(*args)
+        return result, (time.perf_counter() - started[name]) * 1000
+
+def load_sections(sections, timeout=SECTION_TIMEOUT, executor=None):
+    """
+    sections: {tên_khối: (hàm, (tham số...), giá_trị_mặc_định)}
+    executor: pool dùng chung để giới hạn số luồng (VD: cache warmer). Bỏ trống -> pool riêng cho lần gọi này.
+    Trả về (results, timings):
+      - results: {tên_khối: kết quả | mặc định nếu lỗi/timeout}
+      - timings: {tên_khối: ms | 'timeout' | 'error', 'total': ms}
+    """
+    app = current_app._get_current_object()
+    t_start = time.perf_counter()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, len(sections)), thread_name_prefix='dashboard')
+
+    started = {}
+    futures = {
+        executor.submit(_run_in_context, app, fn, args, started, name): name
+        for name, (fn, args, _) in sections.items()
+    }
+
+    results, timings = {}, {}
+    pending = set(futures)
+    try:
+        while pending:
+            now = time.perf_counter()
+            for future in list(pending):
+                name = futures[future]
+                begun = started.get(name)
+                expired = (now - begun > timeout) if begun else (now - t_start > QUEUE_TIMEOUT)
+                if expired and not future.done():
+                    future.cancel()  # Chưa kịp chạy thì bỏ, đang chạy thì để luồng tự kết thúc
+                    current_app.logger.warning(
+                        f"Dashboard: khối '{name}' " + (f"chạy quá {timeout}s" if begun else f"chờ pool quá {QUEUE_TIMEOUT}s")
+                        + " -> dùng mặc định")
+                    results[name], timings[name] = sections[name][2], 'timeout'
+                    pending.discard(future)
+
+            # Chờ tới khi có khối xong, khối đang chạy hết hạn, hoặc tới chu kỳ kiểm tra khối mới bắt đầu
+            deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+            wait_for = min([POLL_INTERVAL] + [d - time.perf_counter() for d in deadlines])
+            done, _ = wait(pending, timeout=max(0, wait_for), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                pending.discard(future)
+                try:
+                    results[name], elapsed = future.result()
+                    timings[name] = round(elapsed, 1)
+                except Exception as e:
+                    current_app.logger.error(f"Dashboard: lỗi khối '{name}': {e}")
+                    results[name], timings[name] = sections[name][2], 'error'
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)  # Khối quá hạn vẫn chạy nốt trên luồng của nó, không giữ request
+
+    results = {name: results[name] for name in sections}  # Giữ thứ tự khối như bên gọi khai báo
+    timings['total'] = round((time.perf_counter() - t_start) * 1000, 1)
+    return results, timings
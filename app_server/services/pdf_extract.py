@@ -0,0 +1,22 @@
+# services/pdf_extract.py
+# --- TRÍCH TEXT PDF CHẠY TRONG PROCESS CON (multiprocessing) ---
+# Module này chỉ phụ thuộc PyPDF2: process con (spawn) không cần Flask / config / kết nối DB.
+# Lưu ý: spawn còn import lại module main của process cha -> chỉ entry point tạo app trong
+# khối if __name__ == '__main__' và khai báo SPAWN_SAFE_MAIN (server.py) mới chạy module này ở process con;
+# entry point khác (python app.py) gọi thẳng trên luồng (IngestionService._get_pool).
+
+import PyPDF2
+
+def count_pages(pdf_path):
+    return len(PyPDF2.PdfReader(pdf_path).pages)
+
+def extract_page_range(pdf_path, start, end):
+    """Text các trang [start, end) (đánh số từ 0). Trang lỗi / ảnh scan -> chuỗi rỗng."""
+    reader = PyPDF2.PdfReader(pdf_path)
+    texts = []
+    for i in range(start, min(end, len(reader.pages))):
+        try:
+            texts.append(reader.pages[i].extract_text() or '')
+        except Exception:
+            texts.append('')
+    return start, texts
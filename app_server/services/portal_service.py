@@ -4,6 +4,8 @@ import pyodbc
 from db_manager import DBManager, safe_float
 import config
 from datetime import datetime, timedelta
+from services.parallel_loader import load_sections
+from services.swr_cache import get_or_compute, refresh, invalidate
 
 class PortalService:
     def __init__(self, db_manager: DBManager):
@@ -50,377 +52,316 @@ class PortalService:
             
         return ordered_groups
 
-    def get_all_dashboard_data(self, user_code, bo_phan, role):
-        data = {
-            'sales_kpi': {'actual': 0, 'target': 0, 'percent': 0},
-            'tasks': [], 
-            'overdue_debt': [], 
-            'orders_stat': 0, 
-            'active_quotes': [], 
-            'pending_deliveries': [],
-            'orders_flow': [], 
-            'urgent_replenish': [], 
-            'recent_reports': [],
-            'errors': {} 
-        }
+    # =========================================================
+    # CÁC KHỐI (SECTION) CỦA PORTAL
+    # Mỗi khối: 1 connection riêng từ pool, chạy song song, cache riêng với TTL riêng.
+    # Khối lỗi -> raise (không cache), load_sections trả giá trị mặc định của khối đó.
+    # =========================================================
+    def _fetch_all(self, query, params=()):
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            if not cursor.description: return []
+            cols = [c[0] for c in cursor.description]
+            return [dict(zip(cols, r)) for r in cursor.fetchall()]
+        finally:
+            conn.close()  # Raw connection lấy từ pool -> close() là trả về pool
 
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        
-        # --- LOGIC LỌC CHUNG ---
-        # [CONFIG]: Dùng mã phòng ban từ Config
-        # Sử dụng getattr để tránh lỗi nếu config thiếu biến
+    def _fetch_one(self, query, params=()):
+        rows = self._fetch_all(query, params)
+        return rows[0] if rows else None
+
+    def _erp_filter(self, bo_phan):
+        """Thư ký lọc theo người lập (EmployeeID), Sales lọc theo người phụ trách (SalesManID)."""
+        # [CONFIG]: Dùng mã phòng ban từ Config (getattr để tránh lỗi nếu config thiếu biến)
         dept_thuky = getattr(config, 'DEPT_THUKY', '3.THUKY')
         is_thu_ky = str(bo_phan).strip() == str(dept_thuky).strip()
-        col_filter_erp = "EmployeeID" if is_thu_ky else "SalesManID"
-        
-        TABLE_CUSTOMER_ERP = config.ERP_IT1202
+        return is_thu_ky, ("EmployeeID" if is_thu_ky else "SalesManID")
 
-        # [FIX KẾT NỐI]: Thay thế pyodbc.connect bằng self.db.get_transaction_connection()
-        conn = None
-        try:
-            conn = self.db.get_transaction_connection()
-            cursor = conn.cursor()
-        except Exception as e:
-            data['errors']['connection'] = f"Lỗi kết nối DB: {str(e)}"
-            return data
+    def _section_user_avatar(self, user_code, bo_phan):
+        row = self._fetch_one("SELECT AvatarUrl FROM dbo.TitanOS_UserProfile WHERE LTRIM(RTRIM(UserCode)) = ?", (user_code,))
+        return (row or {}).get('AvatarUrl') or self._default_avatar(user_code)
 
-        # --- LẤY AVATAR TỪ DB ---
-        # --- LẤY AVATAR TỪ DB ---
-        try:
-            cursor.execute("SELECT AvatarUrl FROM dbo.TitanOS_UserProfile WHERE LTRIM(RTRIM(UserCode)) = ?", (user_code,))
-            ava_res = cursor.fetchone()
-            data['user_avatar'] = ava_res[0] if ava_res and ava_res[0] else f"https://ui-avatars.com/api/?background=random&color=fff&size=80&bold=true&name={user_code}"
-        except Exception:
-            data['user_avatar'] = f"https://ui-avatars.com/api/?background=random&color=fff&size=80&bold=true&name={user_code}"
-        # --- 1. KPI: DOANH SỐ ---
-        try:
-            cursor.execute(f"SELECT SUM([DK]) FROM {config.CRM_DTCL} WHERE [Nam]=? AND [PHU TRACH DS]=?", (current_year, user_code))
-            row = cursor.fetchone()
-            monthly_target = (safe_float(row[0]) / 12) if row and row[0] else 0
-            
-            if is_thu_ky:
-                # Tính theo EmployeeID trong bảng OT2001 (OT2001 JOIN GT9000)
-                cursor.execute(f"""
-                    SELECT SUM(H.ConvertedAmount) FROM {config.ERP_GIAO_DICH} H
-                    INNER JOIN {config.ERP_OT2001} O ON H.OrderID = O.SOrderID
-                    WHERE O.EmployeeID=? AND H.TranMonth=? AND H.TranYear=? 
-                    AND H.DebitAccountID='{config.ACC_PHAI_THU_KH}' AND H.CreditAccountID LIKE '{config.ACC_DOANH_THU}'
-                """, (user_code, current_month, current_year))
-            else:
-                cursor.execute(f"""
-                    SELECT SUM(ConvertedAmount) FROM {config.ERP_GIAO_DICH} 
-                    WHERE SalesManID=? AND TranMonth=? AND TranYear=? 
-                    AND DebitAccountID='{config.ACC_PHAI_THU_KH}' AND CreditAccountID LIKE '{config.ACC_DOANH_THU}'
-                """, (user_code, current_month, current_year))
-
-            row = cursor.fetchone()
-            actual_sales = safe_float(row[0]) if row and row[0] else 0
-            percent = (actual_sales / monthly_target * 100) if monthly_target > 0 else 0
-            data['sales_kpi'] = {'actual': actual_sales, 'target': monthly_target, 'percent': round(percent, 1)}
-        except Exception as e:
-            data['errors']['kpi'] = str(e)
-
-        # --- 2. TASK ---
-        try:
-            # [CONFIG]: TASK_TABLE, TASK_LOG_TABLE, TASK STATUSES
-            cursor.execute(f"""
-                SELECT TOP 20 M.TaskID, M.Title, M.Status, M.Priority, M.LastUpdated, M.ObjectID,
-                (SELECT COUNT(*) FROM {config.TASK_LOG_TABLE} L WHERE L.TaskID = M.TaskID) as UpdateCount,
-                CASE WHEN M.LastUpdated >= DATEADD(hour, -24, GETDATE()) THEN 1 ELSE 0 END as IsNewUpdate
-                FROM {config.TASK_TABLE} M
-                WHERE (M.UserCode=? OR M.CapTren=?) 
-                AND M.Status IN ('{config.TASK_STATUS_OPEN}', '{config.TASK_STATUS_PENDING}', '{config.TASK_STATUS_HELP}', '{config.TASK_STATUS_BLOCKED}')
-                ORDER BY CASE WHEN M.Priority='HIGH' THEN 0 ELSE 1 END, M.LastUpdated DESC
-            """, (user_code, user_code))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                data['tasks'] = [dict(zip(cols, r)) for r in cursor.fetchall()]
-        except Exception as e:
-            data['errors']['tasks'] = str(e)
-
-        # --- 3. CÔNG NỢ ---
-        try:
-            # [CONFIG]: CRM_AR_AGING_SUMMARY, RISK_DEBT_VALUE
-            cursor.execute(f"""
-                SELECT TOP 20 
-                    T1.ObjectID, 
-                    ISNULL(C.ShortObjectName, T1.ObjectName) as ObjectName, 
-                    T1.TotalOverdueDebt, 
-                    T1.ReDueDays
-                FROM {config.CRM_AR_AGING_SUMMARY} AS T1
-                LEFT JOIN {TABLE_CUSTOMER_ERP} C ON T1.ObjectID = C.ObjectID 
-                INNER JOIN {config.CRM_DTCL} AS T2 ON T1.ObjectID = T2.[MA KH]
-                WHERE T2.[Nam]=? AND T2.[PHU TRACH DS]=? 
-                AND T1.TotalOverdueDebt > {config.RISK_DEBT_VALUE}
-                ORDER BY T1.TotalOverdueDebt DESC
-            """, (current_year, user_code))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                debt = [dict(zip(cols, r)) for r in cursor.fetchall()]
-                for d in debt: 
-                    d['TotalOverdueDebtFmt'] = "{:,.0f}".format(safe_float(d['TotalOverdueDebt']))
-                data['overdue_debt'] = debt
-        except Exception as e:
-            data['errors']['debt'] = str(e)
-
-        # --- 4. THỐNG KÊ ĐƠN TRONG THÁNG ---
-        try:
-            query_stat = f"""
-                SELECT COUNT(DISTINCT T1.SOrderID)
-                FROM {config.ERP_SALES_DETAIL} T2
-                INNER JOIN {config.ERP_OT2001} T1 ON T2.SOrderID = T1.SOrderID
-                WHERE T1.{col_filter_erp} = ? 
-                AND MONTH(T2.Date01) = MONTH(GETDATE()) AND YEAR(T2.Date01) = YEAR(GETDATE())
-                AND T1.OrderStatus = 1 
-                AND NOT EXISTS (
-                    SELECT 1 FROM {config.ERP_GOODS_RECEIPT_DETAIL} W2
-                    INNER JOIN {config.ERP_GOODS_RECEIPT_MASTER} W1 ON W2.VoucherID = W1.VoucherID
-                    WHERE W2.OTransactionID = T2.TransactionID AND W1.VoucherTypeID = 'PX'
-                )
-            """
-            cursor.execute(query_stat, (user_code,))
-            row = cursor.fetchone()
-            data['orders_stat'] = row[0] if row else 0
-        except Exception as e:
-            data['errors']['orders_stat'] = str(e)
+    def _default_avatar(self, user_code):
+        return f"https://ui-avatars.com/api/?background=random&color=fff&size=80&bold=true&name={user_code}"
 
-        # --- 5. BÁO GIÁ ---
-        try:
-            query = f"""
-                SELECT TOP 40 
-                    T1.QuotationNo as VoucherNo, 
-                    T1.QuotationDate, 
-                    T1.ObjectID, 
-                    ISNULL(C.ShortObjectName, T1.ObjectName) as CustomerName, 
-                    T1.SaleAmount as TotalAmount
-                FROM {config.ERP_QUOTES} T1
-                LEFT JOIN {TABLE_CUSTOMER_ERP} C ON T1.ObjectID = C.ObjectID
-                WHERE T1.{col_filter_erp}=? 
-                AND T1.QuotationDate > DATEADD(day, -30, GETDATE())
-                AND NOT EXISTS (
-                    SELECT 1 FROM {config.ERP_QUOTE_DETAILS} D1 
-                    JOIN {config.ERP_SALES_DETAIL} D2 ON D1.TransactionID = D2.RetransactionID 
-                    WHERE D1.QuotationID = T1.QuotationID
-                )
-                ORDER BY T1.QuotationDate DESC
-            """
-            cursor.execute(query, (user_code,))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                raw_quotes = [dict(zip(cols, r)) for r in cursor.fetchall()]
-                for q in raw_quotes: q['TotalAmount'] = safe_float(q.get('TotalAmount', 0))
-                
-                data['active_quotes'] = self._group_by_customer(raw_quotes, name_key='CustomerName', id_key='ObjectID')
-        except Exception as e:
-            data['errors']['quotes'] = str(e)
-
-        # --- 6. LXH - PENDING DELIVERIES ---
-        try:
-            # [CONFIG]: DELIVERY_WEEKLY_VIEW, DELIVERY_STATUS_DONE
+    def _section_sales_kpi(self, user_code, bo_phan):
+        now = datetime.now()
+        is_thu_ky, _ = self._erp_filter(bo_phan)
+        row = self._fetch_one(f"SELECT SUM([DK]) AS Target FROM {config.CRM_DTCL} WHERE [Nam]=? AND [PHU TRACH DS]=?", (now.year, user_code))
+        monthly_target = (safe_float(row['Target']) / 12) if row and row['Target'] else 0
+
+        if is_thu_ky:
+            # Tính theo EmployeeID trong bảng OT2001 (OT2001 JOIN GT9000)
             query = f"""
-                SELECT DISTINCT TOP 40 
-                    DW.VoucherNo, 
-                    DW.VoucherDate as Request_Day, 
-                    DW.Planned_Day,
-                    DW.ObjectID,
-                    ISNULL(C.ShortObjectName, DW.ObjectName) as ObjectName,
-                    DATEDIFF(day, DW.VoucherDate, GETDATE()) as DaysPending,
-                    DW.DeliveryStatus
-                FROM {config.DELIVERY_WEEKLY_VIEW} DW
-                LEFT JOIN {TABLE_CUSTOMER_ERP} C ON DW.ObjectID = C.ObjectID
-                INNER JOIN {config.ERP_DELIVERY_DETAIL} T2 ON DW.VoucherID = T2.VoucherID
-                INNER JOIN {config.ERP_OT2001} T3 ON T2.RespVoucherID = T3.SOrderID
-                WHERE DW.DeliveryStatus <> '{config.DELIVERY_STATUS_DONE}' 
-                AND T3.{col_filter_erp} = ? 
-                ORDER BY DW.VoucherDate ASC
+                SELECT SUM(H.ConvertedAmount) AS Actual FROM {config.ERP_GIAO_DICH} H
+                INNER JOIN {config.ERP_OT2001} O ON H.OrderID = O.SOrderID
+                WHERE O.EmployeeID=? AND H.TranMonth=? AND H.TranYear=? 
+                AND H.DebitAccountID='{config.ACC_PHAI_THU_KH}' AND H.CreditAccountID LIKE '{config.ACC_DOANH_THU}'
             """
-            cursor.execute(query, (user_code,))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                raw_dels = [dict(zip(cols, r)) for r in cursor.fetchall()]
-                for d in raw_dels: 
-                    d['IsOverdue'] = (d['DaysPending'] or 0) > 3
-                    d['Planned_Day'] = self._fix_date(d.get('Planned_Day'))
-                    d['Request_Day'] = self._fix_date(d.get('Request_Day'))
-                
-                data['pending_deliveries'] = self._group_by_customer(raw_dels, name_key='ObjectName', id_key='ObjectID')
-
-        except Exception as e:
-            data['errors']['delivery'] = str(e)
-
-        # --- 7. LỊCH GIAO HÀNG ---
-        try:
+        else:
             query = f"""
-                SELECT TOP 40 
-                    T1.VoucherNo, 
-                    MIN(T2.Date01) as DeliveryDate, 
-                    T1.ObjectID,
-                    ISNULL(C.ShortObjectName, T1.ObjectName) as CustomerName,
-                    SUM(T2.ConvertedAmount) as SaleAmount
-                FROM {config.ERP_SALES_DETAIL} T2
-                INNER JOIN {config.ERP_OT2001} T1 ON T2.SOrderID = T1.SOrderID
-                LEFT JOIN {TABLE_CUSTOMER_ERP} C ON T1.ObjectID = C.ObjectID
-                WHERE 
-                    T1.{col_filter_erp} = ? 
-                    AND T2.Date01 BETWEEN DATEADD(day, -30, GETDATE()) AND DATEADD(day, 30, GETDATE())
-                    AND T1.VoucherTypeID <> 'DTK' 
-                    AND T1.OrderStatus = 1
-                    AND NOT EXISTS (
-                        SELECT 1
-                        FROM {config.ERP_GOODS_RECEIPT_DETAIL} W2
-                        INNER JOIN {config.ERP_GOODS_RECEIPT_MASTER} W1 ON W2.VoucherID = W1.VoucherID
-                        WHERE W2.OTransactionID = T2.TransactionID
-                        AND W1.VoucherTypeID = 'PX'
-                    )
-                GROUP BY T1.VoucherNo, T1.ObjectID, T1.ObjectName, C.ShortObjectName
-                ORDER BY MIN(T2.Date01) ASC
+                SELECT SUM(ConvertedAmount) AS Actual FROM {config.ERP_GIAO_DICH} 
+                WHERE SalesManID=? AND TranMonth=? AND TranYear=? 
+                AND DebitAccountID='{config.ACC_PHAI_THU_KH}' AND CreditAccountID LIKE '{config.ACC_DOANH_THU}'
             """
-            cursor.execute(query, (user_code,))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                raw_orders = [dict(zip(cols, r)) for r in cursor.fetchall()]
-                for o in raw_orders: 
-                    o['IsOverdue'] = o['DeliveryDate'] < datetime.now()
-                
-                data['orders_flow'] = self._group_by_customer(raw_orders, name_key='CustomerName', id_key='ObjectID')
-
-        except Exception as e:
-            data['errors']['orders'] = str(e)
-
-        # --- 8. DỰ PHÒNG ---
-        try:
-            # Kiểm tra SP tồn tại trong config
-            sp_name = getattr(config, 'SP_REPLENISH_PORTAL', 'sp_GetCustomerReplenishmentSuggest')
-            cursor.execute(f"{{CALL {sp_name} (?, ?)}}", (user_code, current_year))
-            
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                replenish_items = [dict(zip(cols, r)) for r in cursor.fetchall()]
-                
-                if replenish_items:
-                    replenish_items = replenish_items[:40]
-                    for item in replenish_items:
-                        item['QuantitySuggestion'] = "{:,.0f}".format(safe_float(item.get('QuantitySuggestion', 0)))
-                    
-                    data['urgent_replenish'] = self._group_by_customer(replenish_items, name_key='CustomerName', id_key='ItemID')
-
-        except Exception as e:
-            data['errors']['replenish'] = str(e)
-
-        # --- 9. BÁO CÁO ---
-        try:
-            cursor.execute(f"SELECT TOP 20 STT, NGAY, [KHACH HANG] as [TEN DOI TUONG], [NOI DUNG 4] as MucDich FROM {config.TEN_BANG_BAO_CAO} WHERE NGUOI=? AND NGAY >= DATEADD(day, -7, GETDATE()) ORDER BY NGAY DESC", (user_code,))
-            if cursor.description:
-                cols = [c[0] for c in cursor.description]
-                data['recent_reports'] = [dict(zip(cols, r)) for r in cursor.fetchall()]
-        except Exception as e:
-            data['errors']['reports'] = str(e)
-
-        # Quan trọng: Trả kết nối về Pool (Dùng close() với Raw Connection cũng được nhưng an toàn hơn là gọi qua DBManager nếu có API)
-        # Vì đây là Raw Connection lấy từ pool, .close() sẽ trả nó về pool.
-        if conn:
-            conn.close()
-        
-        # =========================================================
-        # [NEW] KÉO DỮ LIỆU HALL OF FAME (BẢNG VÀNG)
-        # =========================================================
-        try:
-            # Tùy chỉnh tên bảng Hall of Fame thực tế của bạn (Ví dụ: TitanOS_HallOfFame)
-            hof_query = """
-                SELECT TOP 1 TargetUser, Title, AuthorUser 
-                FROM dbo.TitanOS_HallOfFame 
-                ORDER BY CreatedAt DESC
-            """
-            cursor.execute(hof_query)
-            hof_res = cursor.fetchone()
-            if hof_res:
-                data['hall_of_fame'] = {
-                    'target': hof_res[0],
-                    'title': hof_res[1],
-                    'author': hof_res[2]
-                }
-            else:
-                data['hall_of_fame'] = None
-        except Exception as e:
-            data['errors']['hof'] = str(e)
-            data['hall_of_fame'] = None
-
-        # =========================================================
-        # [NEW] KÉO DỮ LIỆU TRAINING (HỌC TẬP)
-        # =========================================================
-        try:
-            # Lấy khóa học đang học dở gần nhất của User
-            # Giả định cấu trúc bảng Training của bạn
-            train_query = """
-                SELECT TOP 1 C.CourseName, E.ProgressPct, C.XPReward
-                FROM dbo.TitanOS_CourseEnrollment E
-                INNER JOIN dbo.TitanOS_Courses C ON E.CourseID = C.CourseID
-                WHERE E.UserCode = ? AND E.Status = 'IN_PROGRESS'
-                ORDER BY E.LastAccessed DESC
-            """
-            cursor.execute(train_query, (user_code,))
-            train_res = cursor.fetchone()
-            if train_res:
-                data['training'] = {
-                    'course_name': train_res[0],
-                    'progress': int(train_res[1]),
-                    'xp': train_res[2]
-                }
-            else:
-                data['training'] = None
-        except Exception as e:
-            data['errors']['training'] = str(e)
-            data['training'] = None
-
-        # ... (Bên trong hàm get_portal_data, ngay sau khi kéo dữ liệu user) ...
-        
-        # --- [NEW] KÉO DỮ LIỆU KPI TỔNG QUAN (GAMIFICATION) ---
-        try:
-            current_year = datetime.now().year
-            current_month = datetime.now().month
-            
-            # Lấy tổng điểm KPI tháng hiện tại
-            kpi_query = """
-                SELECT SUM(WeightedScore) as TotalScore 
-                FROM dbo.KPI_MONTHLY_RESULT 
-                WHERE UserCode = ? AND EvalYear = ? AND EvalMonth = ?
-            """
-            cursor.execute(kpi_query, (user_code, current_year, current_month))
-            kpi_res = cursor.fetchone()
-            total_score = float(kpi_res[0]) if kpi_res and kpi_res[0] else 0
-            
-            # Xếp hạng
-            grade = 'D'
-            if total_score >= 101: grade = 'S'
-            elif total_score >= 86: grade = 'A'
-            elif total_score >= 76: grade = 'B'
-            elif total_score >= 61: grade = 'C'
-            
-            data['gamification'] = {
-                'total_score': round(total_score, 1),
-                'grade': grade,
-                'target_left': round(max(0, 100 - total_score), 1)
-            }
-        except Exception as e:
-            data['errors']['gamification'] = str(e)
-
-        # --- [NEW] KÉO TASK TÌNH TRẠNG KHẨN CẤP ---
-        try:
-            task_query = """
-                SELECT 
-                    SUM(CASE WHEN TaskDate < CAST(GETDATE() AS DATE) AND Status != 'Completed' THEN 1 ELSE 0 END) as Overdue,
-                    SUM(CASE WHEN TaskDate = CAST(GETDATE() AS DATE) THEN 1 ELSE 0 END) as Today
-                FROM dbo.Task_Master 
-                WHERE UserCode = ?
-            """
-            cursor.execute(task_query, (user_code,))
-            task_res = cursor.fetchone()
-            data['task_brief'] = {
-                'overdue': int(task_res[0]) if task_res and task_res[0] else 0,
-                'today': int(task_res[1]) if task_res and task_res[1] else 0
-            }
-        except Exception as e:
-             data['errors']['task_brief'] = str(e)
-            
-        return data
\ No newline at end of file
+        row = self._fetch_one(query, (user_code, now.month, now.year))
+        actual_sales = safe_float(row['Actual']) if row and row['Actual'] else 0
+        percent = (actual_sales / monthly_target * 100) if monthly_target > 0 else 0
+        return {'actual': actual_sales, 'target': monthly_target, 'percent': round(percent, 1)}
+
+    def _section_tasks(self, user_code, bo_phan):
+        # [CONFIG]: TASK_TABLE, TASK_LOG_TABLE, TASK STATUSES
+        return self._fetch_all(f"""
+            SELECT TOP 20 M.TaskID, M.Title, M.Status, M.Priority, M.LastUpdated, M.ObjectID,
+            (SELECT COUNT(*) FROM {config.TASK_LOG_TABLE} L WHERE L.TaskID = M.TaskID) as UpdateCount,
+            CASE WHEN M.LastUpdated >= DATEADD(hour, -24, GETDATE()) THEN 1 ELSE 0 END as IsNewUpdate
+            FROM {config.TASK_TABLE} M
+            WHERE (M.UserCode=? OR M.CapTren=?) 
+            AND M.Status IN ('{config.TASK_STATUS_OPEN}', '{config.TASK_STATUS_PENDING}', '{config.TASK_STATUS_HELP}', '{config.TASK_STATUS_BLOCKED}')
+            ORDER BY CASE WHEN M.Priority='HIGH' THEN 0 ELSE 1 END, M.LastUpdated DESC
+        """, (user_code, user_code))
+
+    def _section_overdue_debt(self, user_code, bo_phan):
+        # [CONFIG]: CRM_AR_AGING_SUMMARY, RISK_DEBT_VALUE
+        debt = self._fetch_all(f"""
+            SELECT TOP 20 
+                T1.ObjectID, 
+                ISNULL(C.ShortObjectName, T1.ObjectName) as ObjectName, 
+                T1.TotalOverdueDebt, 
+                T1.ReDueDays
+            FROM {config.CRM_AR_AGING_SUMMARY} AS T1
+            LEFT JOIN {config.ERP_IT1202} C ON T1.ObjectID = C.ObjectID 
+            INNER JOIN {config.CRM_DTCL} AS T2 ON T1.ObjectID = T2.[MA KH]
+            WHERE T2.[Nam]=? AND T2.[PHU TRACH DS]=? 
+            AND T1.TotalOverdueDebt > {config.RISK_DEBT_VALUE}
+            ORDER BY T1.TotalOverdueDebt DESC
+        """, (datetime.now().year, user_code))
+        for d in debt:
+            d['TotalOverdueDebtFmt'] = "{:,.0f}".format(safe_float(d['TotalOverdueDebt']))
+        return debt
+
+    def _section_orders_stat(self, user_code, bo_phan):
+        _, col_filter_erp = self._erp_filter(bo_phan)
+        row = self._fetch_one(f"""
+            SELECT COUNT(DISTINCT T1.SOrderID) AS Total
+            FROM {config.ERP_SALES_DETAIL} T2
+            INNER JOIN {config.ERP_OT2001} T1 ON T2.SOrderID = T1.SOrderID
+            WHERE T1.{col_filter_erp} = ? 
+            AND MONTH(T2.Date01) = MONTH(GETDATE()) AND YEAR(T2.Date01) = YEAR(GETDATE())
+            AND T1.OrderStatus = 1 
+            AND NOT EXISTS (
+                SELECT 1 FROM {config.ERP_GOODS_RECEIPT_DETAIL} W2
+                INNER JOIN {config.ERP_GOODS_RECEIPT_MASTER} W1 ON W2.VoucherID = W1.VoucherID
+                WHERE W2.OTransactionID = T2.TransactionID AND W1.VoucherTypeID = 'PX'
+            )
+        """, (user_code,))
+        return row['Total'] if row else 0
+
+    def _section_active_quotes(self, user_code, bo_phan):
+        _, col_filter_erp = self._erp_filter(bo_phan)
+        raw_quotes = self._fetch_all(f"""
+            SELECT TOP 40 
+                T1.QuotationNo as VoucherNo, 
+                T1.QuotationDate, 
+                T1.ObjectID, 
+                ISNULL(C.ShortObjectName, T1.ObjectName) as CustomerName, 
+                T1.SaleAmount as TotalAmount
+            FROM {config.ERP_QUOTES} T1
+            LEFT JOIN {config.ERP_IT1202} C ON T1.ObjectID = C.ObjectID
+            WHERE T1.{col_filter_erp}=? 
+            AND T1.QuotationDate > DATEADD(day, -30, GETDATE())
+            AND NOT EXISTS (
+                SELECT 1 FROM {config.ERP_QUOTE_DETAILS} D1 
+                JOIN {config.ERP_SALES_DETAIL} D2 ON D1.TransactionID = D2.RetransactionID 
+                WHERE D1.QuotationID = T1.QuotationID
+            )
+            ORDER BY T1.QuotationDate DESC
+        """, (user_code,))
+        for q in raw_quotes: q['TotalAmount'] = safe_float(q.get('TotalAmount', 0))
+        return self._group_by_customer(raw_quotes, name_key='CustomerName', id_key='ObjectID')
+
+    def _section_pending_deliveries(self, user_code, bo_phan):
+        # [CONFIG]: DELIVERY_WEEKLY_VIEW, DELIVERY_STATUS_DONE
+        _, col_filter_erp = self._erp_filter(bo_phan)
+        raw_dels = self._fetch_all(f"""
+            SELECT DISTINCT TOP 40 
+                DW.VoucherNo, 
+                DW.VoucherDate as Request_Day, 
+                DW.Planned_Day,
+                DW.ObjectID,
+                ISNULL(C.ShortObjectName, DW.ObjectName) as ObjectName,
+                DATEDIFF(day, DW.VoucherDate, GETDATE()) as DaysPending,
+                DW.DeliveryStatus
+            FROM {config.DELIVERY_WEEKLY_VIEW} DW
+            LEFT JOIN {config.ERP_IT1202} C ON DW.ObjectID = C.ObjectID
+            INNER JOIN {config.ERP_DELIVERY_DETAIL} T2 ON DW.VoucherID = T2.VoucherID
+            INNER JOIN {config.ERP_OT2001} T3 ON T2.RespVoucherID = T3.SOrderID
+            WHERE DW.DeliveryStatus <> '{config.DELIVERY_STATUS_DONE}' 
+            AND T3.{col_filter_erp} = ? 
+            ORDER BY DW.VoucherDate ASC
+        """, (user_code,))
+        for d in raw_dels:
+            d['IsOverdue'] = (d['DaysPending'] or 0) > 3
+            d['Planned_Day'] = self._fix_date(d.get('Planned_Day'))
+            d['Request_Day'] = self._fix_date(d.get('Request_Day'))
+        return self._group_by_customer(raw_dels, name_key='ObjectName', id_key='ObjectID')
+
+    def _section_orders_flow(self, user_code, bo_phan):
+        _, col_filter_erp = self._erp_filter(bo_phan)
+        raw_orders = self._fetch_all(f"""
+            SELECT TOP 40 
+                T1.VoucherNo, 
+                MIN(T2.Date01) as DeliveryDate, 
+                T1.ObjectID,
+                ISNULL(C.ShortObjectName, T1.ObjectName) as CustomerName,
+                SUM(T2.ConvertedAmount) as SaleAmount
+            FROM {config.ERP_SALES_DETAIL} T2
+            INNER JOIN {config.ERP_OT2001} T1 ON T2.SOrderID = T1.SOrderID
+            LEFT JOIN {config.ERP_IT1202} C ON T1.ObjectID = C.ObjectID
+            WHERE 
+                T1.{col_filter_erp} = ? 
+                AND T2.Date01 BETWEEN DATEADD(day, -30, GETDATE()) AND DATEADD(day, 30, GETDATE())
+                AND T1.VoucherTypeID <> 'DTK' 
+                AND T1.OrderStatus = 1
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM {config.ERP_GOODS_RECEIPT_DETAIL} W2
+                    INNER JOIN {config.ERP_GOODS_RECEIPT_MASTER} W1 ON W2.VoucherID = W1.VoucherID
+                    WHERE W2.OTransactionID = T2.TransactionID
+                    AND W1.VoucherTypeID = 'PX'
+                )
+            GROUP BY T1.VoucherNo, T1.ObjectID, T1.ObjectName, C.ShortObjectName
+            ORDER BY MIN(T2.Date01) ASC
+        """, (user_code,))
+        for o in raw_orders:
+            o['IsOverdue'] = o['DeliveryDate'] < datetime.now()
+        return self._group_by_customer(raw_orders, name_key='CustomerName', id_key='ObjectID')
+
+    def _section_urgent_replenish(self, user_code, bo_phan):
+        sp_name = getattr(config, 'SP_REPLENISH_PORTAL', 'sp_GetCustomerReplenishmentSuggest')
+        replenish_items = self._fetch_all(f"{{CALL {sp_name} (?, ?)}}", (user_code, datetime.now().year))[:40]
+        for item in replenish_items:
+            item['QuantitySuggestion'] = "{:,.0f}".format(safe_float(item.get('QuantitySuggestion', 0)))
+        return self._group_by_customer(replenish_items, name_key='CustomerName', id_key='ItemID')
+
+    def _section_recent_reports(self, user_code, bo_phan):
+        return self._fetch_all(f"SELECT TOP 20 STT, NGAY, [KHACH HANG] as [TEN DOI TUONG], [NOI DUNG 4] as MucDich FROM {config.TEN_BANG_BAO_CAO} WHERE NGUOI=? AND NGAY >= DATEADD(day, -7, GETDATE()) ORDER BY NGAY DESC", (user_code,))
+
+    def _section_hall_of_fame(self, user_code, bo_phan):
+        # Bảng vàng dùng chung cho mọi user (cache key không theo user)
+        row = self._fetch_one("""
+            SELECT TOP 1 TargetUser, Title, AuthorUser 
+            FROM dbo.TitanOS_HallOfFame 
+            ORDER BY CreatedAt DESC
+        """)
+        return {'target': row['TargetUser'], 'title': row['Title'], 'author': row['AuthorUser']} if row else None
+
+    def _section_training(self, user_code, bo_phan):
+        # Khóa học đang học dở gần nhất của User
+        row = self._fetch_one("""
+            SELECT TOP 1 C.CourseName, E.ProgressPct, C.XPReward
+            FROM dbo.TitanOS_CourseEnrollment E
+            INNER JOIN dbo.TitanOS_Courses C ON E.CourseID = C.CourseID
+            WHERE E.UserCode = ? AND E.Status = 'IN_PROGRESS'
+            ORDER BY E.LastAccessed DESC
+        """, (user_code,))
+        if not row: return None
+        return {'course_name': row['CourseName'], 'progress': int(row['ProgressPct']), 'xp': row['XPReward']}
+
+    def _section_gamification(self, user_code, bo_phan):
+        # Tổng điểm KPI tháng hiện tại
+        now = datetime.now()
+        row = self._fetch_one("""
+            SELECT SUM(WeightedScore) as TotalScore 
+            FROM dbo.KPI_MONTHLY_RESULT 
+            WHERE UserCode = ? AND EvalYear = ? AND EvalMonth = ?
+        """, (user_code, now.year, now.month))
+        total_score = float(row['TotalScore']) if row and row['TotalScore'] else 0
+
+        # Xếp hạng
+        grade = 'D'
+        if total_score >= 101: grade = 'S'
+        elif total_score >= 86: grade = 'A'
+        elif total_score >= 76: grade = 'B'
+        elif total_score >= 61: grade = 'C'
+
+        return {
+            'total_score': round(total_score, 1),
+            'grade': grade,
+            'target_left': round(max(0, 100 - total_score), 1)
+        }
+
+    def _section_task_brief(self, user_code, bo_phan):
+        row = self._fetch_one("""
+            SELECT 
+                SUM(CASE WHEN TaskDate < CAST(GETDATE() AS DATE) AND Status != 'Completed' THEN 1 ELSE 0 END) as Overdue,
+                SUM(CASE WHEN TaskDate = CAST(GETDATE() AS DATE) THEN 1 ELSE 0 END) as Today
+            FROM dbo.Task_Master 
+            WHERE UserCode = ?
+        """, (user_code,))
+        return {
+            'overdue': int(row['Overdue']) if row and row['Overdue'] else 0,
+            'today': int(row['Today']) if row and row['Today'] else 0
+        }
+
+    # {khối: (TTL tươi giây, giá trị mặc định, dùng chung mọi user?)}
+    # Số liệu thay đổi trong ngày (doanh số, task) -> vài phút; dữ liệu tĩnh (avatar, bảng vàng) -> vài giờ
+    SECTIONS = {
+        'sales_kpi':          (300,   {'actual': 0, 'target': 0, 'percent': 0}, False),
+        'tasks':              (300,   [], False),
+        'task_brief':         (300,   {'overdue': 0, 'today': 0}, False),
+        'recent_reports':     (600,   [], False),
+        'orders_stat':        (1800,  0, False),
+        'active_quotes':      (1800,  [], False),
+        'pending_deliveries': (1800,  [], False),
+        'orders_flow':        (1800,  [], False),
+        'gamification':       (3600,  None, False),
+        'overdue_debt':       (3600,  [], False),
+        'training':           (3600,  None, False),
+        'urgent_replenish':   (10800, [], False),
+        'hall_of_fame':       (3600,  None, True),
+        'user_avatar':        (21600, None, False),
+    }
+
+    @classmethod
+    def section_cache_key(cls, user_code, section):
+        owner = '_all' if cls.SECTIONS[section][2] else user_code
+        return f"portal:{owner}:{section}"
+
+    def _load_section(self, section, user_code, bo_phan, force=False):
+        ttl = self.SECTIONS[section][0]
+        key = self.section_cache_key(user_code, section)
+        fn = getattr(self, f"_section_{section}")
+        # Bọc {'value': ...}: kết quả rỗng ([] / 0 / None) vẫn là dữ liệu hợp lệ -> vẫn được cache
+        compute = lambda: {'value': fn(user_code, bo_phan)}
+        cached = refresh(key, compute, ttl=ttl) if force else get_or_compute(key, compute, ttl=ttl)
+        if cached is None:  # refresh bị bỏ qua do worker khác đang tính
+            cached = get_or_compute(key, compute, ttl=ttl)
+        return cached['value']
+
+    def get_all_dashboard_data(self, user_code, bo_phan, force_refresh=False):
+        """
+        Dữ liệu Portal: các khối chạy song song trên pool riêng của lần gọi (timeout tính từ lúc
+        khối bắt đầu chạy, xem parallel_loader), mỗi khối cache riêng.
+        force_refresh=True: tính lại và ghi đè cache mọi khối (dùng cho job làm nóng).
+        """
+        sections = {
+            name: (self._load_section, (name, user_code, bo_phan, force_refresh), default)
+            for name, (_, default, _) in self.SECTIONS.items()
+        }
+        results, timings = load_sections(sections)
+
+        data = dict(results)
+        data['user_avatar'] = data['user_avatar'] or self._default_avatar(user_code)
+        data['errors'] = {name: status for name, status in timings.items() if isinstance(status, str)}
+        data['timings'] = timings
+        return data
+
+    def invalidate_sections(self, user_code, sections=None):
+        """Xóa cache 1 vài khối (mặc định: mọi khối riêng của user, giữ khối dùng chung)."""
+        names = sections or [name for name, (_, _, shared) in self.SECTIONS.items() if not shared]
+        for name in names:
+            if name in self.SECTIONS:
+                invalidate(self.section_cache_key(user_code, name))
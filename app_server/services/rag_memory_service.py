@@ -1,13 +1,258 @@
 # services/rag_memory_service.py
 import numpy as np
 import json
+import os
 import logging
 import threading
+import shutil
+import time
+from contextlib import contextmanager
+import config
 import google.generativeai as genai
 from flask import current_app
+from services.embedding_cache import EMBEDDING_CACHE, CONTEXT_CACHE, query_hash
 
 logger = logging.getLogger(__name__)
 GLOBAL_VECTOR_CACHE = None
+GLOBAL_INDEX_SIGNATURES = {}  # Chữ ký từng MaterialID ứng với GLOBAL_VECTOR_CACHE hiện tại
+GLOBAL_INDEX_VERSION = 0      # Phiên bản index (Redis) mà process này đã đồng bộ tới
+
+SIMILARITY_THRESHOLD = 0.55  # Chỉ lấy chunk có cosine > ngưỡng này
+
+# Snapshot nhị phân trên đĩa: mỗi phiên bản 1 thư mục riêng (vectors.npy đọc bằng memmap + meta.json),
+# file con trỏ CURRENT ghi tên thư mục đang dùng. Ghi bản mới KHÔNG đụng tới file đang bị memmap
+# (Windows không cho replace/xóa file đang map) và reader không bao giờ ghép ma trận mới với meta cũ.
+SNAPSHOT_VECTORS_FILE = 'vectors.npy'
+SNAPSHOT_META_FILE = 'meta.json'
+SNAPSHOT_POINTER_FILE = 'CURRENT'
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_KEEP_OLD = 2      # Giữ thêm N bản cũ cho process đang đọc dở con trỏ cũ
+WARMUP_MAX_ATTEMPTS = 10
+WARMUP_RETRY_SECONDS = 60
+MAX_DELTA_MATERIALS = 500  # Quá số tài liệu thay đổi này -> tải lại toàn bộ (tránh IN (...) quá dài)
+
+CHUNK_SELECT_SQL = """
+    SELECT C.MaterialID, ChunkText, VectorData, M.FileName, PageIndex
+    FROM TRAINING_KNOWLEDGE_CHUNKS C JOIN TRAINING_MATERIALS M ON C.MaterialID = M.MaterialID
+"""
+# Chữ ký từng tài liệu: số chunk + ChunkID lớn nhất (thêm/xóa/embed lại chunk đều làm đổi chữ ký)
+CHUNK_SIGNATURE_SQL = """
+    SELECT MaterialID, COUNT(*) AS ChunkCount, MAX(ChunkID) AS MaxChunkID
+    FROM TRAINING_KNOWLEDGE_CHUNKS {where} GROUP BY MaterialID
+"""
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+# Bộ đếm phiên bản index dùng chung giữa các process (INCR mỗi lần nạp tài liệu mới)
+RAG_VERSION_KEY = 'rag:index_version'
+
+class ReadWriteLock:
+    """Nhiều reader (search) chạy song song; writer (hoán đổi index) độc quyền, được ưu tiên."""
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+_INDEX_LOCK = ReadWriteLock()      # Bảo vệ việc đọc/hoán đổi GLOBAL_VECTOR_CACHE
+_REFRESH_LOCK = threading.Lock()   # Chỉ 1 luồng dựng index mới tại 1 thời điểm
+
+def _get_redis():
+    try:
+        return getattr(current_app, 'redis_client', None)
+    except RuntimeError:  # Luồng nền không có app_context
+        return None
+
+def _cleanup_old_versions(folder, keep):
+    """Xóa các thư mục phiên bản cũ, chừa bản đang dùng + SNAPSHOT_KEEP_OLD bản gần nhất. Lỗi (đang bị map) -> bỏ qua."""
+    try:
+        versions = sorted((d for d in os.listdir(folder) if d.startswith('v') and d != keep
+                           and os.path.isdir(os.path.join(folder, d))), reverse=True)
+    except OSError:
+        return
+    for name in versions[SNAPSHOT_KEEP_OLD:]:
+        try:
+            shutil.rmtree(os.path.join(folder, name))
+        except OSError:
+            pass  # Process khác còn memmap (Windows) -> lần ghi sau dọn tiếp
+
+class VectorIndex:
+    """
+    Kho vector trong RAM dạng ma trận liền khối (N x D, float32, đã chuẩn hóa L2)
+    + các mảng metadata song song. Cosine similarity = 1 phép nhân ma trận-vector.
+    """
+    def __init__(self, matrix, texts, file_names, pages, material_ids):
+        self.matrix = matrix
+        self.texts = texts
+        self.file_names = file_names
+        self.pages = pages
+        self.material_ids = material_ids
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Dựng index từ các dòng TRAINING_KNOWLEDGE_CHUNKS (VectorData là chuỗi JSON)."""
+        vectors, texts, file_names, pages, material_ids = [], [], [], [], []
+        dim = None
+        for row in rows:
+            try:
+                vec = np.asarray(json.loads(row['VectorData']), dtype=np.float32)
+            except Exception: continue
+            if vec.ndim != 1 or vec.size == 0: continue
+            if dim is None: dim = vec.size
+            if vec.size != dim: continue  # Bỏ chunk khác số chiều (embed bằng model cũ)
+            vectors.append(vec)
+            texts.append(row['ChunkText'])
+            file_names.append(row['FileName'])
+            pages.append(row['PageIndex'])
+            material_ids.append(str(row.get('MaterialID')))  # Khóa dạng chuỗi, khớp chữ ký trong snapshot
+
+        if not vectors:
+            return cls(np.zeros((0, 0), dtype=np.float32), [], [], [], [])
+        return cls.build(np.vstack(vectors), texts, file_names, pages, material_ids)
+
+    @classmethod
+    def build(cls, matrix, texts, file_names, pages, material_ids):
+        """Chuẩn hóa L2 từng dòng của ma trận thô (N x D) và loại vector 0."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        keep = norms > 0  # Vector 0 không có hướng -> loại như code cũ
+        idx = np.flatnonzero(keep)
+        return cls(
+            np.ascontiguousarray(matrix[keep] / norms[keep, None], dtype=np.float32),
+            [texts[i] for i in idx], [file_names[i] for i in idx],
+            [pages[i] for i in idx], [material_ids[i] for i in idx]
+        )
+
+    def replace_materials(self, material_ids, new_part):
+        """
+        Trả về index MỚI: bỏ mọi chunk thuộc material_ids, nối thêm new_part.
+        Không sửa index hiện tại (reader đang search vẫn dùng bản cũ an toàn).
+        """
+        drop = set(material_ids)
+        keep = np.array([m not in drop for m in self.material_ids], dtype=bool)
+        idx = np.flatnonzero(keep)
+
+        parts = [np.asarray(self.matrix[keep])] if idx.size else []
+        if len(new_part): parts.append(new_part.matrix)
+        if not parts:
+            return VectorIndex(np.zeros((0, 0), dtype=np.float32), [], [], [], [])
+        if len(parts) == 2 and parts[0].shape[1] != parts[1].shape[1]:
+            raise ValueError("Số chiều embedding mới khác snapshot")
+
+        return VectorIndex(
+            np.ascontiguousarray(np.vstack(parts), dtype=np.float32),
+            [self.texts[i] for i in idx] + new_part.texts,
+            [self.file_names[i] for i in idx] + new_part.file_names,
+            [self.pages[i] for i in idx] + new_part.pages,
+            [self.material_ids[i] for i in idx] + new_part.material_ids
+        )
+
+    def save(self, folder, signatures):
+        """
+        Ghi snapshot vào thư mục phiên bản mới rồi đổi con trỏ CURRENT (os.replace 1 file nhỏ, nguyên tử).
+        Bản cũ được dọn sau; bản nào còn bị process khác memmap (Windows khóa) thì để lần ghi sau dọn tiếp.
+        """
+        os.makedirs(folder, exist_ok=True)
+        name = f"v{time.time_ns()}_{os.getpid()}"
+        version_dir = os.path.join(folder, name)
+        os.makedirs(version_dir)
+
+        with open(os.path.join(version_dir, SNAPSHOT_VECTORS_FILE), 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.matrix, dtype=np.float32))
+        meta = {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'rows': len(self),
+            'signatures': {str(k): v for k, v in signatures.items()},
+            'texts': self.texts, 'file_names': self.file_names,
+            'pages': self.pages, 'material_ids': self.material_ids
+        }
+        with open(os.path.join(version_dir, SNAPSHOT_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, default=str)
+
+        pointer = os.path.join(folder, SNAPSHOT_POINTER_FILE)
+        with open(f"{pointer}.{os.getpid()}.tmp", 'w', encoding='utf-8') as f:
+            f.write(name)
+        for attempt in range(5):  # Reader đang mở CURRENT đúng lúc này (Windows) -> thử lại
+            try:
+                os.replace(f"{pointer}.{os.getpid()}.tmp", pointer)
+                break
+            except PermissionError:
+                if attempt == 4: raise
+                time.sleep(0.1)
+        _cleanup_old_versions(folder, keep=name)
+
+    @classmethod
+    def load(cls, folder):
+        """
+        Đọc snapshot mà CURRENT trỏ tới: ma trận mở bằng memmap (zero-copy, nhiều process dùng chung page cache).
+        Trả về (index, signatures) hoặc (None, {}) nếu chưa có / hỏng.
+        """
+        pointer = os.path.join(folder, SNAPSHOT_POINTER_FILE)
+        if not os.path.exists(pointer):
+            return None, {}
+        try:
+            with open(pointer, 'r', encoding='utf-8') as f:
+                version_dir = os.path.join(folder, f.read().strip())
+            with open(os.path.join(version_dir, SNAPSHOT_META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(os.path.join(version_dir, SNAPSHOT_VECTORS_FILE), mmap_mode='r')
+            if meta.get('version') != SNAPSHOT_FORMAT_VERSION or matrix.shape[0] != meta['rows']:
+                return None, {}
+            index = cls(matrix, meta['texts'], meta['file_names'], meta['pages'], meta['material_ids'])
+            return index, {k: tuple(v) for k, v in meta['signatures'].items()}
+        except Exception as e:
+            logger.error(f"Lỗi đọc RAG snapshot: {e}")
+            return None, {}
+
+    def search(self, query_vector, top_k=3, threshold=SIMILARITY_THRESHOLD):
+        """Trả về top_k chunk (similarity giảm dần) có cosine > threshold."""
+        if len(self) == 0: return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0 or q.size != self.matrix.shape[1]: return []
+
+        sims = self.matrix @ (q / q_norm)
+        candidates = np.flatnonzero(sims > threshold)
+        if candidates.size == 0: return []
+        if candidates.size > top_k:
+            part = np.argpartition(sims[candidates], -top_k)[-top_k:]
+            candidates = candidates[part]
+        order = candidates[np.argsort(sims[candidates])[::-1]]
+
+        return [
+            {'similarity': float(sims[i]), 'text': self.texts[i], 'file_name': self.file_names[i], 'page': self.pages[i]}
+            for i in order
+        ]
 
 class RagMemoryService:
     def __init__(self, db_manager):
@@ -17,59 +262,218 @@ class RagMemoryService:
 
     def _background_warmup(self):
         print("\n⏳ [HỆ THỐNG] Đang âm thầm tải kho dữ liệu RAG lên RAM... (Sếp cứ chat bình thường nhé)")
-        self._load_vector_cache()
-        print("✅ [HỆ THỐNG] Tải kho RAG hoàn tất! Trợ lý đọc tài liệu đã sẵn sàng.\n")
+        for attempt in range(WARMUP_MAX_ATTEMPTS):  # DB chưa sẵn sàng lúc khởi động -> thử lại, không ghi gì ra đĩa
+            if self._load_vector_cache() is not None:
+                print("✅ [HỆ THỐNG] Tải kho RAG hoàn tất! Trợ lý đọc tài liệu đã sẵn sàng.\n")
+                return
+            time.sleep(WARMUP_RETRY_SECONDS)
+        logger.error(f"RAG warmup thất bại sau {WARMUP_MAX_ATTEMPTS} lần thử")
 
     def _load_vector_cache(self):
-        global GLOBAL_VECTOR_CACHE
         if GLOBAL_VECTOR_CACHE is not None:
             return GLOBAL_VECTOR_CACHE
         try:
-            sql = "SELECT ChunkText, VectorData, M.FileName, PageIndex FROM TRAINING_KNOWLEDGE_CHUNKS C JOIN TRAINING_MATERIALS M ON C.MaterialID = M.MaterialID"
-            rows = self.db.get_data(sql)
-            if not rows:
-                GLOBAL_VECTOR_CACHE = []
-                return []
-            cache = []
-            for row in rows:
-                try:
-                    vec = np.array(json.loads(row['VectorData']), dtype=np.float32)
-                    cache.append({
-                        'text': row['ChunkText'], 'vector': vec, 'norm': np.linalg.norm(vec),
-                        'file_name': row['FileName'], 'page': row['PageIndex']
-                    })
-                except Exception: continue
-            GLOBAL_VECTOR_CACHE = cache
+            with _REFRESH_LOCK:
+                version = self.get_index_version()
+                index, sigs, synced = self._sync_snapshot()
+                # Chạy bằng snapshot cũ -> version -1 để _refresh_if_stale đồng bộ lại ở lần search sau
+                self._swap_index(index, sigs, version if synced else -1)
             return GLOBAL_VECTOR_CACHE
         except Exception as e:
             logger.error(f"Lỗi tải Vector Cache: {e}")
-            return []
+            return None
+
+    # -------------------------------------------------------------------------
+    # ĐỌC DB CHO INDEX: lỗi SQL phải RAISE (iter_rows), KHÔNG được trả rỗng.
+    # Đọc lỗi mà coi như "0 tài liệu" -> index bị xóa sạch, version bị ghi nhận là đã đồng bộ
+    # và snapshot trên đĩa bị ghi đè bằng bản rỗng. Bên gọi bắt lỗi thì giữ nguyên index cũ.
+    # -------------------------------------------------------------------------
+    def _get_chunk_signatures(self, material_id=None):
+        """{MaterialID(str): (ChunkCount, MaxChunkID)} hiện có trong DB (1 query GROUP BY nhẹ). Lỗi SQL -> raise."""
+        if material_id is None:
+            rows = self.db.iter_rows(CHUNK_SIGNATURE_SQL.format(where=''))
+        else:
+            rows = self.db.iter_rows(CHUNK_SIGNATURE_SQL.format(where='WHERE MaterialID = ?'), (material_id,))
+        return {
+            str(row['MaterialID']): (int(row['ChunkCount']), int(row['MaxChunkID'] or 0))
+            for row in rows
+        }
+
+    def _read_index(self, sql=CHUNK_SELECT_SQL, params=None):
+        """Dựng VectorIndex từ DB (stream iter_rows). Lỗi SQL (kể cả giữa chừng) -> raise, không trả index cụt."""
+        return VectorIndex.from_rows(self.db.iter_rows(sql, params))
+
+    def _apply_delta(self, index, old_sigs, new_sigs, material_ids=None):
+        """
+        Dựng index mới: chỉ kéo lại chunk của các tài liệu có chữ ký khác nhau
+        (mới / embed lại / bị xóa). material_ids: giới hạn phạm vi so sánh.
+        Trả về (index, số tài liệu thay đổi).
+        """
+        scope = set(material_ids) if material_ids is not None else set(new_sigs) | set(old_sigs)
+        changed = [m for m in scope if new_sigs.get(m) != old_sigs.get(m)]
+        if not changed:
+            return index, 0
+
+        if len(changed) > MAX_DELTA_MATERIALS:
+            return self._read_index(), len(changed)
+
+        # Tài liệu bị xóa khỏi DB không có dòng nào -> replace_materials chỉ việc bỏ đi
+        placeholders = ', '.join(['?'] * len(changed))
+        delta_sql = CHUNK_SELECT_SQL + f" WHERE C.MaterialID IN ({placeholders})"
+        delta = self._read_index(delta_sql, tuple(changed))
+        try:
+            return index.replace_materials(changed, delta), len(changed)
+        except ValueError:  # Đổi model embedding -> index cũ vô dụng
+            return self._read_index(), len(changed)
+
+    def _sync_snapshot(self):
+        """
+        Mở snapshot trên đĩa rồi chỉ kéo phần thay đổi so với DB.
+        Chưa có snapshot -> tải toàn bộ 1 lần rồi ghi ra đĩa. Trả về (index, signatures, đã_đồng_bộ).
+        Đọc DB lỗi -> dùng tạm snapshot cũ (KHÔNG ghi đè, đã_đồng_bộ=False);
+        chưa có snapshot thì raise để warmup thử lại. Chỉ index dựng từ lần đọc thành công mới được lưu.
+        """
+        folder = config.RAG_SNAPSHOT_DIR
+        snapshot, snap_sigs = VectorIndex.load(folder)
+        try:
+            db_sigs = self._get_chunk_signatures()
+            if snapshot is None:
+                logger.info("RAG snapshot chưa có -> tải toàn bộ TRAINING_KNOWLEDGE_CHUNKS")
+                index, n_changed = self._read_index(), None
+            else:
+                index, n_changed = self._apply_delta(snapshot, snap_sigs, db_sigs)
+        except Exception as e:
+            if snapshot is None: raise
+            logger.warning(f"RAG: đọc DB lỗi, dùng tạm snapshot cũ (không ghi đè): {e}")
+            return snapshot, snap_sigs, False
+
+        if n_changed == 0:
+            return index, db_sigs, True
+
+        if n_changed: logger.info(f"RAG snapshot: cập nhật {n_changed} tài liệu thay đổi")
+        if self._save_snapshot(index, folder, db_sigs):
+            index = VectorIndex.load(folder)[0] or index  # Mở lại bằng memmap để dùng chung page cache
+        return index, db_sigs, True
+
+    def _swap_index(self, index, sigs, version):
+        global GLOBAL_VECTOR_CACHE, GLOBAL_INDEX_SIGNATURES, GLOBAL_INDEX_VERSION
+        with _INDEX_LOCK.write():
+            GLOBAL_VECTOR_CACHE = index
+            GLOBAL_INDEX_SIGNATURES = sigs
+            GLOBAL_INDEX_VERSION = version
+
+    # =========================================================================
+    # NẠP TĂNG DẦN (INCREMENTAL) KHI CÓ TÀI LIỆU MỚI
+    # =========================================================================
+    def get_index_version(self):
+        """Phiên bản index hiện hành (Redis, dùng chung mọi process). Không có Redis -> bản local."""
+        redis_client = _get_redis()
+        if redis_client:
+            try:
+                return int(redis_client.get(RAG_VERSION_KEY) or 0)
+            except Exception:
+                pass
+        return GLOBAL_INDEX_VERSION
+
+    def _bump_index_version(self):
+        redis_client = _get_redis()
+        if redis_client:
+            try:
+                return int(redis_client.incr(RAG_VERSION_KEY))
+            except Exception:
+                pass
+        return GLOBAL_INDEX_VERSION + 1
+
+    def ingest_material(self, material_id):
+        """
+        Nạp (thêm mới / thay thế / gỡ) chunk của 1 MaterialID vào index đang chạy,
+        không cần restart. Gọi sau khi tài liệu được chunk + embed xong.
+        Đọc DB lỗi -> giữ nguyên index + snapshot cũ (không swap, không ghi đĩa), trả False.
+        """
+        if GLOBAL_VECTOR_CACHE is None:
+            return False  # Warmup chưa xong -> warmup sẽ tự thấy tài liệu này
+        mid = str(material_id)
+        try:
+            with _REFRESH_LOCK:
+                new_sigs = dict(GLOBAL_INDEX_SIGNATURES)
+                new_sigs.pop(mid, None)
+                new_sigs.update(self._get_chunk_signatures(material_id))  # Lỗi -> raise, chưa đụng gì
+
+                index, _ = self._apply_delta(GLOBAL_VECTOR_CACHE, GLOBAL_INDEX_SIGNATURES, new_sigs, [mid])
+                # Tới đây mọi lần đọc đã thành công -> mới swap + ghi snapshot
+                self._swap_index(index, new_sigs, self._bump_index_version())
+                self._save_snapshot(index, config.RAG_SNAPSHOT_DIR, new_sigs)
+            logger.info(f"RAG: đã nạp tài liệu {mid} vào index (v{GLOBAL_INDEX_VERSION})")
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi nạp tài liệu {mid} vào RAG index: {e}")
+            return False
+
+    def _refresh_if_stale(self):
+        """
+        Process khác đã nạp tài liệu (version Redis tăng) -> chỉ kéo phần chênh lệch.
+        Không chặn: nếu đang có luồng khác refresh thì search tiếp bằng index cũ.
+        Đọc DB lỗi -> giữ index cũ và KHÔNG ghi nhận version (lần search sau thử lại).
+        """
+        if GLOBAL_VECTOR_CACHE is None: return
+        version = self.get_index_version()
+        if version == GLOBAL_INDEX_VERSION: return
+        if not _REFRESH_LOCK.acquire(blocking=False): return
+        try:
+            db_sigs = self._get_chunk_signatures()
+            index, n_changed = self._apply_delta(GLOBAL_VECTOR_CACHE, GLOBAL_INDEX_SIGNATURES, db_sigs)
+            self._swap_index(index, db_sigs, version)  # Chỉ chạy khi cả 2 lần đọc trên thành công
+            if n_changed:
+                logger.info(f"RAG: đồng bộ {n_changed} tài liệu từ process khác (v{version})")
+        except Exception as e:
+            logger.error(f"Lỗi đồng bộ RAG index: {e}")
+        finally:
+            _REFRESH_LOCK.release()
+
+    def _save_snapshot(self, index, folder, signatures):
+        """Ghi snapshot; lỗi (VD: Windows khóa file đang được process khác memmap) -> chỉ dùng bản trong RAM."""
+        try:
+            index.save(folder, signatures)
+            return True
+        except Exception as e:
+            logger.warning(f"Không ghi được RAG snapshot: {e}")
+            return False
+
+    def _embed_query(self, query_text):
+        """Embedding câu hỏi, ưu tiên lấy từ cache (LRU -> Redis) trước khi gọi Gemini."""
+        key = f"{EMBEDDING_MODEL}:{query_hash(query_text)}"
+        vector = EMBEDDING_CACHE.get(key)
+        if vector is None:
+            response = genai.embed_content(model=EMBEDDING_MODEL, content=query_text, task_type="retrieval_query")
+            vector = np.asarray(response['embedding'], dtype=np.float32)
+            EMBEDDING_CACHE.set(key, vector)
+        return vector
+
+    def get_cache_stats(self):
+        return {'embedding': EMBEDDING_CACHE.get_stats(), 'context': CONTEXT_CACHE.get_stats()}
 
     def search_vector_database(self, query_text, top_k=3):
-        global GLOBAL_VECTOR_CACHE
         if not GLOBAL_VECTOR_CACHE:
             return "Hệ thống đang đồng bộ kho tài liệu nội bộ (Khoảng 2-3 phút) vào RAM. Sếp vui lòng hỏi lại câu này sau ít phút nhé!"
         try:
-            response = genai.embed_content(model="models/gemini-embedding-001", content=query_text, task_type="retrieval_query")
-            query_vector = np.array(response['embedding'], dtype=np.float32)
-            query_norm = np.linalg.norm(query_vector)
-            if query_norm == 0: return ""
-
-            results = []
-            for item in GLOBAL_VECTOR_CACHE:
-                if item['norm'] == 0: continue
-                sim = np.dot(query_vector, item['vector']) / (query_norm * item['norm'])
-                if sim > 0.55:
-                    results.append({'similarity': sim, 'text': item['text'], 'file_name': item['file_name'], 'page': item['page']})
-
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            top_results = results[:top_k]
-            if not top_results: return ""
-
-            context_pieces = ["DỮ LIỆU NỘI BỘ TÌM THẤY TRONG HỆ THỐNG CÔNG TY:"]
-            for idx, r in enumerate(top_results):
-                context_pieces.append(f"--- TÀI LIỆU {idx+1} [Nguồn: {r['file_name']} | Trang: {r['page']}] ---\n{r['text']}")
-            return "\n\n".join(context_pieces)
+            self._refresh_if_stale()
+            # Số chunk đi kèm version: restart nạp delta từ DB mà version Redis chưa tăng vẫn ra key mới
+            ctx_key = f"{GLOBAL_INDEX_VERSION}.{len(GLOBAL_VECTOR_CACHE)}:{top_k}:{query_hash(query_text)}"
+            cached = CONTEXT_CACHE.get(ctx_key)
+            if cached is not None: return cached
+
+            query_vector = self._embed_query(query_text)
+            with _INDEX_LOCK.read():
+                top_results = GLOBAL_VECTOR_CACHE.search(query_vector, top_k=top_k)
+
+            context = ""
+            if top_results:
+                context_pieces = ["DỮ LIỆU NỘI BỘ TÌM THẤY TRONG HỆ THỐNG CÔNG TY:"]
+                for idx, r in enumerate(top_results):
+                    context_pieces.append(f"--- TÀI LIỆU {idx+1} [Nguồn: {r['file_name']} | Trang: {r['page']}] ---\n{r['text']}")
+                context = "\n\n".join(context_pieces)
+            CONTEXT_CACHE.set(ctx_key, context)
+            return context
         except Exception as e:
             logger.error(f"❌ Lỗi RAG: {e}")
-            return ""
\ No newline at end of file
+            return ""
@@ -0,0 +1,175 @@
+# services/swr_cache.py
+# --- CACHE DASHBOARD: STALE-WHILE-REVALIDATE + SINGLE-FLIGHT ---
+# Vấn đề: key hết hạn -> mọi user cùng MISS 1 lúc -> cùng bắn 1 SP nặng song song.
+#  - Single-flight: khóa Redis (SET NX EX) -> chỉ 1 worker được tính lại, worker khác chờ kết quả.
+#  - Stale-while-revalidate: quá hạn "tươi" nhưng còn trong cửa sổ "cũ" -> trả ngay bản cũ,
+#    1 luồng nền tính lại.
+# Dữ liệu vẫn lưu trong current_app.cache (Redis DB 2), bọc trong envelope có timestamp.
+# Metrics theo từng key (hit / stale / miss / thời gian tính lại) lưu ở Redis hash swr_stats:<key>.
+
+from flask import current_app
+import threading
+import time
+import uuid
+
+LOCK_PREFIX = 'swr_lock'
+STATS_PREFIX = 'swr_stats'
+STATS_TTL = 7 * 86400
+LOCK_TTL = 120          # giây: tối đa thời gian 1 lần tính lại được giữ khóa
+WAIT_TIMEOUT = 30       # giây: worker không giữ khóa chờ kết quả tối đa bao lâu
+WAIT_INTERVAL = 0.2
+
+_ENVELOPE_MARK = '__swr__'
+
+# Chỉ xóa khóa nếu mình còn là chủ (tránh xóa nhầm khóa của worker khác sau khi hết TTL)
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+def _get_redis():
+    try:
+        return getattr(current_app, 'redis_client', None)
+    except RuntimeError:
+        return None
+
+def _record(key, field, amount=1, last_ms=None):
+    redis_client = _get_redis()
+    if not redis_client: return
+    try:
+        stats_key = f"{STATS_PREFIX}:{key}"
+        pipe = redis_client.pipeline()
+        pipe.hincrby(stats_key, field, amount)
+        if last_ms is not None:
+            pipe.hincrby(stats_key, 'recompute_ms_total', last_ms)
+            pipe.hset(stats_key, 'recompute_ms_last', last_ms)
+        pipe.expire(stats_key, STATS_TTL)
+        pipe.execute()
+    except Exception:
+        pass
+
+def _acquire_lock(key):
+    """Trả về token nếu giành được khóa. Không có Redis -> luôn coi như giành được."""
+    redis_client = _get_redis()
+    token = uuid.uuid4().hex
+    if not redis_client:
+        return token
+    try:
+        return token if redis_client.set(f"{LOCK_PREFIX}:{key}", token, nx=True, ex=LOCK_TTL) else None
+    except Exception:
+        return token
+
+def _release_lock(key, token):
+    redis_client = _get_redis()
+    if not redis_client: return
+    try:
+        redis_client.eval(_RELEASE_LUA, 1, f"{LOCK_PREFIX}:{key}", token)
+    except Exception:
+        pass
+
+def _read(key):
+    try:
+        envelope = current_app.cache.get(key)
+    except Exception as e:
+        current_app.logger.warning(f"Cache Warning ({key}): {e}")
+        return None
+    # Bản cache định dạng cũ (không có envelope) -> coi như MISS
+    if isinstance(envelope, dict) and envelope.get(_ENVELOPE_MARK):
+        return envelope
+    return None
+
+def _compute_and_store(key, compute_fn, args, ttl, stale_ttl):
+    t0 = time.perf_counter()
+    value = compute_fn(*args)
+    elapsed_ms = int((time.perf_counter() - t0) * 1000)
+    _record(key, 'recompute_count', last_ms=elapsed_ms)
+
+    if value:  # Không cache kết quả rỗng (thường do lỗi DB)
+        try:
+            current_app.cache.set(key, {_ENVELOPE_MARK: True, 'ts': time.time(), 'value': value},
+                                  timeout=ttl + stale_ttl)
+        except Exception as e:
+            current_app.logger.warning(f"Cache Warning ({key}): {e}")
+    return value
+
+def _refresh_in_background(key, compute_fn, args, ttl, stale_ttl, token):
+    app = current_app._get_current_object()
+
+    def worker():
+        with app.app_context():
+            try:
+                _compute_and_store(key, compute_fn, args, ttl, stale_ttl)
+            except Exception as e:
+                app.logger.error(f"SWR: lỗi làm mới nền {key}: {e}")
+            finally:
+                _release_lock(key, token)
+
+    threading.Thread(target=worker, daemon=True, name=f"swr-{key}").start()
+
+def get_or_compute(key, compute_fn, args=(), ttl=600, stale_ttl=None):
+    """
+    Lấy dữ liệu dashboard từ cache, tự tính lại khi cần.
+      - ttl: số giây dữ liệu được coi là "tươi".
+      - stale_ttl: sau ttl, còn được phục vụ bản cũ thêm bao lâu (mặc định = ttl).
+    compute_fn(*args) KHÔNG được phụ thuộc request/session (có thể chạy ở luồng nền).
+    """
+    stale_ttl = ttl if stale_ttl is None else stale_ttl
+    envelope = _read(key)
+
+    if envelope:
+        if time.time() - envelope['ts'] < ttl:
+            _record(key, 'hit')
+            return envelope['value']
+        # Hết hạn tươi: trả bản cũ, 1 worker duy nhất làm mới ở nền
+        _record(key, 'stale')
+        token = _acquire_lock(key)
+        if token:
+            _refresh_in_background(key, compute_fn, args, ttl, stale_ttl, token)
+        return envelope['value']
+
+    _record(key, 'miss')
+    token = _acquire_lock(key)
+    if not token:
+        # Worker khác đang tính -> chờ kết quả thay vì bắn thêm 1 SP nặng
+        deadline = time.time() + WAIT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            envelope = _read(key)
+            if envelope:
+                _record(key, 'wait_hit')
+                return envelope['value']
+        current_app.logger.warning(f"SWR: chờ {key} quá {WAIT_TIMEOUT}s -> tự tính")
+
+    try:
+        return _compute_and_store(key, compute_fn, args, ttl, stale_ttl)
+    finally:
+        if token: _release_lock(key, token)
+
+def refresh(key, compute_fn, args=(), ttl=600, stale_ttl=None):
+    """
+    Tính lại và ghi đè cache ngay (dùng cho job làm nóng cache).
+    Worker khác đang tính key này -> bỏ qua, trả về None.
+    """
+    stale_ttl = ttl if stale_ttl is None else stale_ttl
+    token = _acquire_lock(key)
+    if not token:
+        return None
+    try:
+        return _compute_and_store(key, compute_fn, args, ttl, stale_ttl)
+    finally:
+        _release_lock(key, token)
+
+def invalidate(key):
+    try:
+        current_app.cache.delete(key)
+    except Exception as e:
+        current_app.logger.warning(f"Cache Warning ({key}): {e}")
+
+def get_cache_metrics(key):
+    """{hit, stale, miss, wait_hit, recompute_count, recompute_ms_total, recompute_ms_last} của 1 key."""
+    redis_client = _get_redis()
+    if not redis_client: return {}
+    try:
+        return {k: int(v) for k, v in redis_client.hgetall(f"{STATS_PREFIX}:{key}").items()}
+    except Exception:
+        return {}
@@ -0,0 +1,143 @@
+# services/task_events.py
+# --- KÊNH ĐẨY THAY ĐỔI TASK (REDIS PUB/SUB -> SSE) ---
+# Thay cho việc mỗi tab Task Dashboard 15 phút hỏi SQL 1 lần:
+#  - TaskService ghi xong -> publish 1 event gọn lên config.REDIS_CHANNEL.
+#  - Mỗi process có 1 luồng nền duy nhất subscribe Redis, phát event vào hàng đợi
+#    của từng kết nối SSE đang mở. Tab đứng yên = 0 query SQL.
+# Event: {"task_id", "type", "user_code" (chủ task), "cap_tren", "actor", "ts"}
+
+from flask import current_app
+from datetime import datetime
+import threading
+import logging
+import queue
+import json
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+CLIENT_QUEUE_MAX = 100     # Client đọc chậm -> bỏ event cũ, không chặn luồng phát
+RECONNECT_DELAY = 5        # giây: chờ trước khi subscribe lại khi mất Redis
+STREAM_PATH = '/api/task/stream'
+STREAM_ENVIRON_KEY = 'titan.task_stream'  # Đánh dấu request đến từ server SSE riêng
+
+def publish_task_event(task_id, event_type, user_code=None, cap_tren=None, actor=None):
+    """
+    Best-effort: lỗi Redis không được làm hỏng thao tác ghi Task.
+    Không truyền user_code -> tự tra chủ task/cấp trên theo TaskID (1 query theo khóa chính).
+    """
+    redis_client = getattr(current_app, 'redis_client', None)
+    if not redis_client: return
+    try:
+        if task_id and user_code is None:
+            rows = current_app.db_manager.get_data_fast(
+                f"SELECT UserCode, CapTren FROM {config.TASK_TABLE} WHERE TaskID = ?", (task_id,)
+            )
+            if rows:
+                user_code, cap_tren = rows[0].get('UserCode'), rows[0].get('CapTren')
+        event = {
+            'task_id': int(task_id) if task_id else None,
+            'type': event_type,
+            'user_code': (user_code or '').strip(),
+            'cap_tren': (cap_tren or '').strip(),
+            'actor': actor,
+            'ts': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        redis_client.publish(config.REDIS_CHANNEL, json.dumps(event, ensure_ascii=False))
+    except Exception as e:
+        current_app.logger.warning(f"Task event: lỗi publish ({event_type} #{task_id}): {e}")
+
+def event_visible_to(event, user_code, is_admin=False, view_mode='USER'):
+    """Cùng quy tắc phạm vi với get_kanban_tasks / get_recently_updated_tasks."""
+    if view_mode == 'SUPERVISOR':
+        return event.get('cap_tren') == user_code
+    if is_admin:
+        return True
+    return event.get('user_code') == user_code
+
+class TaskEventHub:
+    """1 kết nối Redis pub/sub cho cả process, fan-out tới các hàng đợi SSE."""
+    def __init__(self, redis_client, channel=config.REDIS_CHANNEL):
+        self.redis = redis_client
+        self.channel = channel
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=CLIENT_QUEUE_MAX)
+        with self._lock:
+            self._clients.add(q)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, daemon=True, name='task-events')
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._clients.discard(q)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def _dispatch(self, data):
+        try:
+            event = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            clients = list(self._clients)
+        for q in clients:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._dispatch(message.get('data'))
+            except Exception as e:
+                logger.warning(f"Task event hub: mất kết nối Redis, thử lại sau {RECONNECT_DELAY}s: {e}")
+                time.sleep(RECONNECT_DELAY)
+
+def serve_task_stream(app, host='0.0.0.0', port=None):
+    """
+    Server SSE riêng (chạy trong luồng daemon, xem server.py): cùng app + cùng hub của process,
+    nhưng pool luồng riêng nên kết nối mở lâu không chiếm luồng của server chính. Chỉ phục vụ STREAM_PATH.
+    """
+    from waitress import serve
+
+    def stream_only(environ, start_response):
+        if environ.get('PATH_INFO') != STREAM_PATH:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+        environ[STREAM_ENVIRON_KEY] = True
+        return app(environ, start_response)
+
+    # +2 luồng: còn chỗ trả 503 khi đã đủ suất
+    serve(stream_only, host=host, port=port or config.TASK_STREAM_PORT,
+          threads=config.TASK_STREAM_MAX_CLIENTS + 2, ident='titan-task-stream')
+
+_hub = None
+_hub_lock = threading.Lock()
+
+def get_event_hub():
+    """Hub dùng chung của process (tạo lần đầu khi có client). Không có Redis -> None."""
+    global _hub
+    redis_client = getattr(current_app, 'redis_client', None)
+    if not redis_client: return None
+    with _hub_lock:
+        if _hub is None:
+            _hub = TaskEventHub(redis_client)
+        return _hub
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta # Import các đối tượng phổ bi
 import config
 import math
 import pandas as pd # <-- FIX: THÊM DÒNG NÀY ĐỂ KHẮC PHỤC LỖI "pd is not defined"
+from services.task_events import publish_task_event
 class TaskService:
     """Xử lý toàn bộ logic nghiệp vụ liên quan đến quản lý đầu việc (Task Management)."""
     
@@ -176,6 +177,7 @@ class TaskService:
                 cursor.execute(log_query, (new_task_id, user_code, initial_note))
                 
                 conn.commit()
+                publish_task_event(new_task_id, 'created', user_code=user_code, cap_tren=supervisor_code, actor=user_code)
                 return True
             else:
                 conn.rollback()
@@ -385,6 +387,7 @@ class TaskService:
             WHERE TaskID = ?
         """
         self.db.execute_non_query(update_object_query, (object_id, task_id))
+        # Event 'progress' đã được log_task_progress publish -> không phát trùng ở đây
         
         return log_id is not None
 
@@ -401,7 +404,9 @@ class TaskService:
         params = (note, supervisor_code, task_id)
         
         try:
-            return self.db.execute_non_query(update_query, params)
+            success = self.db.execute_non_query(update_query, params)
+            if success: publish_task_event(task_id, 'supervisor_note', actor=supervisor_code)
+            return success
         except Exception as e:
             current_app.logger.error(f"LỖI NOTE CẤP TRÊN: {e}")
             return False
@@ -425,7 +430,9 @@ class TaskService:
         """
         params = (new_priority.upper(), task_id)
         try:
-            return self.db.execute_non_query(update_query, params)
+            success = self.db.execute_non_query(update_query, params)
+            if success: publish_task_event(task_id, 'priority')
+            return success
         except Exception as e:
             current_app.logger.error(f"LỖI CẬP NHẬT PRIORITY: {e}")
             return False
@@ -469,9 +476,10 @@ class TaskService:
             new_title = f"HELP - [{current_user_code}] - {original_title}"
             new_detail_content = f"[Hãy giúp tôi:] {original_detail_content}"
 
-        # 3. CHÈN TASK MỚI (Đã thêm TaskType)
+        # 3. CHÈN TASK MỚI (Đã thêm TaskType) + lấy TaskID mới để báo realtime
         insert_query = f"""
             INSERT INTO {self.TASK_TABLE} (UserCode, TaskDate, Status, Priority, Title, CapTren, ObjectID, DetailContent, LastUpdated, SupervisorCode, TaskType)
+            OUTPUT INSERTED.TaskID
             VALUES (?, GETDATE(), 'HELP_NEEDED', ?, ?, ?, ?, ?, GETDATE(), 'KD000', ?)
         """
         params = (
@@ -484,11 +492,25 @@ class TaskService:
             new_task_type  # Gán TaskType của task mới
         )
         
+        conn = None
         try:
-            return self.db.execute_non_query(insert_query, params)
+            conn = self.db.get_transaction_connection()
+            cursor = conn.cursor()
+            cursor.execute(insert_query, params)
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                return False
+            conn.commit()
+            publish_task_event(row[0], 'created', user_code=helper_code, cap_tren=current_user_code,
+                               actor=current_user_code)
+            return True
         except Exception as e:
+            if conn: conn.rollback()
             current_app.logger.error(f"LỖI TẠO TASK YÊU CẦU HỖ TRỢ/GIAO VIỆC: {e}")
             return False
+        finally:
+            if conn: conn.close()
     # --- PHẦN MỚI: Lấy chi tiết Log History ---
     def get_task_history_logs(self, task_id):
         """Lấy tất cả Log tiến độ cho một Task."""
@@ -575,6 +597,7 @@ class TaskService:
             WHERE TaskID = ?
         """
         self.db.execute_non_query(update_master_query, (progress_percent, new_status, content, task_id))
+        publish_task_event(task_id, 'progress', actor=user_code)
 
         return log_id
 
@@ -589,18 +612,19 @@ class TaskService:
     def get_recently_updated_tasks(self, user_code, is_admin=False, view_mode='USER', minutes_ago=15):
         """Lấy danh sách Task có cập nhật (LastUpdated) trong N phút gần nhất."""
         
-        minutes_ago_str = (datetime.now() - timedelta(minutes=minutes_ago)).strftime('%Y-%m-%d %H:%M:%S')
-        
         where_conditions = [
-            f"LastUpdated >= '{minutes_ago_str}'",
-            f"Status IN ('OPEN', 'PENDING', 'HELP_NEEDED', 'COMPLETED')" 
+            "LastUpdated >= ?",
+            "Status IN ('OPEN', 'PENDING', 'HELP_NEEDED', 'COMPLETED')" 
         ]
+        params = [datetime.now() - timedelta(minutes=minutes_ago)]
         
         # Áp dụng bộ lọc quyền tương tự như get_kanban_tasks
         if view_mode == 'SUPERVISOR':
-            where_conditions.append(f"CapTren = '{user_code}'") 
+            where_conditions.append("CapTren = ?") 
+            params.append(user_code)
         elif not is_admin: 
-            where_conditions.append(f"UserCode = '{user_code}'") 
+            where_conditions.append("UserCode = ?") 
+            params.append(user_code)
         
         query = f"""
             SELECT TaskID, LastUpdated
@@ -608,7 +632,7 @@ class TaskService:
             WHERE {' AND '.join(where_conditions)}
             ORDER BY LastUpdated DESC
         """
-        data = self.db.get_data(query)
+        data = self.db.get_data(query, tuple(params))
         # Chỉ trả về TaskID và LastUpdated để giảm tải
         return [{'TaskID': task['TaskID'], 'LastUpdated': task['LastUpdated']} for task in data]
     
@@ -3,17 +3,25 @@ import re
 import difflib
 import json
 import os
-import PyPDF2
+import time
 from datetime import datetime, timedelta
 import google.generativeai as genai
 from flask import current_app
 from flask import session
+import config
+from services.document_text_store import get_document_store
+from services.grading_pool import GradingPipeline, GRADING_WORKERS, CALL_TIMEOUT as GRADING_CALL_TIMEOUT
+
+GRADING_REPORT_KEY = 'grading:last_report'
+DISTRIBUTE_PARAM_CHUNK = 1000  # SQL Server giới hạn 2100 tham số / câu lệnh
 
 class TrainingService:
     def __init__(self, db_manager, gamification_service):
         self.db = db_manager
         self.gamification = gamification_service
         self.ACTIVITY_CODE_WIN = 'DAILY_QUIZ_WIN'
+        self.ai_model_name = 'gemini-2.5-flash'
+        self._session_has_earned_xp = True  # Tắt khi DB chưa có cột EarnedXP
 
     # =========================================================================
     # PHẦN 1: GAME & DAILY CHALLENGE
@@ -95,11 +103,8 @@ class TrainingService:
         user_groups = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
         messages_to_send = []
 
-        for idx, group in enumerate(user_groups):
-            if idx >= len(questions): break
-            q_id = questions[idx]['ID']
-            mail_title = f"💡 Cơ hội nâng tầm tri thức lúc {datetime.now().strftime('%H:%M')}"
-            mail_content = f"""
+        mail_title = f"💡 Cơ hội nâng tầm tri thức lúc {datetime.now().strftime('%H:%M')}"
+        mail_content = f"""
 <div class='p-2 text-center'>
     <p class='mb-3'>Một thử thách tri thức mới vừa xuất hiện. Sếp đã sẵn sàng cập nhật bản thân?</p>
     <a href='/training/daily-challenge' 
@@ -109,16 +114,61 @@ class TrainingService:
     </a>
 </div>
 """
+        # Tạo phiên mới (Hạn 10 phút) - cùng 1 mốc cho cả đợt
+        expired_at = datetime.now() + timedelta(minutes=10)
+        session_rows, mail_rows = [], []
+        for idx, group in enumerate(user_groups):
+            if idx >= len(questions): break
+            q_id = questions[idx]['ID']
             for user_code in group:
-                # Đánh dấu phiên cũ hết hạn
-                self.db.execute_non_query("UPDATE TRAINING_DAILY_SESSION SET Status='EXPIRED' WHERE UserCode=? AND Status='PENDING'", (user_code,))
-                # Tạo phiên mới (Hạn 10 phút)
-                expired_at = datetime.now() + timedelta(minutes=10)
-                self.db.execute_non_query("INSERT INTO TRAINING_DAILY_SESSION (UserCode, QuestionID, Status, ExpiredAt) VALUES (?, ?, 'PENDING', ?)", (user_code, q_id, expired_at))
-                # Gửi thông báo
-                self.db.execute_non_query("INSERT INTO TitanOS_Game_Mailbox (UserCode, Title, Content, CreatedTime, IsClaimed) VALUES (?, ?, ?, GETDATE(), 0)", (user_code, mail_title, mail_content))
+                session_rows.append((user_code, q_id, expired_at))
+                mail_rows.append((user_code, mail_title, mail_content))
                 messages_to_send.append({"user_code": user_code})
-                
+
+        # Ghi cả đợt trong 1 transaction: lỗi giữa chừng -> không user nào nhận nửa vời
+        timings = {}
+        t_start = time.perf_counter()
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True  # PyODBC: gửi cả lô trong 1 round-trip
+            except AttributeError:
+                pass
+
+            # Đánh dấu phiên cũ hết hạn: 1 UPDATE / nhóm câu hỏi (cắt nhỏ cho giới hạn 2100 tham số)
+            t0 = time.perf_counter()
+            for group in user_groups[:len(questions)]:
+                for i in range(0, len(group), DISTRIBUTE_PARAM_CHUNK):
+                    part = group[i:i + DISTRIBUTE_PARAM_CHUNK]
+                    cursor.execute(
+                        f"UPDATE TRAINING_DAILY_SESSION SET Status='EXPIRED' WHERE Status='PENDING' AND UserCode IN ({','.join(['?'] * len(part))})",
+                        part
+                    )
+            timings['expire'] = (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            cursor.executemany("INSERT INTO TRAINING_DAILY_SESSION (UserCode, QuestionID, Status, ExpiredAt) VALUES (?, ?, 'PENDING', ?)", session_rows)
+            timings['sessions'] = (time.perf_counter() - t0) * 1000
+
+            # Gửi thông báo
+            t0 = time.perf_counter()
+            cursor.executemany("INSERT INTO TitanOS_Game_Mailbox (UserCode, Title, Content, CreatedTime, IsClaimed) VALUES (?, ?, ?, GETDATE(), 0)", mail_rows)
+            timings['mailbox'] = (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            conn.commit()
+            timings['commit'] = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            conn.rollback()
+            current_app.logger.error(f"Lỗi phát Daily Challenge ({len(session_rows)} user): {e}")
+            return []
+        finally:
+            conn.close()
+
+        timings['total'] = (time.perf_counter() - t_start) * 1000
+        print(f"📤 [Daily Challenge] {len(session_rows)} user / {min(len(questions), len(user_groups))} câu: "
+              + ", ".join(f"{k} {v:.0f} ms" for k, v in timings.items()))
         return messages_to_send
 
     # =========================================================================
@@ -501,22 +551,20 @@ class TrainingService:
         if not os.path.exists(real_path):
              return {"text": f"Không tìm thấy file gốc: {file_path}", "page": None}
 
-        # Live Read PDF
-        pdf_text = ""
+        # Text đã trích sẵn theo trang (nén, đọc lười) -> chỉ lấy các trang liên quan tới câu hỏi
         try:
-            reader = PyPDF2.PdfReader(real_path)
-            for i, page in enumerate(reader.pages[:10]): # Đọc 10 trang đầu
-                text = page.extract_text()
-                if text: pdf_text += f"\n--- TRANG {i+1} ---\n{text}"
+            doc_index = get_document_store().get_index(material_id, real_path)
+            pages = doc_index.select_pages(user_question, config.DOC_CHAT_MAX_PAGES, config.DOC_CHAT_MAX_CHARS)
         except Exception as e:
             return {"text": f"Lỗi đọc PDF: {str(e)}", "page": None}
 
+        pdf_text = "".join(f"\n--- TRANG {page_no} ---\n{text}" for page_no, text in pages)
         if not pdf_text.strip():
             return {"text": "Tài liệu này là file ảnh scan, AI chưa đọc được chữ.", "page": None}
 
         try:
             model = genai.GenerativeModel('gemini-2.5-flash')
-            prompt = f"Trả lời câu hỏi dựa trên tài liệu. Nếu thấy thông tin ở trang nào, ghi [[PAGE:số_trang]]. Câu hỏi: {user_question}. Dữ liệu: {pdf_text[:15000]}"
+            prompt = f"Trả lời câu hỏi dựa trên tài liệu. Nếu thấy thông tin ở trang nào, ghi [[PAGE:số_trang]]. Câu hỏi: {user_question}. Dữ liệu: {pdf_text}"
             res = model.generate_content(prompt)
             reply = res.text
             
@@ -692,44 +740,132 @@ class TrainingService:
             return {"score": 0, "feedback": "Chưa trả lời hoặc quá ngắn."}
 
         try:
-            model = genai.GenerativeModel(self.ai_model_name)
-            
-            prompt = f"""
-            Bạn là Giám khảo chấm thi Tự luận kỹ thuật.
-            
-            CÂU HỎI: {question}
-            ĐÁP ÁN CHUẨN (Ý chính): {standard_ans}
-            
-            TRẢ LỜI CỦA HỌC VIÊN: "{user_ans}"
-            
-            NHIỆM VỤ:
-            So sánh ý nghĩa (Semantic Matching) của câu trả lời học viên với đáp án chuẩn.
-            - Không bắt bẻ chính tả.
-            - Chú trọng vào các từ khóa kỹ thuật và logic.
-            - Nếu trả lời lan man, sai trọng tâm -> Điểm thấp.
-            - Nếu trả lời đúng ý nhưng khác văn phong -> Điểm cao.
-            
-            OUTPUT JSON (Bắt buộc):
-            {{
-                "score": 0-100,  // Điểm số (Interger)
-                "feedback": "..." // Nhận xét ngắn gọn (dưới 15 từ) tại sao sai/đúng.
-            }}
-            """
-            
-            res = model.generate_content(prompt)
-            text = res.text.replace('```json', '').replace('```', '').strip()
-            return json.loads(text)
-            
+            return self._ai_grade_essay_strict(question, standard_ans, user_ans)
         except Exception as e:
             print(f"❌ Lỗi AI Grading: {e}")
             # [QUAN TRỌNG] Lỗi AI -> Trả về 0 điểm để tránh gian lận, yêu cầu user làm lại
             return {"score": 0, "feedback": "Lỗi kết nối AI chấm điểm. Vui lòng thử lại sau giây lát."}
 
+    def _ai_grade_essay_strict(self, question, standard_ans, user_ans):
+        """Gọi Gemini chấm 1 bài. Lỗi mạng / timeout / JSON hỏng -> raise (để bên gọi tự thử lại)."""
+        model = genai.GenerativeModel(self.ai_model_name)
+        
+        prompt = f"""
+        Bạn là Giám khảo chấm thi Tự luận kỹ thuật.
+        
+        CÂU HỎI: {question}
+        ĐÁP ÁN CHUẨN (Ý chính): {standard_ans}
+        
+        TRẢ LỜI CỦA HỌC VIÊN: "{user_ans}"
+        
+        NHIỆM VỤ:
+        So sánh ý nghĩa (Semantic Matching) của câu trả lời học viên với đáp án chuẩn.
+        - Không bắt bẻ chính tả.
+        - Chú trọng vào các từ khóa kỹ thuật và logic.
+        - Nếu trả lời lan man, sai trọng tâm -> Điểm thấp.
+        - Nếu trả lời đúng ý nhưng khác văn phong -> Điểm cao.
+        
+        OUTPUT JSON (Bắt buộc):
+        {{
+            "score": 0-100,  // Điểm số (Interger)
+            "feedback": "..." // Nhận xét ngắn gọn (dưới 15 từ) tại sao sai/đúng.
+        }}
+        """
+        
+        res = model.generate_content(prompt, request_options={'timeout': GRADING_CALL_TIMEOUT})
+        text = res.text.replace('```json', '').replace('```', '').strip()
+        return json.loads(text)
+
+    # =========================================================================
+    # CHẤM ĐIỂM DAILY CHALLENGE HẾT HẠN (Job 8:20 / 13:20 / 17:20)
+    # =========================================================================
+    def _grade_daily_session(self, row, grader):
+        """Chấm 1 bài (chạy trên pool, không dùng DB/app_context)."""
+        grade_result = grader(row['QuestionText'], row['StandardAnswer'], row['UserAnswerContent'])
+        try:
+            score = int(round(float(grade_result.get('score', 0))))
+        except (TypeError, ValueError):
+            raise ValueError(f"AI trả điểm không hợp lệ: {grade_result!r}")
+        score = max(0, min(100, score))
+
+        # Phân định thưởng: >= 50đ tính là Đúng (50 XP), ngược lại là Tham gia (10 XP)
+        is_correct = 1 if score >= 50 else 0
+        return {
+            'sid': row['SessionID'], 'user_code': row['UserCode'],
+            'score': score, 'feedback': grade_result.get('feedback') or 'Đã chấm điểm tự động.',
+            'is_correct': is_correct, 'xp': 50 if is_correct else 10, 'send_mail': True,
+        }
+
+    def _write_grading_chunk(self, results):
+        """
+        Ghi 1 chunk kết quả trong 1 transaction: UPDATE session + INSERT hòm thư.
+        Chỉ ghi các session còn AIScore IS NULL (khóa UPDLOCK) -> chạy lại / chạy chồng không thưởng 2 lần.
+        XP được cộng khi user nhận thư (Total_XP), như các phần thưởng khác.
+        """
+        if not results: return 0
+        ids = [r['sid'] for r in results]
+        conn = self.db.get_transaction_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.fast_executemany = True
+            except AttributeError:
+                pass
+            cursor.execute(
+                f"SELECT SessionID FROM TRAINING_DAILY_SESSION WITH (UPDLOCK, ROWLOCK) WHERE AIScore IS NULL AND SessionID IN ({','.join(['?'] * len(ids))})",
+                ids
+            )
+            still_pending = {row[0] for row in cursor.fetchall()}
+            rows = [r for r in results if r['sid'] in still_pending]
+            if not rows:
+                conn.commit()
+                return 0
 
-    def process_pending_grading(self):
+            if self._session_has_earned_xp:
+                try:
+                    cursor.executemany(
+                        "UPDATE TRAINING_DAILY_SESSION SET AIScore = ?, AIFeedback = ?, Status = 'COMPLETED', IsCorrect = ?, EarnedXP = ? WHERE SessionID = ?",
+                        [(r['score'], r['feedback'], r['is_correct'], r['xp'] if r['send_mail'] else 0, r['sid']) for r in rows]
+                    )
+                except Exception as e:
+                    # Chỉ tắt hẳn khi DB báo thiếu cột (SQLSTATE 42S22); lỗi khác (deadlock, mất kết nối...) -> raise
+                    if not (e.args and e.args[0] == '42S22') and 'Invalid column name' not in str(e):
+                        raise
+                    print(f"⚠️ Chưa tạo cột EarnedXP trong DB. Bỏ qua ghi nhận XP vào Session: {e}")
+                    self._session_has_earned_xp = False
+                    conn.rollback()
+                    return self._write_grading_chunk(results)
+            else:
+                cursor.executemany(
+                    "UPDATE TRAINING_DAILY_SESSION SET AIScore = ?, AIFeedback = ?, Status = 'COMPLETED', IsCorrect = ? WHERE SessionID = ?",
+                    [(r['score'], r['feedback'], r['is_correct'], r['sid']) for r in rows]
+                )
+
+            mails = []
+            for r in rows:
+                if not r['send_mail']: continue
+                title = "🎉 Kết quả Thử thách Daily" if r['is_correct'] else "📝 Phản hồi Thử thách Daily"
+                msg = f"Điểm của sếp: <b>{r['score']}/100</b>. <br>Nhận xét từ AI: {r['feedback']}"
+                mails.append((r['user_code'], title, msg, r['xp']))
+            if mails:
+                cursor.executemany(
+                    "INSERT INTO TitanOS_Game_Mailbox (UserCode, Title, Content, Total_XP, IsClaimed, CreatedTime) VALUES (?, ?, ?, ?, 0, GETDATE())",
+                    mails
+                )
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def process_pending_grading(self, grader=None, workers=GRADING_WORKERS):
         """
         Quét và chấm điểm tự động cho các bài Daily Challenge đã hết hạn.
         Khớp 100% cấu trúc SSMS: TRAINING_DAILY_SESSION & TRAINING_QUESTION_BANK
+        grader(question, standard, answer) -> {'score', 'feedback'}: mặc định Gemini, truyền grader giả để chạy thử.
+        Trả về báo cáo thông lượng (bài/giây, p95 độ trễ LLM...).
         """
         print(f"🤖 [AI Grading] Bắt đầu quét các bài nộp chưa chấm...")
         
@@ -746,81 +882,43 @@ class TrainingService:
         
         try:
             pending_list = self.db.get_data(sql_pending)
-            
             if not pending_list:
                 print("✅ Không có bài nộp nào cần chấm.")
-                return
-
-            for row in pending_list:
-                sid = row['SessionID']
-                user_code = row['UserCode']
-                user_ans = row['UserAnswerContent']
-                question = row['QuestionText']
-                standard_ans = row['StandardAnswer']
-
-                # Nếu user không nhập gì, chấm 0 điểm luôn
-                if not user_ans or len(str(user_ans).strip()) < 2:
-                    self.db.execute_non_query(
-                        "UPDATE TRAINING_DAILY_SESSION SET AIScore=0, AIFeedback=N'Không có nội dung trả lời.', Status='COMPLETED', IsCorrect=0 WHERE SessionID=?", 
-                        (sid,)
-                    )
-                    continue
-
+                return None
+
+            # Nếu user không nhập gì, chấm 0 điểm luôn (không gọi AI, không gửi thư)
+            empty, to_grade = [], []
+            for r in pending_list:
+                has_answer = r['UserAnswerContent'] and len(str(r['UserAnswerContent']).strip()) >= 2
+                (to_grade if has_answer else empty).append(r)
+            self._write_grading_chunk([
+                {'sid': r['SessionID'], 'user_code': r['UserCode'], 'score': 0, 'feedback': 'Không có nội dung trả lời.',
+                 'is_correct': 0, 'xp': 0, 'send_mail': False}
+                for r in empty
+            ])
+
+            grader = grader or self._ai_grade_essay_strict
+            pipeline = GradingPipeline(lambda row: self._grade_daily_session(row, grader), self._write_grading_chunk,
+                                       workers=workers)
+            report = pipeline.run(to_grade)
+            report['empty'] = len(empty)
+
+            print(f"✅ [AI Grading] {report['written']}/{report['total']} bài trong {report['elapsed_s']}s "
+                  f"({report['per_second']} bài/s, LLM p50 {report['llm_p50_ms']} ms / p95 {report['llm_p95_ms']} ms, "
+                  f"thử lại {report['retries']}, lỗi {report['failed']}, quá giờ {report['timed_out']}, bỏ trống {len(empty)})")
+
+            redis_client = getattr(current_app, 'redis_client', None)
+            if redis_client:
                 try:
-                    print(f"--- Đang chấm cho User: {user_code} (Session: {sid}) ---")
-                    
-                    # Sử dụng logic AI Essay Grade có sẵn trong Service của sếp
-                    grade_result = self._ai_grade_essay(question, standard_ans, user_ans)
-                    
-                    score = grade_result.get('score', 0)
-                    feedback = grade_result.get('feedback', 'Đã chấm điểm tự động.')
-
-                    # Phân định thưởng: >= 50đ tính là Đúng (50 XP), ngược lại là Tham gia (10 XP)
-                    # Phân định thưởng: >= 50đ tính là Đúng (50 XP), ngược lại là Tham gia (10 XP)
-                    is_correct = 1 if score >= 50 else 0
-                    xp_reward = 50 if is_correct else 10
-                    
-                    # CẬP NHẬT DATABASE (Khớp các cột AIScore, AIFeedback, IsCorrect trong SSMS)
-                    # [SỬA]: Thêm cột EarnedXP vào lệnh UPDATE
-                    try:
-                        sql_update = """
-                            UPDATE TRAINING_DAILY_SESSION 
-                            SET AIScore = ?, AIFeedback = ?, Status = 'COMPLETED', IsCorrect = ?, EarnedXP = ?
-                            WHERE SessionID = ?
-                        """
-                        self.db.execute_non_query(sql_update, (score, feedback, is_correct, xp_reward, sid))
-                    except Exception as e:
-                        print(f"⚠️ Chưa tạo cột EarnedXP trong DB. Bỏ qua ghi nhận XP vào Session: {e}")
-                        sql_update = """
-                            UPDATE TRAINING_DAILY_SESSION 
-                            SET AIScore = ?, AIFeedback = ?, Status = 'COMPLETED', IsCorrect = ?
-                            WHERE SessionID = ?
-                        """
-                        self.db.execute_non_query(sql_update, (score, feedback, is_correct, sid))
-
-                    # CỘNG XP VÀO HỆ THỐNG GAMIFICATION
-                    self.gamification.add_xp(user_code, xp_reward, f"Hoàn thành Daily Challenge #{sid}")
-                    
-                    # GỬI THÔNG BÁO VÀO HÒM THƯ (MAILBOX)
-                    title = "🎉 Kết quả Thử thách Daily" if is_correct else "📝 Phản hồi Thử thách Daily"
-                    msg = f"Điểm của sếp: <b>{score}/100</b>. <br>Nhận xét từ AI: {feedback}"
-                    
-                    sql_mail = """
-                        INSERT INTO TitanOS_Game_Mailbox (UserCode, Title, Content, Total_XP, IsClaimed, CreatedTime)
-                        VALUES (?, ?, ?, ?, 0, GETDATE())
-                    """
-                    self.db.execute_non_query(sql_mail, (user_code, title, msg, xp_reward))
-                    
-                    print(f"✅ Session {sid}: {score} điểm -> Thưởng {xp_reward} XP")
-
-                except Exception as e:
-                    print(f"❌ Lỗi AI chấm điểm Session {sid}: {e}")
-                    continue
+                    redis_client.set(GRADING_REPORT_KEY, json.dumps(dict(report, finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
+                except Exception:
+                    pass
+            return report
 
         except Exception as e:
             print(f"❌ Lỗi SQL process_pending_grading: {e}")
+            return None
 
-    
     def request_teaching(self, user_code, material_id):
         try:
             # 1. Kiểm tra hạn mức tuần
@@ -0,0 +1,142 @@
+# services/user_cache.py
+# --- CACHE DỮ LIỆU THEO USER (REDIS) ---
+# Các service đọc dữ liệu "ít đổi" của user (Level, Nickname, Pet, Inventory...)
+# cache theo UserCode tại đây. Mọi chỗ GHI vào UserStats / UserProfile / UserInventory
+# phải gọi invalidate_user_cache(user_code) để dữ liệu mới có hiệu lực ngay.
+
+from flask import current_app
+from collections import OrderedDict
+import threading
+import time
+import json
+
+# Prefix key -> TTL (giây)
+CHAT_CONTEXT_PREFIX = 'chat_ctx'
+CHAT_CONTEXT_TTL = 600
+USER_CONTEXT_PREFIX = 'user_ctx'   # Dữ liệu "chrome" của mọi trang (inject_user)
+USER_CONTEXT_TTL = 300
+USER_CONTEXT_LOCAL_TTL = 15        # Tầng RAM: ngắn để giới hạn độ trễ khi process khác invalidate
+
+# Danh sách prefix sẽ bị xóa khi dữ liệu user thay đổi
+USER_CACHE_PREFIXES = [CHAT_CONTEXT_PREFIX, USER_CONTEXT_PREFIX]
+
+# Tầng LRU trong process đứng trước Redis: key -> (hết hạn lúc, dữ liệu)
+LOCAL_CACHE_MAX = 1000
+_local_cache = OrderedDict()
+_local_lock = threading.Lock()
+
+def _get_redis():
+    try:
+        return getattr(current_app, 'redis_client', None)
+    except RuntimeError:  # Ngoài app_context (job chạy nền)
+        return None
+
+def _key(prefix, user_code):
+    return f"{prefix}:{user_code}"
+
+def _get_local(key):
+    with _local_lock:
+        entry = _local_cache.get(key)
+        if not entry: return None
+        if entry[0] < time.monotonic():
+            del _local_cache[key]
+            return None
+        _local_cache.move_to_end(key)
+        return entry[1]
+
+def _set_local(key, data, ttl):
+    with _local_lock:
+        _local_cache[key] = (time.monotonic() + ttl, data)
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > LOCAL_CACHE_MAX:
+            _local_cache.popitem(last=False)
+
+def get_user_cache(prefix, user_code, local_ttl=None):
+    """
+    Đọc cache JSON của user. Không có Redis / lỗi -> None.
+    local_ttl: bật tầng LRU trong RAM (đọc RAM trước, Redis sau).
+    """
+    if not user_code:
+        return None
+    key = _key(prefix, user_code)
+    if local_ttl:
+        data = _get_local(key)
+        if data is not None:
+            return data
+
+    redis_client = _get_redis()
+    if not redis_client:
+        return None
+    try:
+        raw = redis_client.get(key)
+        data = json.loads(raw) if raw else None
+        if data is not None and local_ttl:
+            _set_local(key, data, local_ttl)
+        return data
+    except Exception as e:
+        current_app.logger.warning(f"Lỗi đọc user cache {prefix}: {e}")
+        return None
+
+def set_user_cache(prefix, user_code, data, ttl, local_ttl=None):
+    if not user_code:
+        return
+    key = _key(prefix, user_code)
+    if local_ttl:
+        _set_local(key, data, local_ttl)
+    redis_client = _get_redis()
+    if not redis_client:
+        return
+    try:
+        redis_client.setex(key, ttl, json.dumps(data, ensure_ascii=False, default=str))
+    except Exception as e:
+        current_app.logger.warning(f"Lỗi ghi user cache {prefix}: {e}")
+
+def invalidate_user_cache(user_code):
+    """Xóa toàn bộ cache của 1 user (gọi sau khi mua/trang bị đồ, đổi tên, nhận thưởng...)."""
+    if not user_code:
+        return
+    keys = [_key(p, user_code) for p in USER_CACHE_PREFIXES]
+    with _local_lock:
+        for key in keys:
+            _local_cache.pop(key, None)
+
+    redis_client = _get_redis()
+    if not redis_client:
+        return
+    try:
+        redis_client.delete(*keys)
+    except Exception as e:
+        current_app.logger.warning(f"Lỗi xóa user cache {user_code}: {e}")
+
+# =========================================================================
+# PHIÊN BẢN THÔNG TIN ĐĂNG NHẬP (CREDENTIAL VERSION)
+# login_required chỉ so mật khẩu với SQL định kỳ; giữa các lần đó chỉ so version.
+# Đổi / reset mật khẩu, xóa user -> bump version -> mọi phiên cũ bị kiểm tra lại ngay.
+# =========================================================================
+CREDENTIAL_VERSION_PREFIX = 'cred_ver'
+CREDENTIAL_RECHECK_SECONDS = 60  # Tối đa bao lâu thì so lại mật khẩu với DB
+
+_local_cred_versions = {}  # Fallback khi không có Redis (waitress chạy 1 process)
+
+def get_credential_version(user_code):
+    redis_client = _get_redis()
+    if redis_client:
+        try:
+            return int(redis_client.get(_key(CREDENTIAL_VERSION_PREFIX, user_code)) or 0)
+        except Exception:
+            pass
+    return _local_cred_versions.get(user_code, 0)
+
+def bump_credential_version(user_code):
+    """Gọi sau mọi thay đổi mật khẩu / xóa user."""
+    if not user_code:
+        return
+    with _local_lock:
+        _local_cred_versions[user_code] = _local_cred_versions.get(user_code, 0) + 1
+    redis_client = _get_redis()
+    if not redis_client:
+        return
+    try:
+        redis_client.incr(_key(CREDENTIAL_VERSION_PREFIX, user_code))
+    except Exception as e:
+        current_app.logger.warning(f"Lỗi bump credential version {user_code}: {e}")
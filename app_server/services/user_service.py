@@ -3,6 +3,10 @@ import config
 import os
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from services.user_cache import (
+    invalidate_user_cache, get_user_cache, set_user_cache, bump_credential_version,
+    USER_CONTEXT_PREFIX, USER_CONTEXT_TTL, USER_CONTEXT_LOCAL_TTL
+)
 
 class UserService:
     def __init__(self, db_manager):
@@ -91,6 +95,8 @@ class UserService:
                 self.db.execute_non_query(f"DELETE FROM {t} WHERE UserCode=?", (user_code,))
             
             self.db.execute_non_query(f"DELETE FROM {config.TEN_BANG_NGUOI_DUNG} WHERE USERCODE = ?", (user_code,))
+            invalidate_user_cache(user_code)
+            bump_credential_version(user_code)
             return {'success': True, 'message': 'Đã xóa nhân viên.'}
         except Exception as e:
             return {'success': False, 'message': str(e)}
@@ -98,6 +104,7 @@ class UserService:
     def admin_reset_password(self, user_code, new_pass):
         try:
             self.db.execute_non_query(f"UPDATE {config.TEN_BANG_NGUOI_DUNG} SET PASSWORD = ? WHERE USERCODE = ?", (new_pass, user_code))
+            bump_credential_version(user_code)  # Đá mọi phiên đang mở của user ngay lập tức
             return {'success': True, 'message': 'Đã reset mật khẩu.'}
         except Exception as e:
             return {'success': False, 'message': str(e)}
@@ -216,6 +223,28 @@ class UserService:
 
         return user_profile
 
+    def get_user_context(self, user_code):
+        """
+        Dữ liệu "chrome" hiển thị trên mọi trang (inject_user): Profile + Theme đã mở khóa.
+        Cache RAM (15s) -> Redis (5 phút); bị xóa qua invalidate_user_cache khi XP/Coin/Theme/Pet/Nickname/Inventory đổi.
+        """
+        ctx = get_user_cache(USER_CONTEXT_PREFIX, user_code, local_ttl=USER_CONTEXT_LOCAL_TTL)
+        if ctx is not None:
+            return ctx
+
+        profile = self.get_user_profile(user_code)
+
+        # Theme đã mở khóa (Query trực tiếp bảng Inventory vì get_user_profile không trả inventory)
+        inv_data = self.db.get_data("SELECT ItemCode FROM TitanOS_UserInventory WHERE UserCode = ?", (user_code,))
+        owned_items = {row['ItemCode'] for row in inv_data} if inv_data else set()
+        # Chỉ lọc lấy các item là theme để đưa vào switcher
+        unlocked_themes = [t for t in ['dark', 'fantasy', 'adorable'] if t in owned_items]
+
+        ctx = {'profile': profile, 'unlocked_themes': unlocked_themes}
+        if profile:  # Không cache khi lỗi DB / user không tồn tại
+            set_user_cache(USER_CONTEXT_PREFIX, user_code, ctx, USER_CONTEXT_TTL, local_ttl=USER_CONTEXT_LOCAL_TTL)
+        return ctx
+
     def update_user_theme_preference(self, user_code, theme_code):
         """Cập nhật theme vào bảng UserProfile (cột EquippedTheme)."""
         # Kiểm tra tồn tại
@@ -223,6 +252,7 @@ class UserService:
              self.db.execute_non_query("INSERT INTO TitanOS_UserProfile (UserCode, EquippedTheme) VALUES (?, ?)", (user_code, theme_code))
         else:
              self.db.execute_non_query("UPDATE TitanOS_UserProfile SET EquippedTheme = ? WHERE UserCode = ?", (theme_code, user_code))
+        invalidate_user_cache(user_code)
         return True
 
     def update_avatar(self, user_code, file):
@@ -241,6 +271,7 @@ class UserService:
                 self.db.execute_non_query("UPDATE TitanOS_UserProfile SET AvatarUrl=? WHERE UserCode=?", (db_url, user_code))
             else:
                 self.db.execute_non_query("INSERT INTO TitanOS_UserProfile (UserCode, AvatarUrl, EquippedTheme) VALUES (?, ?, 'light')", (user_code, db_url))
+            invalidate_user_cache(user_code)
             return {'success': True, 'url': db_url}
         except Exception as e:
             return {'success': False, 'message': str(e)}
@@ -268,6 +299,7 @@ class UserService:
         try:
             self.db.execute_non_query("UPDATE TitanOS_UserStats SET TotalCoins = TotalCoins - ? WHERE UserCode = ?", (price, user_code))
             self.db.execute_non_query("INSERT INTO TitanOS_UserInventory (UserCode, ItemCode, AcquiredDate, IsActive) VALUES (?, ?, GETDATE(), 1)", (user_code, item_code))
+            invalidate_user_cache(user_code)
             return {'success': True, 'message': f'Mua thành công "{item_name}"!'}
         except Exception as e:
             return {'success': False, 'message': str(e)}
@@ -296,6 +328,7 @@ class UserService:
                 self.db.execute_non_query("INSERT INTO TitanOS_UserProfile (UserCode, IsFlexing, EquippedTheme) VALUES (?, 1, 'light')", (user_code,))
             
             self.db.execute_non_query(f"UPDATE TitanOS_UserProfile SET {target_col} = ?, IsFlexing = 1 WHERE UserCode = ?", (item_code, user_code))
+            invalidate_user_cache(user_code)
             return {'success': True, 'message': 'Đã trang bị!'}
         
         return {'success': True, 'message': 'Đã kích hoạt!'}
@@ -325,6 +358,7 @@ class UserService:
             cursor.execute("DELETE FROM TitanOS_UserInventory WHERE ID = ?", (item_id,))
             
             conn.commit()
+            invalidate_user_cache(user_code)
             return {'success': True, 'message': f'Đã đổi tên thành công sang: "{new_nickname}"'}
         except Exception as e:
             if conn: conn.rollback()
@@ -343,6 +377,7 @@ class UserService:
             return {'success': False, 'message': 'Mật khẩu cũ không đúng!'}
         try:
             self.db.execute_non_query(f"UPDATE {config.TEN_BANG_NGUOI_DUNG} SET PASSWORD = ? WHERE USERCODE = ?", (new_pass, user_code))
+            bump_credential_version(user_code)
             return {'success': True, 'message': 'Đổi mật khẩu thành công!'}
         except Exception as e:
             return {'success': False, 'message': str(e)}
\ No newline at end of file
@@ -11,7 +11,8 @@ let taskConfig = {
     baseUrl: '/task_dashboard', 
     viewMode: 'USER',
     activeFilter: 'ALL',
-    searchTerm: ''
+    searchTerm: '',
+    streamPort: ''
 };
 
 let taskManagerInstance = null;
@@ -124,6 +125,7 @@ document.addEventListener('DOMContentLoaded', function() {
         taskConfig.viewMode = contextEl.dataset.viewMode || 'USER';
         taskConfig.activeFilter = contextEl.dataset.activeFilter || 'ALL';
         taskConfig.searchTerm = contextEl.dataset.searchTerm || '';
+        taskConfig.streamPort = contextEl.dataset.streamPort || '';
 
     } catch(e) {
         console.error("Lỗi khởi tạo cấu hình Task:", e);
@@ -148,7 +150,7 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    startPolling();
+    startTaskStream();
     // [BỔ SUNG] Tự động set 100% khi chọn Hoàn thành
     $('#log_type_select').on('change', function() {
         if ($(this).val() === 'REQUEST_CLOSE') {
@@ -366,20 +368,73 @@ window.selectClient = function(dropdownId, inputId, hiddenId) {
      }
 }
 
+function markTaskUpdated(taskId) {
+    let card = document.querySelector(`.task-card[onclick*="${taskId}"]`) || document.querySelector(`tr[data-task-id="${taskId}"] td`);
+    if (card && !card.querySelector('.new-update-marker')) {
+        const marker = document.createElement('div'); marker.className = 'new-update-marker';
+        if (card.tagName === 'TD') card.style.position = 'relative';
+        card.appendChild(marker);
+    }
+}
+
 function checkRecentUpdates() {
     fetch(`/api/task/recent_updates?view=${taskConfig.viewMode}&minutes=15`)
         .then(r => r.json()).then(updatedTasks => {
             document.querySelectorAll('.new-update-marker').forEach(m => m.remove());
             if (updatedTasks && updatedTasks.length > 0) {
-                updatedTasks.forEach(task => {
-                    let card = document.querySelector(`.task-card[onclick*="${task.TaskID}"]`) || document.querySelector(`tr[data-task-id="${task.TaskID}"] td`);
-                    if (card) {
-                        const marker = document.createElement('div'); marker.className = 'new-update-marker';
-                        if (card.tagName === 'TD') card.style.position = 'relative';
-                        card.appendChild(marker);
-                    }
-                });
+                updatedTasks.forEach(task => markTaskUpdated(task.TaskID));
             }
         }).catch(console.error);
 }
-function startPolling() { checkRecentUpdates(); setInterval(checkRecentUpdates, 15 * 60 * 1000); }
\ No newline at end of file
+
+let pollingTimer = null;
+function startPolling() {
+    if (pollingTimer) return;
+    checkRecentUpdates(); pollingTimer = setInterval(checkRecentUpdates, 15 * 60 * 1000);
+}
+
+function stopPolling() {
+    if (!pollingTimer) return;
+    clearInterval(pollingTimer); pollingTimer = null;
+}
+
+// Kênh đẩy SSE: server báo khi có Task thay đổi -> tab đứng yên không tốn query.
+// SSE chạy trên server riêng (cổng data-stream-port, cùng hostname).
+// Server từ chối / hết suất (503) -> poll tạm, mở lại SSE sau backoff có jitter; mở lại được thì thôi poll.
+const STREAM_RETRY_MIN = 5 * 1000;
+const STREAM_RETRY_MAX = 5 * 60 * 1000;
+let streamRetryDelay = 0;
+
+function taskStreamUrl() {
+    const origin = taskConfig.streamPort ? `${location.protocol}//${location.hostname}:${taskConfig.streamPort}` : '';
+    return `${origin}/api/task/stream?view=${encodeURIComponent(taskConfig.viewMode)}`;
+}
+
+function startTaskStream() {
+    if (!window.EventSource) { startPolling(); return; }
+    checkRecentUpdates(); // Đánh dấu các cập nhật xảy ra trước khi mở trang
+    openTaskStream();
+}
+
+function openTaskStream() {
+    const source = new EventSource(taskStreamUrl(), { withCredentials: true });
+    source.onopen = function() {
+        if (pollingTimer) { stopPolling(); checkRecentUpdates(); } // Bù các cập nhật trong lúc mất SSE
+        streamRetryDelay = 0;
+    };
+    source.onmessage = function(e) {
+        try {
+            const evt = JSON.parse(e.data);
+            if (evt.task_id) markTaskUpdated(evt.task_id);
+        } catch (err) { console.error(err); }
+    };
+    source.onerror = function() {
+        // CONNECTING = trình duyệt đang tự thử lại; CLOSED = server trả lỗi, trình duyệt bỏ cuộc -> tự mở lại
+        if (source.readyState !== EventSource.CLOSED) return;
+        source.close();
+        startPolling();
+        streamRetryDelay = Math.min(STREAM_RETRY_MAX, streamRetryDelay ? streamRetryDelay * 2 : STREAM_RETRY_MIN);
+        // Jitter 50-100%: các tab bị từ chối cùng lúc không kết nối lại cùng lúc
+        setTimeout(openTaskStream, streamRetryDelay * (0.5 + Math.random() / 2));
+    };
+}
@@ -3,8 +3,10 @@ from flask import session, redirect, url_for, flash, request, current_app, jsoni
 from functools import wraps
 import config
 import os
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from services.user_cache import get_credential_version, CREDENTIAL_RECHECK_SECONDS
 
 
 # --- [BỔ SUNG HÀM NÀY] ---
@@ -37,15 +39,21 @@ def login_required(f):
         
         if user_code and security_hash:
             try:
-                db = current_app.db_manager
-                # Sử dụng tham số binding để tránh SQL Injection
-                query = f"SELECT [PASSWORD] FROM {config.TEN_BANG_NGUOI_DUNG} WHERE USERCODE = ?"
-                data = db.get_data(query, (user_code,))
-                
-                if not data or data[0]['PASSWORD'] != security_hash:
-                    session.clear()
-                    flash("Phiên đăng nhập hết hạn.", "warning")
-                    return redirect(url_for('login'))
+                # Đã so mật khẩu gần đây + version chưa bị bump (đổi/reset mật khẩu) -> bỏ qua SQL
+                cred_version = get_credential_version(user_code)
+                checked_at = session.get('cred_checked_at', 0)
+                if session.get('cred_version') != cred_version or time.time() - checked_at > CREDENTIAL_RECHECK_SECONDS:
+                    db = current_app.db_manager
+                    # Sử dụng tham số binding để tránh SQL Injection
+                    query = f"SELECT [PASSWORD] FROM {config.TEN_BANG_NGUOI_DUNG} WHERE USERCODE = ?"
+                    data = db.get_data(query, (user_code,))
+                    
+                    if not data or data[0]['PASSWORD'] != security_hash:
+                        session.clear()
+                        flash("Phiên đăng nhập hết hạn.", "warning")
+                        return redirect(url_for('login'))
+                    session['cred_version'] = cred_version
+                    session['cred_checked_at'] = time.time()
             except Exception:
                 pass 
                 